@@ -4,9 +4,17 @@ import math
 import os
 import yaml
 import re
+import time
+import threading
 import requests
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 from ansible.module_utils.basic import *
+from ansible.module_utils.route_set import RouteSetWriter, load_route_set, route_set_key
 
 DOCUMENTATION = '''
 module:  announce_routes
@@ -22,6 +30,19 @@ Options:
     - option-name: ptf_ip
       description: PTF container management IP address
       required: True
+
+    - option-name: chunk_size
+      description: number of routes sent to exabgp in one request
+      required: False
+
+    - option-name: concurrency
+      description: number of exabgp processes the routes are announced to at the same time
+      required: False
+
+    - option-name: route_set_dir
+      description: folder of the route set files, the routes of a topology are generated once and saved in it.
+          Empty to generate the routes on every run
+      required: False
 '''
 
 EXAMPLES = '''
@@ -48,6 +69,13 @@ TOR_ASN_START = 65500
 IPV4_BASE_PORT = 5000
 IPV6_BASE_PORT = 6000
 
+CHUNK_SIZE = 5000
+CONCURRENCY = 16
+
+ROUTE_SET_DIR = '/tmp/route_sets'
+# Increase when the generated routes change, so the saved route sets are not used
+ROUTE_SET_VERSION = 1
+
 
 def get_topo_type(topo_name):
     pattern = re.compile(r'^(t0|t1|ptf|fullmesh|dualtor|t2)')
@@ -70,18 +98,126 @@ def read_topo(topo_name):
         return {}
 
 
-def announce_routes(ptf_ip, port, routes):
-    messages = []
+def route_messages(routes):
     for prefix, nexthop, aspath in routes:
         if aspath:
-            messages.append("announce route {} next-hop {} as-path [ {} ]".format(prefix, nexthop, aspath))
+            yield "announce route {} next-hop {} as-path [ {} ]".format(prefix, nexthop, aspath)
         else:
-            messages.append("announce route {} next-hop {}".format(prefix, nexthop))
-
+            yield "announce route {} next-hop {}".format(prefix, nexthop)
+
+
+def chunks(messages, chunk_size):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def announce_routes(ptf_ip, port, routes, chunk_size=CHUNK_SIZE, session=None):
+    """
+    Announce the routes to the exabgp process listening on the port in chunks.
+    The chunks are posted to the bulk API of exabgp, which writes them to exabgp
+    while they are received, falling back to the form API of older exabgp processes.
+    Returns the number of routes announced.
+    """
+    session = session or requests.Session()
     url = "http://%s:%d" % (ptf_ip, port)
-    data = { "commands": ";".join(messages) }
-    r = requests.post(url, data=data)
-    assert r.status_code == 200
+    bulk = True
+    count = 0
+    for chunk in chunks(route_messages(routes), chunk_size):
+        if bulk:
+            r = session.post(url + "/bulk", data="\n".join(chunk))
+            if r.status_code == 404:
+                bulk = False
+        if not bulk:
+            r = session.post(url, data={ "commands": ";".join(chunk) })
+        assert r.status_code == 200
+        count += len(chunk)
+    return count
+
+
+class RouteAnnouncer(object):
+    """
+    Announce the routes to the exabgp processes concurrently.
+    The routes of a port are announced in the order they are added, the messages
+    are formatted by the worker announcing them so they are never all in memory.
+    """
+
+    def __init__(self, ptf_ip, chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY, log=None):
+        self.ptf_ip = ptf_ip
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.log = log
+        self.jobs = {}
+        self.ports = []
+        self.stats = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def add(self, port, routes):
+        if port not in self.jobs:
+            self.jobs[port] = []
+            self.ports.append(port)
+        self.jobs[port].append(routes)
+
+    def announce_port(self, port):
+        start = time.time()
+        session = requests.Session()
+        count = 0
+        for routes in self.jobs[port]:
+            count += announce_routes(self.ptf_ip, port, routes, self.chunk_size, session)
+        elapsed = time.time() - start
+        with self.lock:
+            self.stats[port] = (count, elapsed)
+            done = len(self.stats)
+        if self.log:
+            self.log("announced %d routes to port %d in %.2f seconds (%d/%d ports)" %
+                     (count, port, elapsed, done, len(self.ports)))
+
+    def worker(self, pending):
+        while True:
+            try:
+                port = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.announce_port(port)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append("port %d: %s" % (port, repr(e)))
+
+    def run(self):
+        """
+        Announce all the routes added and return the statistics.
+        Raises an exception when announcing to any port failed.
+        """
+        start = time.time()
+        pending = queue.Queue()
+        for port in self.ports:
+            pending.put(port)
+        threads = []
+        for _ in range(max(1, min(self.concurrency, len(self.ports)))):
+            thread = threading.Thread(target=self.worker, args=(pending,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise Exception("Failed to announce routes: {}".format(", ".join(self.errors)))
+
+        elapsed = time.time() - start
+        routes = sum([count for count, _ in self.stats.values()])
+        return {
+            "routes": routes,
+            "ports": len(self.stats),
+            "elapsed": round(elapsed, 2),
+            "rate": int(routes / elapsed) if elapsed else routes
+        }
 
 # AS path from Leaf router for T0 topology
 def get_leaf_uplink_as_path(spine_asn):
@@ -116,15 +252,22 @@ def generate_routes(family, podset_number, tor_number, tor_subnet_number,
                     nexthop, nexthop_v6,
                     tor_subnet_size, max_tor_subnet_number, topo,
                     router_type = "leaf", tor_index=None, set_num=None):
-    routes = []
+    """
+    Generator of the (prefix, nexthop, aspath) routes announced by a VM
+    """
     if router_type != "tor":
         default_route_as_path = get_uplink_router_as_path(router_type, spine_asn)
 
         if topo != "t2" or (topo == "t2" and router_type == "core"):
             if family in ["v4", "both"]:
-                routes.append(("0.0.0.0/0", nexthop, default_route_as_path))
+                yield ("0.0.0.0/0", nexthop, default_route_as_path)
             if family in ["v6", "both"]:
-                routes.append(("::/0", nexthop_v6, default_route_as_path))
+                yield ("::/0", nexthop_v6, default_route_as_path)
+
+    # First 3 pods are advertised from T1 - so remove 3 from the total pods being advertised by T3
+    first_third_podset_number = int(math.ceil((podset_number - 3) / 3.0))
+    second_third_podset_number = int(math.ceil(((podset_number - 3) * 2) / 3.0))
+    prefixlen_v4 = (32 - int(math.log(tor_subnet_size, 2)))
 
     # NOTE: Using large enough values (e.g., podset_number = 200,
     # us to overflow the 192.168.0.0/16 private address space here.
@@ -137,10 +280,6 @@ def generate_routes(family, podset_number, tor_number, tor_subnet_number,
                     if podset < 3:
                         continue
 
-                    # First 3 pods are advertised from T1 - so remove 3 from the total pods being advertised by T3
-                    first_third_podset_number = int(math.ceil((podset_number - 3) / 3.0))
-                    second_third_podset_number = int(math.ceil(((podset_number - 3) * 2) / 3.0))
-
                     if set_num is not None:
                         # For T2, we have 3 sets - 1 set advertises first 1/3 podsets, second set advertises second 1/3 podsets, and all VM's advertises the last 1/3 podsets
                         if podset <= first_third_podset_number and set_num != 0:
@@ -177,12 +316,11 @@ def generate_routes(family, podset_number, tor_number, tor_subnet_number,
                 suffix = ( (podset * tor_number * max_tor_subnet_number * tor_subnet_size) + \
                       (tor * max_tor_subnet_number * tor_subnet_size) + \
                       (subnet * tor_subnet_size) )
-                octet2 = (168 + (suffix / (256 ** 2)))
-                octet1 = (192 + (octet2 / 256))
+                octet2 = (168 + (suffix // (256 ** 2)))
+                octet1 = (192 + (octet2 // 256))
                 octet2 = (octet2 % 256)
-                octet3 = ((suffix / 256) % 256)
+                octet3 = ((suffix // 256) % 256)
                 octet4 = (suffix % 256)
-                prefixlen_v4 = (32 - int(math.log(tor_subnet_size, 2)))
 
                 prefix = "{}.{}.{}.{}/{}".format(octet1, octet2, octet3, octet4, prefixlen_v4)
                 prefix_v6 = "20%02X:%02X%02X:0:%02X::/64" % (octet1, octet2, octet3, octet4)
@@ -205,14 +343,12 @@ def generate_routes(family, podset_number, tor_number, tor_subnet_number,
                             aspath = "{} {} {}".format(spine_asn, leaf_asn, tor_asn)
 
                 if family in ["v4", "both"]:
-                    routes.append((prefix, nexthop, aspath))
+                    yield (prefix, nexthop, aspath)
                 if family in ["v6", "both"]:
-                    routes.append((prefix_v6, nexthop_v6, aspath))
-
-    return routes
+                    yield (prefix_v6, nexthop_v6, aspath)
 
 
-def fib_t0(topo, ptf_ip):
+def fib_t0(topo, announcer):
 
     common_config = topo['configuration_properties'].get('common', {})
     podset_number = common_config.get("podset_number", PODSET_NUMBER)
@@ -239,11 +375,11 @@ def fib_t0(topo, ptf_ip):
                                     spine_asn, leaf_asn_start, tor_asn_start,
                                     nhipv6, nhipv6, tor_subnet_size, max_tor_subnet_number, "t0")
 
-        announce_routes(ptf_ip, port, routes_v4)
-        announce_routes(ptf_ip, port6, routes_v6)
+        announcer.add(port, routes_v4)
+        announcer.add(port6, routes_v6)
 
 
-def fib_t1_lag(topo, ptf_ip):
+def fib_t1_lag(topo, announcer):
 
     common_config = topo['configuration_properties'].get('common', {})
     podset_number = common_config.get("podset_number", PODSET_NUMBER)
@@ -280,14 +416,14 @@ def fib_t1_lag(topo, ptf_ip):
                                         None, leaf_asn_start, tor_asn_start,
                                         nhipv4, nhipv6, tor_subnet_size, max_tor_subnet_number, "t1",
                                         router_type=router_type, tor_index=tor_index)
-            announce_routes(ptf_ip, port, routes_v4)
-            announce_routes(ptf_ip, port6, routes_v6)
+            announcer.add(port, routes_v4)
+            announcer.add(port6, routes_v6)
 
         if 'vips' in v:
             routes_vips = []
             for prefix in v["vips"]["ipv4"]["prefixes"]:
                 routes_vips.append((prefix, nhipv4, v["vips"]["ipv4"]["asn"]))
-            announce_routes(ptf_ip, port, routes_vips)
+            announcer.add(port, routes_vips)
 
 
 """
@@ -319,7 +455,7 @@ We would have the following distribution:
    - 193.177.xx.xx - 194.55.xx.xx (4K routes) from all 24 T3 VM's on linecard1 (VM1-VM24)
    - default route from all 24 T3 VM's on linecard1 (VM1-VM24)
 """
-def fib_t2_lag(topo, ptf_ip):
+def fib_t2_lag(topo, announcer):
 
     vms = topo['topology']['VMs']
     # T1 VMs per linecard(asic) - key is the dut index, and value is a list of T1 VMs
@@ -339,10 +475,10 @@ def fib_t2_lag(topo, ptf_ip):
             if dut_index not in t3_vms:
                 t3_vms[dut_index] = list()
             t3_vms[dut_index].append(key)
-    generate_t2_routes(t1_vms, topo, ptf_ip)
-    generate_t2_routes(t3_vms, topo, ptf_ip)
+    generate_t2_routes(t1_vms, topo, announcer)
+    generate_t2_routes(t3_vms, topo, announcer)
 
-def generate_t2_routes(dut_vm_dict, topo, ptf_ip):
+def generate_t2_routes(dut_vm_dict, topo, announcer):
     common_config = topo['configuration_properties'].get('common', {})
     vms = topo['topology']['VMs']
     vms_config = topo['configuration']
@@ -393,14 +529,55 @@ def generate_t2_routes(dut_vm_dict, topo, ptf_ip):
                                             common_config['dut_asn'], leaf_asn_start, tor_asn_start,
                                             nhipv4, nhipv6, tor_subnet_size, max_tor_subnet_number, "t2",
                                             router_type=router_type, tor_index=tor_index, set_num=set_num)
-                announce_routes(ptf_ip, port, routes_v4)
-                announce_routes(ptf_ip, port6, routes_v6)
+                announcer.add(port, routes_v4)
+                announcer.add(port6, routes_v6)
 
                 if 'vips' in vms_config[a_vm]:
                     routes_vips = []
                     for prefix in vms_config[a_vm]["vips"]["ipv4"]["prefixes"]:
                         routes_vips.append((prefix, nhipv4, vms_config[a_vm]["vips"]["ipv4"]["asn"]))
-                    announce_routes(ptf_ip, port, routes_vips)
+                    announcer.add(port, routes_vips)
+
+
+def get_ptf_ports(vm):
+    # vlans are the PTF port indices, or <dut index>.<dut port>@<ptf port> for multi-DUT topologies
+    ptf_ports = []
+    for vlan in vm.get('vlans', []):
+        ptf_ports.append(int(str(vlan).split('@')[-1]))
+    return ptf_ports
+
+
+def add_topo_routes(topo, topo_type, announcer):
+    """
+    Add the routes of the topology to the announcer, or to the RouteSetWriter
+    """
+    if topo_type == "t0":
+        fib_t0(topo, announcer)
+    elif topo_type == "t1":
+        fib_t1_lag(topo, announcer)
+    else:
+        fib_t2_lag(topo, announcer)
+
+
+def write_route_set(topo, topo_type, path):
+    """
+    Generate the routes of the topology with the PTF ports of the exabgp ports into the route set file
+    """
+    writer = RouteSetWriter()
+    add_topo_routes(topo, topo_type, writer)
+    for vm in topo['topology']['VMs'].values():
+        ptf_ports = get_ptf_ports(vm)
+        writer.set_port_group(IPV4_BASE_PORT + vm['vm_offset'], ptf_ports)
+        writer.set_port_group(IPV6_BASE_PORT + vm['vm_offset'], ptf_ports)
+    writer.write(path)
+
+
+def get_route_set_path(route_set_dir, topo_name, topo):
+    key = route_set_key(ROUTE_SET_VERSION, topo_name,
+                        topo.get('configuration_properties'),
+                        topo['topology'].get('VMs'),
+                        topo.get('configuration'))
+    return os.path.join(route_set_dir, "{}-{}.rset".format(topo_name, key))
 
 
 def main():
@@ -408,7 +585,10 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             topo_name=dict(required=True, type='str'),
-            ptf_ip=dict(required=True, type='str')
+            ptf_ip=dict(required=True, type='str'),
+            chunk_size=dict(required=False, type='int', default=CHUNK_SIZE),
+            concurrency=dict(required=False, type='int', default=CONCURRENCY),
+            route_set_dir=dict(required=False, type='str', default=ROUTE_SET_DIR)
         ),
         supports_check_mode=False)
 
@@ -420,16 +600,37 @@ def main():
         module.fail_json(msg='Unable to load topology "{}"'.format(topo_name))
 
     topo_type = get_topo_type(topo_name)
-
-    if topo_type == "t0":
-        fib_t0(topo, ptf_ip)
-        module.exit_json(changed=True)
-    elif topo_type == "t1":
-        fib_t1_lag(topo, ptf_ip)
-        module.exit_json(changed=True)
-    elif topo_type == "t2":
-        fib_t2_lag(topo, ptf_ip)
-        module.exit_json(changed=True)
+    announcer = RouteAnnouncer(ptf_ip, module.params['chunk_size'], module.params['concurrency'], module.log)
+
+    if topo_type in ["t0", "t1", "t2"]:
+        route_set_dir = module.params['route_set_dir']
+        route_set_path = None
+        route_set = None
+        route_set_cached = False
+        if route_set_dir:
+            route_set_path = get_route_set_path(route_set_dir, topo_name, topo)
+            route_set = load_route_set(route_set_path)
+            route_set_cached = route_set is not None
+            if not route_set_cached:
+                try:
+                    write_route_set(topo, topo_type, route_set_path)
+                    route_set = load_route_set(route_set_path)
+                except (IOError, OSError) as e:
+                    module.warn("Unable to save route set {}: {}".format(route_set_path, str(e)))
+                    route_set_path = None
+
+        if route_set is not None:
+            for port in route_set.ports():
+                announcer.add(port, route_set.routes(port))
+        else:
+            # The routes are generated by the workers announcing them
+            add_topo_routes(topo, topo_type, announcer)
+        try:
+            stats = announcer.run()
+        except Exception as e:
+            module.fail_json(msg=str(e))
+        module.exit_json(changed=True, announce_stats=stats,
+                         route_set=route_set_path, route_set_cached=route_set_cached)
     else:
         module.exit_json(msg='Unsupported topology "{}" - skipping announcing routes'.format(topo_name))
 
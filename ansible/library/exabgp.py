@@ -67,6 +67,21 @@ def run_command():
     sys.stdout.flush()
     return "OK\\n"
 
+# Setup a bulk route taking newline separated commands in the request body.
+# The body is streamed to exabgp while it is received, so the sender is slowed
+# down by TCP when exabgp does not read its stdin fast enough.
+@app.route('/bulk', methods=['POST'])
+def run_bulk_command():
+    count = 0
+    for line in request.stream:
+        cmd = line.strip()
+        if not cmd:
+            continue
+        sys.stdout.write("%s\\n" % cmd)
+        count += 1
+    sys.stdout.flush()
+    return "OK %d\\n" % count
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=sys.argv[1])
 '''
@@ -8,6 +8,9 @@ description: The module scans the 'directory' in search of files which filenames
 The found files are ungzipped and combined together in the rotation order. After that all lines after
 'start_string' are copied into a file with name 'target_filename'. All input strings with 'nsible' in it
 aren't considered as 'start_string' to avoid clashing with ansible output.
+Offsets of found 'start_string' are kept in a sidecar index in /tmp keyed by file inode and checked by a fingerprint
+of the file head, so rotated files are not rescanned and only the content appended to the current log file since
+the previous run is searched.
 
 Options:
     - option-name: directory
@@ -30,6 +33,11 @@ Options:
       required: True
       Default: None
 
+    - option-name: compress
+      description: save extracted lines gzip-compressed
+      required: False
+      Default: False
+
 '''
 
 EXAMPLES = '''
@@ -75,29 +83,29 @@ EXAMPLES = '''
 
 import os
 import gzip
+import hashlib
+import json
 import re
+import shutil
 import sys
-from datetime import datetime
 from ansible.module_utils.basic import *
 
 
-def extract_lines(directory, filename, target_string):
-    path = os.path.join(directory, filename)
-    file = None
+# Sidecar index with marker offsets of already scanned log files
+INDEX_DIR = '/tmp'
+BLOCK_SIZE = 1024 * 1024
+# Length of the head of a log file fingerprinted to tell a reused inode from the same file
+HEAD_SIZE = 4096
+
+
+def open_log(path):
     if 'gz' in path:
-        file = gzip.GzipFile(path)
-    else:
-        file = open(path)
-    result = None
-    with file:
-        # This might be a gunzip file or logrotate issue, there has
-        # been '\x00's in front of the log entry timestamp which
-        # messes up with the comparator.
-        # Prehandle lines to remove these sub-strings
-        dt = datetime.datetime.fromtimestamp(os.path.getctime(path))
-        result = [(filename, dt, line.replace('\x00', '')) for line in file if target_string in line and 'nsible' not in line]
+        return gzip.GzipFile(path)
+    return open(path, 'rb')
+
 
-    return result
+def is_start_line(line, target_string):
+    return target_string in line and 'nsible' not in line
 
 
 def extract_number(s):
@@ -109,52 +117,6 @@ def extract_number(s):
         return int(ns[0])
 
 
-def convert_date(fct, s):
-    dt = None
-    re_result = re.findall(r'^\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}\.?\d*', s)
-    # Workaround for pytest-ansible
-    loc = locale.getlocale()
-    locale.setlocale(locale.LC_ALL, (None, None))
-
-    if len(re_result) > 0:
-        str_date = '{:04d} '.format(fct.year) + re_result[0]
-        try:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X.%f')
-        except ValueError:
-            dt = datetime.datetime.strptime(str_date, '%Y %b %d %X')
-        # Handle the wrap around of year (Dec 31 to Jan 1)
-        # Generally, last metadata change time should be larger than generated log message timestamp
-        # but we still perform some wrap around test to avoid the race condition
-        # 183 is the number of days in half year, just a reasonable choice
-        if (dt - fct).days > 183:
-            dt.replace(year = dt.year - 1)
-    else:
-        re_result = re.findall(r'^\d{4}-\d{2}-\d{2}\.\d{2}:\d{2}:\d{2}\.\d{6}', s)
-        str_date = re_result[0]
-        dt = datetime.datetime.strptime(str_date, '%Y-%m-%d.%X.%f')
-    locale.setlocale(locale.LC_ALL, loc)
-
-    return dt
-
-
-def comparator(l, r):
-    nl = extract_number(l[0])
-    nr = extract_number(r[0])
-    if nl == nr:
-        dl = convert_date(l[1], l[2])
-        dr = convert_date(r[1], r[2])
-        if dl == dr:
-            return 0
-        elif dl < dr:
-            return -1
-        else:
-            return 1
-    elif nl > nr:
-        return -1
-    else:
-        return 1
-
-
 def filename_comparator(l, r):
     """Compares log filenames, assumes file with greater number is
     older, e.g syslog.2 is older than syslog.1. This is how logrotate is currently configured.
@@ -180,29 +142,142 @@ def list_files(directory, prefixname):
         if filename.startswith(prefixname)], cmp=filename_comparator)
 
 
-def extract_latest_line_with_string(directory, filenames, start_string):
-    """Extracts latest line with string @start_string. Assumes @filenames are sorted
-    and first file in @filenames is the newest log file"""
-
-    target_lines = []
-    for filename in filenames:
-        extracted_lines = extract_lines(directory, filename, start_string)
-        if extracted_lines:
-            # found lines are the lates since we start from the newest file
-            # assignt to target_lines and break the loop
-            target_lines = extracted_lines
-            break
+def get_index_path(directory, prefixname):
+    return os.path.join(INDEX_DIR, 'extract_log{}.{}.idx'.format(directory.replace('/', '_'), prefixname))
 
-    # find the latest line from traget_lines comparing by date in line
-    target = target_lines[0] if len(target_lines) > 0 else None
-    for line in target_lines:
-        if comparator(line, target) > 0:
-            target = line
 
-    if target is None:
-        raise Exception("{} was not found in {}".format(start_string, directory))
+def load_index(path):
+    """Loads index of log files. Index maps inode of a log file to its size, mtime, fingerprint
+    of its head and found start strings. Inode is used as a key, so the index survives log rotation"""
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_index(path, index):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fp:
+        json.dump(index, fp)
+    os.rename(tmp_path, path)
+
+
+def read_head(path, length):
+    """Returns fingerprint of the first @length bytes of file @path"""
+    with open(path, 'rb') as fp:
+        return hashlib.md5(fp.read(length)).hexdigest()
+
+
+def get_index_entry(index, path):
+    """Returns index entry of the log file, resets the entry if the file was replaced or truncated.
+    Inode can be reused by a new file after rotation, so the entry is kept only if the head of
+    the file is unchanged and the file didn't shrink or go back in time.
+    Compressed files are never appended, so any change of them resets the entry"""
+    stat = os.stat(path)
+    key = str(stat.st_ino)
+    entry = index.get(key)
+    if entry is not None:
+        if stat.st_size < entry['size'] or stat.st_mtime < entry['mtime'] or \
+                entry.get('head') != read_head(path, entry.get('head_len', 0)) or \
+                ('gz' in path and (stat.st_size != entry['size'] or stat.st_mtime != entry['mtime'])):
+            entry = None
+    if entry is None:
+        entry = {'markers': {}}
+        index[key] = entry
+    head_len = min(stat.st_size, HEAD_SIZE)
+    if entry.get('head_len') != head_len:
+        entry.update({'head': read_head(path, head_len), 'head_len': head_len})
+    entry.update({'file': os.path.basename(path), 'size': stat.st_size, 'mtime': stat.st_mtime})
+    return entry
+
+
+def find_complete_end(fp, begin, end):
+    """Returns offset after the last newline in [@begin, @end) region of file @fp or @begin if there is no newline"""
+    pos = end
+    while pos > begin:
+        step = min(BLOCK_SIZE, pos - begin)
+        pos -= step
+        fp.seek(pos)
+        idx = fp.read(step).rfind('\n')
+        if idx != -1:
+            return pos + idx + 1
+    return begin
+
+
+def rfind_start_line(path, target_string, begin):
+    """Searches plain log file @path backward from the end down to @begin offset for the
+    last complete line with @target_string.
+    Returns tuple (offset of the line or None, end offset of the scanned complete lines)"""
+    with open(path, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        scanned = find_complete_end(fp, begin, fp.tell())
+        pos = scanned
+        carry = ''
+        while pos > begin:
+            step = min(BLOCK_SIZE, pos - begin)
+            pos -= step
+            fp.seek(pos)
+            data = fp.read(step) + carry
+            body_offset = pos
+            if pos > begin:
+                # The head of the block belongs to a line started in the previous block
+                idx = data.find('\n')
+                if idx == -1:
+                    carry = data
+                    continue
+                carry = data[:idx + 1]
+                body_offset = pos + idx + 1
+                data = data[idx + 1:]
+
+            line_end = body_offset + len(data)
+            for line in reversed(data.splitlines(True)):
+                line_end -= len(line)
+                if is_start_line(line, target_string):
+                    return line_end, scanned
+    return None, scanned
+
+
+def find_start_line(path, target_string, entry):
+    """Returns offset of the last line with @target_string in log file @path or None.
+    Offsets found before are taken from index @entry, only the content appended to a plain
+    log file since the previous search is scanned. Compressed files are scanned once"""
+    cached = entry['markers'].get(target_string)
+    if 'gz' in path:
+        if cached is None:
+            offset = None
+            with open_log(path) as fp:
+                pos = 0
+                for line in fp:
+                    if is_start_line(line, target_string):
+                        offset = pos
+                    pos += len(line)
+            cached = [offset, entry['size']]
+            entry['markers'][target_string] = cached
+        return cached[0]
+
+    offset, scanned = None, 0
+    if cached is not None:
+        offset, scanned = cached
+    new_offset, scanned = rfind_start_line(path, target_string, scanned)
+    if new_offset is not None:
+        offset = new_offset
+    entry['markers'][target_string] = [offset, scanned]
+    return offset
+
+
+def find_latest_start_line(directory, filenames, target_string, index):
+    """Finds latest line with string @target_string. Assumes @filenames are sorted
+    and first file in @filenames is the newest log file.
+    Returns tuple (file name, offset of the line)"""
+    for filename in filenames:
+        entry = get_index_entry(index, os.path.join(directory, filename))
+        offset = find_start_line(os.path.join(directory, filename), target_string, entry)
+        if offset is not None:
+            # found line is the latest since we start from the newest file
+            return filename, offset
 
-    return target
+    raise Exception("{} was not found in {}".format(target_string, directory))
 
 
 def calculate_files_to_copy(filenames, file_with_latest_line):
@@ -210,29 +285,29 @@ def calculate_files_to_copy(filenames, file_with_latest_line):
     return files_to_copy
 
 
-def combine_logs_and_save(directory, filenames, start_string, target_filename):
-    do_copy = False
-    with open(target_filename, 'w') as fp:
+def combine_logs_and_save(directory, filenames, start_offset, target_filename, compress):
+    """Copies logs starting from @start_offset of the oldest file in @filenames
+    till the end of the newest file in @filenames"""
+    out = gzip.open(target_filename, 'wb') if compress else open(target_filename, 'wb')
+    with out:
         for filename in reversed(filenames):
-            path = os.path.join(directory, filename)
-            file = None
-            if 'gz' in path:
-                file = gzip.GzipFile(path)
-            else:
-                file = open(path)
-            with file:
-                for line in file:
-                    if line == start_string:
-                        do_copy = True
-                    if do_copy:
-                        fp.write(line)
-
-
-def extract_log(directory, prefixname, target_string, target_filename):
+            with open_log(os.path.join(directory, filename)) as fp:
+                if filename == filenames[-1]:
+                    fp.seek(start_offset)
+                shutil.copyfileobj(fp, out, BLOCK_SIZE)
+
+
+def extract_log(directory, prefixname, target_string, target_filename, compress=False):
     filenames = list_files(directory, prefixname)
-    file_with_latest_line, file_create_time, latest_line = extract_latest_line_with_string(directory, filenames, target_string)
+    index_path = get_index_path(directory, prefixname)
+    index = load_index(index_path)
+    file_with_latest_line, start_offset = find_latest_start_line(directory, filenames, target_string, index)
     files_to_copy = calculate_files_to_copy(filenames, file_with_latest_line)
-    combine_logs_and_save(directory, files_to_copy, latest_line, target_filename)
+    combine_logs_and_save(directory, files_to_copy, start_offset, target_filename, compress)
+
+    # Drop entries of the files removed by logrotate
+    inodes = set(str(os.stat(os.path.join(directory, filename)).st_ino) for filename in filenames)
+    save_index(index_path, dict((key, entry) for key, entry in index.items() if key in inodes))
 
 
 def main():
@@ -242,12 +317,13 @@ def main():
             file_prefix=dict(required=True, type='str'),
             start_string=dict(required=True, type='str'),
             target_filename=dict(required=True, type='str'),
+            compress=dict(required=False, type='bool', default=False),
         ),
         supports_check_mode=False)
 
     p = module.params;
     try:
-        extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'])
+        extract_log(p['directory'], p['file_prefix'], p['start_string'], p['target_filename'], p['compress'])
     except:
         err = str(sys.exc_info())
         module.fail_json(msg="Error: %s" % err)
@@ -0,0 +1,311 @@
+"""
+Compact binary file of a set of routes.
+
+The routes announced to the DUT by the exabgp processes of a topology are the
+same on every run, announce_routes saves them in this format once and later
+runs (e.g. re-announcing after a reboot) load them instead of generating them
+again. The FIB test loads the same file, it is linked as ptftests/route_set.py.
+
+File layout, all integers are in network byte order:
+    header      "RSET", version, number of strings, port groups, IPv4 and IPv6 routes
+    strings     length + utf-8 bytes, string 0 is the empty string
+    port groups exabgp port + string index of its PTF ports e.g. "[28 29]"
+    IPv4 routes address, prefix length, exabgp port, next hop and AS path string index
+    IPv6 routes same as IPv4 with the 16 bytes address
+The routes are sorted by prefix then port.
+"""
+
+import os
+import json
+import array
+import heapq
+import socket
+import struct
+import hashlib
+import tempfile
+
+MAGIC = b"RSET"
+VERSION = 1
+
+HEADER = struct.Struct("!4sHIIII")
+LENGTH = struct.Struct("!I")
+PORT_GROUP = struct.Struct("!HI")
+ROUTE_V4 = struct.Struct("!IBHII")
+ROUTE_V6 = struct.Struct("!16sBHII")
+# Tail of a route record from the exabgp port
+PORT_TAIL = struct.Struct("!HII")
+
+# Routes sorted in memory at once and read from the temporary file at once when the route set is written
+RUN_SIZE = 200000
+READ_RECORDS = 4096
+
+
+def route_set_key(*args):
+    """
+    Key of the route set generated from the given arguments e.g. topology name and properties
+    """
+    data = json.dumps([VERSION] + list(args), sort_keys=True)
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def is_route_set(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def parse_prefix(prefix):
+    """
+    Parse the prefix to (version, packed address, prefix length)
+    """
+    if "/" in prefix:
+        address, prefixlen = prefix.split("/")
+        prefixlen = int(prefixlen)
+    else:
+        address, prefixlen = prefix, None
+    if ":" in address:
+        return 6, socket.inet_pton(socket.AF_INET6, address), 128 if prefixlen is None else prefixlen
+    return 4, struct.unpack("!I", socket.inet_aton(address))[0], 32 if prefixlen is None else prefixlen
+
+
+def format_prefix(version, address, prefixlen):
+    if version == 6:
+        return "{}/{}".format(socket.inet_ntop(socket.AF_INET6, address), prefixlen)
+    return "{}/{}".format(socket.inet_ntoa(struct.pack("!I", address)), prefixlen)
+
+
+class RouteSetWriter(object):
+    """
+    Writes the route set file from routes added in any order.
+    add() takes the same arguments as the RouteAnnouncer of announce_routes, so
+    the route generation of a topology can feed either of them. The routes are
+    packed as they are added and sorted in runs of run_size records kept in a
+    temporary file, the runs are merged when the file is written, so the routes
+    are never all in memory.
+    """
+
+    def __init__(self, run_size=RUN_SIZE):
+        self.run_size = run_size
+        self.strings = [""]
+        self.string_index = {"": 0}
+        self.port_groups = {}
+        self.records = {4: ROUTE_V4, 6: ROUTE_V6}
+        # Packed records of the current run, (offset, count) of the runs in the run file
+        self.buffers = {4: [], 6: []}
+        self.runs = {4: [], 6: []}
+        self.run_files = {}
+
+    def _string(self, value):
+        value = "" if value is None else str(value)
+        index = self.string_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_index[value] = index
+        return index
+
+    def _flush_run(self, version):
+        buf = self.buffers[version]
+        if not buf:
+            return
+        # Fields are packed big endian in the sort order, sorting the records sorts the routes
+        buf.sort()
+        run_file = self.run_files.get(version)
+        if run_file is None:
+            run_file = self.run_files[version] = tempfile.TemporaryFile()
+        run_file.seek(0, os.SEEK_END)
+        self.runs[version].append((run_file.tell(), len(buf)))
+        run_file.write(b"".join(buf))
+        self.buffers[version] = []
+
+    def add_route(self, prefix, nexthop, aspath=None, port=0):
+        version, address, prefixlen = parse_prefix(prefix)
+        buf = self.buffers[version]
+        buf.append(self.records[version].pack(address, prefixlen, port, self._string(nexthop), self._string(aspath)))
+        if len(buf) >= self.run_size:
+            self._flush_run(version)
+
+    def add(self, port, routes):
+        """
+        Add the (prefix, nexthop, aspath) routes announced on the exabgp port
+        """
+        for prefix, nexthop, aspath in routes:
+            self.add_route(prefix, nexthop, aspath, port)
+
+    def set_port_group(self, port, ptf_ports):
+        """
+        Set the PTF ports of the VM the exabgp port peers with
+        """
+        self.port_groups[port] = self._string("[{}]".format(" ".join([str(p) for p in ptf_ports])))
+
+    def _read_run(self, version, offset, count):
+        run_file, size = self.run_files[version], self.records[version].size
+        while count > 0:
+            n = min(count, READ_RECORDS)
+            run_file.seek(offset)
+            data = run_file.read(n * size)
+            offset += n * size
+            count -= n
+            for pos in range(0, len(data), size):
+                yield data[pos:pos + size]
+
+    def _count(self, version):
+        return sum([count for _, count in self.runs[version]])
+
+    def write(self, path):
+        """
+        Write the route set, the file is replaced atomically
+        """
+        for version in self.buffers:
+            self._flush_run(version)
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(self.strings), len(self.port_groups),
+                                    self._count(4), self._count(6)))
+                for value in self.strings:
+                    data = value.encode("utf-8")
+                    f.write(LENGTH.pack(len(data)))
+                    f.write(data)
+                for port in sorted(self.port_groups):
+                    f.write(PORT_GROUP.pack(port, self.port_groups[port]))
+                for version in (4, 6):
+                    runs = [self._read_run(version, offset, count) for offset, count in self.runs[version]]
+                    chunk = []
+                    for record in heapq.merge(*runs):
+                        chunk.append(record)
+                        if len(chunk) >= READ_RECORDS:
+                            f.write(b"".join(chunk))
+                            chunk = []
+                    f.write(b"".join(chunk))
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        finally:
+            self.close()
+
+    def close(self):
+        for run_file in self.run_files.values():
+            run_file.close()
+        self.run_files = {}
+        self.buffers = {4: [], 6: []}
+        self.runs = {4: [], 6: []}
+
+
+class RouteSet(object):
+    """
+    Routes of the exabgp ports read from a route set file, sorted by prefix.
+    The routes are kept packed as in the file and unpacked when iterated.
+    """
+
+    def __init__(self, data, strings, port_groups, sections):
+        self.data = data
+        self.strings = strings
+        self.port_groups = port_groups
+        # (version, record struct, offset, count) of the IPv4 and IPv6 routes
+        self.sections = sections
+        self.by_port = None
+
+    def __len__(self):
+        return sum([count for _, _, _, count in self.sections])
+
+    def get_port_group(self, port):
+        index = self.port_groups.get(port)
+        return None if index is None else self.strings[index]
+
+    def _records(self):
+        data = self.data
+        for version, record, offset, count in self.sections:
+            unpack_from, size = record.unpack_from, record.size
+            for pos in range(offset, offset + count * size, size):
+                yield version, unpack_from(data, pos)
+
+    def _index_ports(self):
+        # Offsets of the records of each port, 4 bytes per route
+        self.by_port = {}
+        data = self.data
+        for version, record, offset, count in self.sections:
+            port_offset, size = record.size - PORT_TAIL.size, record.size
+            for pos in range(offset, offset + count * size, size):
+                port = PORT_TAIL.unpack_from(data, pos + port_offset)[0]
+                offsets = self.by_port.get(port)
+                if offsets is None:
+                    offsets = self.by_port[port] = (array.array("I"), array.array("I"))
+                offsets[0 if version == 4 else 1].append(pos)
+
+    def ports(self):
+        if self.by_port is None:
+            self._index_ports()
+        return sorted(self.by_port)
+
+    def entries(self):
+        """
+        Generator of the (prefix, nexthop, aspath, port) of all the routes in prefix order
+        """
+        strings = self.strings
+        for version, (address, prefixlen, port, nexthop, aspath) in self._records():
+            yield (format_prefix(version, address, prefixlen), strings[nexthop],
+                   strings[aspath] or None, port)
+
+    def routes(self, port):
+        """
+        Generator of the (prefix, nexthop, aspath) routes of the exabgp port in prefix order
+        """
+        if self.by_port is None:
+            self._index_ports()
+        offsets = self.by_port.get(port)
+        if offsets is None:
+            return
+        data, strings = self.data, self.strings
+        for version, record, positions in [(4, ROUTE_V4, offsets[0]), (6, ROUTE_V6, offsets[1])]:
+            unpack_from = record.unpack_from
+            for pos in positions:
+                address, prefixlen, _, nexthop, aspath = unpack_from(data, pos)
+                yield format_prefix(version, address, prefixlen), strings[nexthop], strings[aspath] or None
+
+    @classmethod
+    def read(cls, path):
+        """
+        Read the route set written by RouteSetWriter
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, n_strings, n_groups, n_v4, n_v6 = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a route set of version {}".format(path, VERSION))
+
+        offset = HEADER.size
+        strings = []
+        for _ in range(n_strings):
+            length = LENGTH.unpack_from(data, offset)[0]
+            offset += LENGTH.size
+            strings.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        port_groups = {}
+        for _ in range(n_groups):
+            port, index = PORT_GROUP.unpack_from(data, offset)
+            port_groups[port] = index
+            offset += PORT_GROUP.size
+        sections = []
+        for version, record, count in [(4, ROUTE_V4, n_v4), (6, ROUTE_V6, n_v6)]:
+            sections.append((version, record, offset, count))
+            offset += count * record.size
+        if offset != len(data):
+            raise ValueError("{} is truncated or corrupted".format(path))
+        return cls(data, strings, port_groups, sections)
+
+
+def load_route_set(path):
+    """
+    Read the route set, None if the file is missing or not valid
+    """
+    try:
+        return RouteSet.read(path)
+    except (IOError, OSError, ValueError, struct.error):
+        return None
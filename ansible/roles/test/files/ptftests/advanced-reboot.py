@@ -67,6 +67,7 @@ import multiprocessing
 
 from arista import Arista
 import sad_path as sp
+from flow_analyzer import FlowAnalyzer, PcapWriter, Sniffer, read_pcap
 
 
 class StateMachine():
@@ -152,6 +153,7 @@ class ReloadTest(BaseTest):
         self.check_param('nexthop_ips', [], required=False) # nexthops for the routes that will be added during warm-reboot
         self.check_param('allow_vlan_flooding', False, required=False)
         self.check_param('sniff_time_incr', 60, required=False)
+        self.check_param('sniff_pcap', True, required=False) # dump the sniffed packets to pcap files
         self.check_param('vnet', False, required=False)
         self.check_param('vnet_pkts', None, required=False)
         self.check_param('target_version', '', required=False)
@@ -177,6 +179,7 @@ class ReloadTest(BaseTest):
         self.log_fp = open(self.log_file_name, 'w')
 
         self.packets_list = []
+        self.flow = None
         self.vnet = self.test_params['vnet']
         if (self.vnet):
             self.packets_list = json.load(open(self.test_params['vnet_pkts']))
@@ -908,8 +911,6 @@ class ReloadTest(BaseTest):
         self.log("Stopping reachability state watch thread.")
         self.watcher_is_stopped.wait(timeout = 10)  # Wait for the Watcher stopped.
 
-        self.save_sniffed_packets()
-
         examine_start = datetime.datetime.now()
         self.log("Packet flow examine started %s after the reboot" % str(examine_start - self.reboot_start))
         self.examine_flow()
@@ -1302,36 +1303,53 @@ class ReloadTest(BaseTest):
     def sniff_in_background(self, wait = None):
         """
         This function listens on all ports, in both directions, for the TCP src=1234 dst=5000 packets, until timeout.
-        Once found, all packets are dumped to local pcap file,
-        and all packets are saved to self.packets as scapy type.
-        The native scapy.snif() is used as a background thread, to allow delayed start for the send_in_background().
+        The packets are examined by self.flow and dumped to local pcap files as they are captured.
+        The sniffer runs as a background thread, to allow delayed start for the send_in_background().
         """
         if not wait:
             wait = self.time_to_listen + self.test_params['sniff_time_incr']
         sniffer_start = datetime.datetime.now()
         self.log("Sniffer started at %s" % str(sniffer_start))
         sniff_filter = "tcp and tcp dst port 5000 and tcp src port 1234 and not icmp"
-        scapy_sniffer = threading.Thread(target=self.scapy_sniff, kwargs={'wait': wait, 'sniff_filter': sniff_filter})
-        scapy_sniffer.start()
-        time.sleep(2)               # Let the scapy sniff initialize completely.
+        self.flow = FlowAnalyzer(self.packets_to_send, self.dut_mac, vnet=self.vnet)
+        sniffer = Sniffer(sniff_filter)     # The packets are captured from now on.
+        flow_sniffer = threading.Thread(target=self.sniff_flow, kwargs={'sniffer': sniffer, 'wait': wait})
+        flow_sniffer.start()
         self.sniffer_started.set()  # Unblock waiter for the send_in_background.
-        scapy_sniffer.join()
+        flow_sniffer.join()
         self.log("Sniffer has been running for %s" % str(datetime.datetime.now() - sniffer_start))
+        self.log("Sniffed %d sent, %d received, %d duplicated packets" % (self.flow.sent, self.flow.received, self.flow.duplicates))
         self.sniffer_started.clear()
 
-    def save_sniffed_packets(self):
-        filename = "/tmp/capture_%s.pcap" % self.sad_oper if self.sad_oper is not None else "/tmp/capture.pcap"
-        if self.packets:
-            scapyall.wrpcap(filename, self.packets)
-            self.log("Pcap file dumped to %s" % filename)
-        else:
-            self.log("Pcap file is empty.")
+    def get_pcap_filenames(self):
+        if self.sad_oper is None:
+            return "/tmp/capture.pcap", "/tmp/capture_filtered.pcap"
+        return "/tmp/capture_%s.pcap" % self.sad_oper, "/tmp/capture_filtered_%s.pcap" % self.sad_oper
 
-    def scapy_sniff(self, wait = 180, sniff_filter = ''):
+    def sniff_flow(self, sniffer, wait = 180):
         """
-        This method exploits native scapy sniff() method.
+        This method feeds the packets captured by the sniffer to self.flow as they arrive.
+        All packets are dumped to the capture pcap file, the sent and first received packets of the flow to the filtered one.
         """
-        self.packets = scapyall.sniff(timeout = wait, filter = sniff_filter)
+        capture, filtered = None, None
+        if self.test_params['sniff_pcap']:
+            capture_filename, filtered_filename = self.get_pcap_filenames()
+            capture, filtered = PcapWriter(capture_filename), PcapWriter(filtered_filename)
+
+        def handle_packet(data, timestamp):
+            if capture:
+                capture.write(data, timestamp)
+            if self.flow.add(data, timestamp) and filtered:
+                filtered.write(data, timestamp)
+
+        try:
+            sniffer.run(wait, handle_packet)
+        finally:
+            sniffer.close()
+            for pcap in [capture, filtered]:
+                if pcap:
+                    pcap.close()
+                    self.log("Pcap file with %d packets dumped to %s" % (pcap.count, pcap.filename))
 
     def send_and_sniff(self):
         """
@@ -1346,116 +1364,39 @@ class ReloadTest(BaseTest):
         self.sniff_thr.join()
         self.sender_thr.join()
 
-    def check_tcp_payload(self, packet):
-        """
-        This method is used by examine_flow() method.
-        It returns True if a packet is not corrupted and has a valid TCP sequential TCP Payload, as created by generate_bidirectional() method'.
-        """
-        try:
-            int(str(packet[scapyall.TCP].payload)) in range(self.packets_to_send)
-            return True
-        except Exception as err:
-            return False
-
-    def no_flood(self, packet):
-        """
-        This method filters packets which are unique (i.e. no floods).
-        """
-        if (not int(str(packet[scapyall.TCP].payload)) in self.unique_id) and (packet[scapyall.Ether].src == self.dut_mac):
-            # This is a unique (no flooded) received packet.
-            self.unique_id.append(int(str(packet[scapyall.TCP].payload)))
-            return True
-        elif packet[scapyall.Ether].dst == self.dut_mac:
-            # This is a sent packet.
-            return True
-        else:
-            return False
-
     def examine_flow(self, filename = None):
         """
-        This method examines pcap file (if given), or self.packets scapy file.
-        The method compares TCP payloads of the packets one by one (assuming all payloads are consecutive integers),
+        This method examines pcap file (if given), or the packets examined by self.flow while sniffing.
+        The method compares TCP payloads of the packets (assuming all payloads are consecutive integers),
         and the losses if found - are treated as disruptions in Dataplane forwarding.
         All disruptions are saved to self.lost_packets dictionary, in format:
         disrupt_start_id = (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)
         """
         if filename:
-            all_packets = scapyall.rdpcap(filename)
-        elif self.packets:
-            all_packets = self.packets
+            flow = FlowAnalyzer(self.packets_to_send, self.dut_mac, vnet=self.vnet)
+            for data, timestamp in read_pcap(filename):
+                flow.add(data, timestamp)
+        elif self.flow:
+            flow = self.flow
         else:
-            self.log("Filename and self.packets are not defined.")
-            self.fails['dut'].add("Filename and self.packets are not defined")
+            self.log("Filename and self.flow are not defined.")
+            self.fails['dut'].add("Filename and self.flow are not defined")
             return None
-        # Filter out packets and remove floods:
-        self.unique_id = list()     # This list will contain all unique Payload ID, to filter out received floods.
-        filtered_packets = [ pkt for pkt in all_packets if
-            scapyall.TCP in pkt and
-            not scapyall.ICMP in pkt and
-            pkt[scapyall.TCP].sport == 1234 and
-            pkt[scapyall.TCP].dport == 5000 and
-            self.check_tcp_payload(pkt) and
-            self.no_flood(pkt)
-            ]
-
-        if self.vnet:
-            decap_packets = [ scapyall.Ether(str(pkt.payload.payload.payload)[8:]) for pkt in all_packets if
-                scapyall.UDP in pkt and
-                pkt[scapyall.UDP].sport == 1234
-                ]
-            filtered_decap_packets = [ pkt for pkt in decap_packets if
-                scapyall.TCP in pkt and
-                not scapyall.ICMP in pkt and
-                pkt[scapyall.TCP].sport == 1234 and
-                pkt[scapyall.TCP].dport == 5000 and
-                self.check_tcp_payload(pkt) and
-                self.no_flood(pkt)
-                ]
-            filtered_packets = filtered_packets + filtered_decap_packets
-
-        # Re-arrange packets, if delayed, by Payload ID and Timestamp:
-        packets = sorted(filtered_packets, key = lambda packet: (int(str(packet[scapyall.TCP].payload)), packet.time ))
-        self.lost_packets = dict()
+
+        self.lost_packets, disruption_start, disruption_stop = flow.disruptions()
         self.max_disrupt, self.total_disruption = 0, 0
-        sent_packets = dict()
         self.fails['dut'].add("Sniffer failed to capture any traffic")
-        self.assertTrue(packets, "Sniffer failed to capture any traffic")
+        self.assertTrue(flow.sent or flow.received, "Sniffer failed to capture any traffic")
         self.fails['dut'].clear()
-        if packets:
-            prev_payload, prev_time = 0, 0
-            sent_payload = 0
-            received_counter = 0    # Counts packets from dut.
-            self.disruption_start, self.disruption_stop = None, None
-            for packet in packets:
-                if packet[scapyall.Ether].dst == self.dut_mac:
-                    # This is a sent packet - keep track of it as payload_id:timestamp.
-                    sent_payload = int(str(packet[scapyall.TCP].payload))
-                    sent_packets[sent_payload] = packet.time
-                    continue
-                if packet[scapyall.Ether].src == self.dut_mac:
-                    # This is a received packet.
-                    received_time = packet.time
-                    received_payload = int(str(packet[scapyall.TCP].payload))
-                    received_counter += 1
-                if not (received_payload and received_time):
-                    # This is the first valid received packet.
-                    prev_payload = received_payload
-                    prev_time = received_time
-                    continue
-                if received_payload - prev_payload > 1:
-                    # Packets in a row are missing, a disruption.
-                    lost_id = (received_payload -1) - prev_payload # How many packets lost in a row.
-                    disrupt = (sent_packets[received_payload] - sent_packets[prev_payload + 1]) # How long disrupt lasted.
-                    # Add disrupt to the dict:
-                    self.lost_packets[prev_payload] = (lost_id, disrupt, received_time - disrupt, received_time)
-                    self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_payload, received_payload, disrupt))
-                    if not self.disruption_start:
-                        self.disruption_start = datetime.datetime.fromtimestamp(prev_time)
-                    self.disruption_stop = datetime.datetime.fromtimestamp(received_time)
-                prev_payload = received_payload
-                prev_time = received_time
+        self.disruption_start, self.disruption_stop = None, None
+        for prev_payload in sorted(self.lost_packets):
+            lost_id, disrupt, _, _ = self.lost_packets[prev_payload]
+            self.log("Disruption between packet ID %d and %d. For %.4f " % (prev_payload, prev_payload + lost_id + 1, disrupt))
+        if self.lost_packets:
+            self.disruption_start = datetime.datetime.fromtimestamp(disruption_start)
+            self.disruption_stop = datetime.datetime.fromtimestamp(disruption_stop)
         self.fails['dut'].add("Sniffer failed to filter any traffic from DUT")
-        self.assertTrue(received_counter, "Sniffer failed to filter any traffic from DUT")
+        self.assertTrue(flow.received, "Sniffer failed to filter any traffic from DUT")
         self.fails['dut'].clear()
         self.disrupts_count = len(self.lost_packets) # Total disrupt counter.
         if self.lost_packets:
@@ -1472,11 +1413,9 @@ class ReloadTest(BaseTest):
             self.total_disrupt_packets = 0
             self.total_disrupt_time = 0
             self.log("Gaps in forwarding not found.")
-        self.log("Total incoming packets captured %d" % received_counter)
-        if packets:
-            filename = '/tmp/capture_filtered.pcap' if self.sad_oper is None else "/tmp/capture_filtered_%s.pcap" % self.sad_oper
-            scapyall.wrpcap(filename, packets)
-            self.log("Filtered pcap dumped to %s" % filename)
+        self.log("Total incoming packets captured %d" % flow.received)
+        if flow.duplicates:
+            self.log("Duplicated (flooded) incoming packets captured %d" % flow.duplicates)
 
     def check_forwarding_stop(self, signal):
         self.asic_start_recording_vlan_reachability()
@@ -1,6 +1,6 @@
 import re
-from ipaddress import ip_address, ip_network
 from lpm import LpmDict
+from route_set import RouteSet, is_route_set
 
 # These subnets are excluded from FIB test
 # reference: RFC 5735 Special Use IPv4 Addresses
@@ -41,7 +41,7 @@ class Fib():
             port_list = [p for intf in self._next_hop for p in intf]
             return port_list
 
-    # Initialize FIB with FIB file
+    # Initialize FIB with FIB file or route set file
     def __init__(self, file_path):
         self._ipv4_lpm_dict = LpmDict()
         for ip in EXCLUDE_IPV4_PREFIXES:
@@ -51,33 +51,64 @@ class Fib():
         for ip in EXCLUDE_IPV6_PREFIXES:
             self._ipv6_lpm_dict[ip] = self.NextHop()
 
+        if is_route_set(file_path):
+            self._load_route_set(file_path)
+            return
+
         # filter out empty lines and lines starting with '#'
         pattern = re.compile("^#.*$|^[ \t]*$")
 
+        # most of the prefixes share a few next hops, parse each of them once
+        next_hops = {}
         with open(file_path, 'r') as f:
-            for line in f.readlines():
+            for line in f:
                 if pattern.match(line): continue
-                entry = line.split(' ', 1)
-                prefix = ip_network(unicode(entry[0]))
-                next_hop = self.NextHop(entry[1])
-                if prefix.version is 4:
-                    self._ipv4_lpm_dict[str(prefix)] = next_hop
-                elif prefix.version is 6:
-                    self._ipv6_lpm_dict[str(prefix)] = next_hop
+                prefix, next_hop_str = line.split(' ', 1)
+                next_hop = next_hops.get(next_hop_str)
+                if next_hop is None:
+                    next_hop = next_hops[next_hop_str] = self.NextHop(next_hop_str)
+                self._lpm_dict(prefix)[prefix] = next_hop
+
+    def _load_route_set(self, file_path):
+        '''
+        Load the routes saved by announce_routes. The prefixes are already
+        normalized and sorted, the next hops of a prefix are the PTF ports of
+        the VMs announcing it with the shortest AS path, same as the DUT selects.
+        '''
+        route_set = RouteSet.read(file_path)
+
+        def add(prefix, best):
+            groups = []
+            for port in best:
+                group = route_set.get_port_group(port)
+                if group and group not in groups:
+                    groups.append(group)
+            self._lpm_dict(prefix)[prefix] = self.NextHop(' '.join(groups))
+
+        current, best, best_len = None, [], None
+        for prefix, _, aspath, port in route_set.entries():
+            aspath_len = len(aspath.split()) if aspath else 0
+            if prefix != current:
+                if current is not None:
+                    add(current, best)
+                current, best, best_len = prefix, [port], aspath_len
+            elif aspath_len < best_len:
+                best, best_len = [port], aspath_len
+            elif aspath_len == best_len:
+                best.append(port)
+        if current is not None:
+            add(current, best)
+
+    def _lpm_dict(self, ip):
+        return self._ipv6_lpm_dict if ':' in ip else self._ipv4_lpm_dict
 
     def __getitem__(self, ip):
-        ip = ip_address(unicode(ip))
-        if ip.version is 4:
-            return self._ipv4_lpm_dict[str(ip)]
-        elif ip.version is 6:
-            return self._ipv6_lpm_dict[str(ip)]
+        ip = str(ip)
+        return self._lpm_dict(ip)[ip]
 
     def __contains__(self, ip):
-        ip_obj = ip_address(unicode(ip))
-        if ip_obj.version == 4:
-            return self._ipv4_lpm_dict.contains(ip)
-        elif ip_obj.version == 6:
-            return self._ipv6_lpm_dict.contains(ip)
+        ip = str(ip)
+        return self._lpm_dict(ip).contains(ip)
 
     def ipv4_ranges(self):
         return self._ipv4_lpm_dict.ranges()
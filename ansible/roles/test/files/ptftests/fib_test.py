@@ -29,6 +29,7 @@ from ptf.testutils import verify_packet_any_port
 from ptf.testutils import verify_no_packet_any
 
 import fib
+from pkt_batch import PacketBatch, get_batch_size, get_router_mac
 
 class FibTest(BaseTest):
     '''
@@ -103,6 +104,9 @@ class FibTest(BaseTest):
          - dst_vid                vlan tag id of dst pkts. Default: None(untag)
          - ignore_ttl:            mask the ttl field in the expected packet
          - single_fib_for_duts:   have a single fib file for all DUTs in multi-dut case. Default: False
+         - batch_size:            send the packets in batches of this size and verify them by their payload id,
+                                  all the ip ranges are covered in this mode. Capped at the PTF --qlen.
+                                  Default: 0(one packet at a time)
         '''
         self.dataplane = ptf.dataplane_instance
 
@@ -136,6 +140,7 @@ class FibTest(BaseTest):
         
         self.ignore_ttl = self.test_params.get('ignore_ttl', False)
         self.single_fib = self.test_params.get('single_fib_for_duts', False)
+        self.batch_size = get_batch_size(self.test_params.get('batch_size', 0))
 
     def check_ip_ranges(self, ipv4=True):
         for dut_index, fib in enumerate(self.fibs):
@@ -144,14 +149,20 @@ class FibTest(BaseTest):
             else:
                 ip_ranges = fib.ipv6_ranges()
 
-            if len(ip_ranges) > 150:
-                covered_ip_ranges = ip_ranges[:100] + random.sample(ip_ranges[100:], 50)  # Limit test execution time
+            if self.batch_size:
+                covered_ip_ranges = ip_ranges[:]
+            elif len(ip_ranges) > 150:
+                # Limit test execution time, the ranges are created only for the sampled indices
+                covered_ip_ranges = ip_ranges[:100] + [ip_ranges[i] for i in random.sample(range(100, len(ip_ranges)), 50)]
             else:
                 covered_ip_ranges = ip_ranges[:]
 
-            for ip_range in covered_ip_ranges:
-                if ip_range.get_first_ip() in fib:
-                    self.check_ip_range(ip_range, dut_index, ipv4)
+            if self.batch_size:
+                self.check_ip_ranges_batch(covered_ip_ranges, dut_index, ipv4)
+            else:
+                for ip_range in covered_ip_ranges:
+                    if ip_range.get_first_ip() in fib:
+                        self.check_ip_range(ip_range, dut_index, ipv4)
 
             random.shuffle(covered_ip_ranges)
             self.check_balancing(covered_ip_ranges, dut_index, ipv4)
@@ -188,6 +199,52 @@ class FibTest(BaseTest):
                 .format(ip_range, src_port, exp_ports, dst_ip, dut_index))
             self.check_ip_route(src_port, dst_ip, exp_ports, ipv4)
 
+    def check_ip_ranges_batch(self, ip_ranges, dut_index, ipv4=True):
+        '''
+        @summary: Check the ip ranges with the packets sent in batches
+        '''
+        fib = self.fibs[dut_index]
+        entries = []
+        for ip_range in ip_ranges:
+            if ip_range.get_first_ip() not in fib:
+                continue
+            dst_ips = [ip_range.get_first_ip()]
+            if ip_range.length() > 1:
+                dst_ips.append(ip_range.get_last_ip())
+            if ip_range.length() > 2:
+                dst_ips.append(ip_range.get_random_ip())
+            for dst_ip in dst_ips:
+                src_port, exp_ports, _ = self.get_src_and_exp_ports(dst_ip)
+                if not exp_ports:
+                    break
+                entries.append((src_port, dst_ip, exp_ports))
+        logging.info('Checking {} ip ranges with {} packets, dut_index={}'.format(len(ip_ranges), len(entries), dut_index))
+        self.check_ip_routes_batch(entries, ipv4)
+
+    def check_ip_routes_batch(self, entries, ipv4=True):
+        '''
+        @summary: Send the packets of the entries in batches and verify them
+        @param entries: list of (src_port, dst_ip, dst_port_list)
+        @return list of the ports the packets were received on
+        '''
+        build = self.ipv4_packets if ipv4 else self.ipv6_packets
+        mask = self.mask_ipv4_exp_pkt if ipv4 else self.mask_ipv6_exp_pkt
+        matched_ports = []
+        for start in range(0, len(entries), self.batch_size):
+            batch_entries = entries[start:start + self.batch_size]
+            batch = PacketBatch(self, mask)
+            for src_port, dst_ip, dst_port_list in batch_entries:
+                pkt, exp_pkt = build(src_port, dst_ip)
+                batch.add(src_port, pkt, exp_pkt, dst_port_list)
+
+            if self.pkt_action == self.ACTION_DROP:
+                batch.run_no_packet()
+                continue
+
+            matched_ports.extend(batch.run_ports(
+                lambda port: get_router_mac(self.router_macs, self.ptf_test_port_map, port)))
+        return matched_ports
+
     def check_balancing(self, ip_ranges, dut_index, ipv4=True):
         # Test traffic balancing across ECMP/LAG members
         if self.test_balancing and self.pkt_action == self.ACTION_FWD:
@@ -201,9 +258,14 @@ class FibTest(BaseTest):
                 # Change balancing_test_times according to number of next hop groups
                 logging.info('Checking ip range balancing {}, src_port={}, exp_ports={}, dst_ip={}, dut_index={}'\
                     .format(ip_range, src_port, exp_port_list, dst_ip, dut_index))
-                for i in range(0, self.balancing_test_times*len(exp_port_list)):
-                    (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
-                    hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+                if self.batch_size:
+                    entries = [(src_port, dst_ip, exp_port_list)] * (self.balancing_test_times*len(exp_port_list))
+                    for matched_port in self.check_ip_routes_batch(entries, ipv4):
+                        hit_count_map[matched_port] = hit_count_map.get(matched_port, 0) + 1
+                else:
+                    for i in range(0, self.balancing_test_times*len(exp_port_list)):
+                        (matched_index, received) = self.check_ip_route(src_port, dst_ip, exp_port_list, ipv4)
+                        hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
                 self.check_hit_count_map(next_hop.get_next_hop(), hit_count_map)
                 self.balancing_test_count += 1
                 if self.balancing_test_count >= self.balancing_test_number:
@@ -228,12 +290,12 @@ class FibTest(BaseTest):
 
         return (matched_port, received)
 
-    def check_ipv4_route(self, src_port, dst_ip_addr, dst_port_list):
+    def ipv4_packets(self, src_port, dst_ip_addr):
         '''
-        @summary: Check IPv4 route works.
+        @summary: Build the IPv4 packet to send and the packet expected back from the switch
         @param src_port: index of port to use for sending packet to switch
         @param dest_ip_addr: destination IP to build packet with.
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return (pkt, exp_pkt)
         '''
         sport = random.randint(0, 65535)
         dport = random.randint(0, 65535)
@@ -265,6 +327,9 @@ class FibTest(BaseTest):
                             ip_options=self.ip_options,
                             dl_vlan_enable=self.dst_vid is not None,
                             vlan_vid=self.dst_vid or 0)
+        return pkt, exp_pkt
+
+    def mask_ipv4_exp_pkt(self, exp_pkt):
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
@@ -274,6 +339,19 @@ class FibTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IP, "ttl")
             masked_exp_pkt.set_do_not_care_scapy(scapy.IP, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
+        return masked_exp_pkt
+
+    def check_ipv4_route(self, src_port, dst_ip_addr, dst_port_list):
+        '''
+        @summary: Check IPv4 route works.
+        @param src_port: index of port to use for sending packet to switch
+        @param dest_ip_addr: destination IP to build packet with.
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        '''
+        pkt, exp_pkt = self.ipv4_packets(src_port, dst_ip_addr)
+        masked_exp_pkt = self.mask_ipv4_exp_pkt(exp_pkt)
+        ip_src, ip_dst = pkt['IP'].src, pkt['IP'].dst
+        sport, dport = pkt['TCP'].sport, pkt['TCP'].dport
 
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IP(src={}, dst={})/TCP(sport={}, dport={}) on port {}'\
@@ -305,13 +383,12 @@ class FibTest(BaseTest):
             return verify_no_packet_any(self, masked_exp_pkt, dst_port_list)
     #---------------------------------------------------------------------
 
-    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+    def ipv6_packets(self, src_port, dst_ip_addr):
         '''
-        @summary: Check IPv6 route works.
-        @param source_port_index: index of port to use for sending packet to switch
+        @summary: Build the IPv6 packet to send and the packet expected back from the switch
+        @param src_port: index of port to use for sending packet to switch
         @param dest_ip_addr: destination IP to build packet with.
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @return (pkt, exp_pkt)
         '''
         sport = random.randint(0, 65535)
         dport = random.randint(0, 65535)
@@ -341,6 +418,9 @@ class FibTest(BaseTest):
                                 ipv6_hlim=max(self.ttl-1, 0),
                                 dl_vlan_enable=self.dst_vid is not None,
                                 vlan_vid=self.dst_vid or 0)
+        return pkt, exp_pkt
+
+    def mask_ipv6_exp_pkt(self, exp_pkt):
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"src")
@@ -350,6 +430,20 @@ class FibTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IPv6, "hlim")
             masked_exp_pkt.set_do_not_care_scapy(scapy.IPv6, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
+        return masked_exp_pkt
+
+    def check_ipv6_route(self, src_port, dst_ip_addr, dst_port_list):
+        '''
+        @summary: Check IPv6 route works.
+        @param source_port_index: index of port to use for sending packet to switch
+        @param dest_ip_addr: destination IP to build packet with.
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return Boolean
+        '''
+        pkt, exp_pkt = self.ipv6_packets(src_port, dst_ip_addr)
+        masked_exp_pkt = self.mask_ipv6_exp_pkt(exp_pkt)
+        ip_src, ip_dst = pkt['IPv6'].src, pkt['IPv6'].dst
+        sport, dport = pkt['TCP'].sport, pkt['TCP'].dport
 
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IPv6(src={}, dst={})/TCP(sport={}, dport={})'\
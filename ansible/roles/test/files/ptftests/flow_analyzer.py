@@ -0,0 +1,341 @@
+'''
+FlowAnalyzer is a class used in the advanced-reboot test to find the
+disruptions of the data plane flow while the DUT reboots.
+
+The packets sent by the test carry a sequential id as TCP payload. The
+analyzer parses the id straight from the raw bytes of each captured packet as
+it arrives, keeps the time each id was sent and first received by the DUT and
+the gaps between the received ids. The state is one entry per id, not per
+captured packet, so the analysis doesn't grow with the capture.
+
+Sniffer captures the packets of all the interfaces from a memory mapped
+TPACKET_V3 ring, or one recv per packet if the ring can't be set up. The
+captured frames are optionally spooled to a pcap file by PcapWriter.
+
+Usage:
+    analyzer = FlowAnalyzer(packets_to_send, dut_mac)
+    sniffer = Sniffer(sniff_filter)
+    sniffer.run(timeout, analyzer.add)
+    lost_packets, disruption_start, disruption_stop = analyzer.disruptions()
+'''
+
+import binascii
+import bisect
+import mmap
+import select
+import socket
+import struct
+import time
+from array import array
+from fcntl import ioctl
+
+import scapy.all as scapyall
+
+ETH_P_ALL = 3
+ETH_P_8021Q = 0x8100
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86dd
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+VXLAN_HDR_LEN = 8
+
+TCP_SPORT = 1234
+TCP_DPORT = 5000
+VXLAN_SPORT = 1234
+
+SIOCGSTAMP = 0x8906
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+TP_STATUS_VLAN_VALID = 1 << 4
+TP_STATUS_VLAN_TPID_VALID = 1 << 6
+
+# struct tpacket_block_desc: version, offset_to_priv, then block_status, num_pkts, offset_to_first_pkt
+BLOCK_HDR = struct.Struct('III')
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+# tp_status, tp_mac, tp_net, tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+PKT_HDR = struct.Struct('IIIIIIHHIIH')
+
+PCAP_HDR = struct.Struct('=IHHiIII')
+PCAP_REC = struct.Struct('=IIII')
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_SNAPLEN = 65535
+LINKTYPE_ETHERNET = 1
+
+
+def mac_to_bytes(mac):
+    return binascii.unhexlify(mac.replace(':', '').lower())
+
+
+class FlowAnalyzer(object):
+    def __init__(self, packets_to_send, dut_mac, vnet=False):
+        '''
+        @param packets_to_send: number of packets sent, the ids are 0 to packets_to_send - 1
+        @param dut_mac: the packets sent to this MAC are the sent ones, the ones from it the received ones
+        @param vnet: also take the packets decapsulated from VXLAN into account
+        '''
+        self.packets_to_send = packets_to_send
+        self.dut_mac = mac_to_bytes(dut_mac)
+        self.vnet = vnet
+        # timestamp per id, 0 if not captured
+        self.sent_time = array('d', [0.0]) * packets_to_send
+        self.received_time = array('d', [0.0]) * packets_to_send
+        # sorted received ids and the gaps between them: first id before the gap -> first id after it
+        self.received_ids = []
+        self.gaps = {}
+        self.sent = 0
+        self.received = 0
+        self.duplicates = 0
+        self.ignored = 0
+        self.lost = 0
+
+    def parse(self, data):
+        '''
+        @summary: Parse the packet of the flow
+        @return: (dst mac, src mac, id) or None if the packet isn't one of the flow
+        '''
+        if len(data) < 14:
+            return None
+        eth_type = struct.unpack_from('!H', data, 12)[0]
+        offset = 14
+        if eth_type == ETH_P_8021Q and len(data) >= 18:
+            eth_type = struct.unpack_from('!H', data, 16)[0]
+            offset = 18
+        try:
+            if eth_type == ETH_P_IP:
+                version_ihl, total_len, proto = struct.unpack_from('!BxH5xB', data, offset)
+                l4 = offset + (version_ihl & 0xf) * 4
+                end = offset + total_len
+            elif eth_type == ETH_P_IPV6:
+                payload_len, proto = struct.unpack_from('!4xHB', data, offset)
+                l4 = offset + 40
+                end = l4 + payload_len
+            else:
+                return None
+            sport, dport = struct.unpack_from('!HH', data, l4)
+            if self.vnet and proto == IPPROTO_UDP and sport == VXLAN_SPORT:
+                return self.parse(data[l4 + 8 + VXLAN_HDR_LEN:end])
+            if proto != IPPROTO_TCP or sport != TCP_SPORT or dport != TCP_DPORT:
+                return None
+            data_offset = struct.unpack_from('!B', data, l4 + 12)[0] >> 4
+            pkt_id = int(data[l4 + data_offset * 4:end])
+        except (struct.error, ValueError):
+            return None
+        if pkt_id < 0 or pkt_id >= self.packets_to_send:
+            return None
+        return data[0:6], data[6:12], pkt_id
+
+    def add(self, data, timestamp):
+        '''
+        @summary: Take the captured packet into account
+        @return: True if the packet is a sent or first received packet of the flow
+        '''
+        parsed = self.parse(data)
+        if parsed is None:
+            self.ignored += 1
+            return False
+        dst, src, pkt_id = parsed
+        if dst == self.dut_mac:
+            self.sent_time[pkt_id] = timestamp
+            self.sent += 1
+            return True
+        if src != self.dut_mac:
+            self.ignored += 1
+            return False
+        if self.received_time[pkt_id]:
+            # flooded or duplicated
+            self.duplicates += 1
+            return False
+        self.received_time[pkt_id] = timestamp
+        self.received += 1
+        self.add_received_id(pkt_id)
+        return True
+
+    def add_received_id(self, pkt_id):
+        # the packets are mostly received in order, so the id is mostly appended
+        index = bisect.bisect(self.received_ids, pkt_id)
+        prev_id = self.received_ids[index - 1] if index > 0 else None
+        next_id = self.received_ids[index] if index < len(self.received_ids) else None
+        self.received_ids.insert(index, pkt_id)
+        if prev_id is not None and next_id is not None:
+            # the id is received late, within a gap
+            del self.gaps[prev_id]
+            self.lost -= next_id - prev_id - 1
+        for first, second in [(prev_id, pkt_id), (pkt_id, next_id)]:
+            if first is not None and second is not None and second - first > 1:
+                self.gaps[first] = second
+                self.lost += second - first - 1
+
+    def disruptions(self):
+        '''
+        @summary: Get the disruptions of the flow, the gaps between the received ids
+        @return: (lost_packets, disruption_start, disruption_stop) where lost_packets is the dict
+                 disrupt_start_id = (missing_packets_count, disrupt_time, disrupt_start_timestamp, disrupt_stop_timestamp)
+                 and disruption_start, disruption_stop are the timestamps of the first and last disruption, None without any
+        '''
+        lost_packets = dict()
+        disruption_start, disruption_stop = None, None
+        for prev_id in sorted(self.gaps):
+            next_id = self.gaps[prev_id]
+            received_time = self.received_time[next_id]
+            # the sent packets missing in the capture are bounded by the received ones
+            stop = self.sent_time[next_id] or received_time
+            start = self.sent_time[prev_id + 1] or self.received_time[prev_id]
+            disrupt = stop - start
+            lost_packets[prev_id] = (next_id - prev_id - 1, disrupt, received_time - disrupt, received_time)
+            if disruption_start is None:
+                disruption_start = self.received_time[prev_id]
+            disruption_stop = received_time
+        return lost_packets, disruption_start, disruption_stop
+
+
+class PcapWriter(object):
+    '''
+    Write the captured frames to a pcap file as they are captured
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.f = open(filename, 'wb')
+        self.f.write(PCAP_HDR.pack(PCAP_MAGIC, 2, 4, 0, 0, PCAP_SNAPLEN, LINKTYPE_ETHERNET))
+
+    def write(self, data, timestamp):
+        sec = int(timestamp)
+        usec = int(round((timestamp - sec) * 1000000))
+        if usec >= 1000000:
+            sec, usec = sec + 1, usec - 1000000
+        self.f.write(PCAP_REC.pack(sec, usec, len(data), len(data)))
+        self.f.write(data)
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+
+def read_pcap(filename):
+    '''
+    @summary: Generator of the (data, timestamp) of the frames of the pcap file
+    '''
+    with open(filename, 'rb') as f:
+        header = f.read(PCAP_HDR.size)
+        magic = struct.unpack('<I', header[:4])[0]
+        if magic in (PCAP_MAGIC, 0xa1b23c4d):
+            order = '<'
+        else:
+            order = '>'
+        nsec = magic in (0xa1b23c4d, 0x4d3cb2a1)
+        rec = struct.Struct(order + 'IIII')
+        while True:
+            data = f.read(rec.size)
+            if len(data) < rec.size:
+                break
+            sec, frac, incl_len, _ = rec.unpack(data)
+            yield f.read(incl_len), sec + frac / (1e9 if nsec else 1e6)
+
+
+class Sniffer(object):
+    def __init__(self, sniff_filter=None, ring=True, block_size=1 << 20, block_nr=16, frame_size=16384, block_timeout=100):
+        '''
+        @param sniff_filter: BPF filter of the captured packets
+        @param ring: capture from a TPACKET_V3 ring, fall back to recv if the ring can't be set up
+        @param block_timeout: time in ms after which the kernel hands over a not full block of the ring
+        '''
+        self.sniff_filter = sniff_filter
+        self.sock = self.open_socket()
+        self.ring = None
+        if ring:
+            try:
+                self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+                frame_nr = (block_size * block_nr) // frame_size
+                req = struct.pack('IIIIIII', block_size, block_nr, frame_size, frame_nr, block_timeout, 0, 0)
+                self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+                self.ring = mmap.mmap(self.sock.fileno(), block_size * block_nr, mmap.MAP_SHARED,
+                                      mmap.PROT_READ | mmap.PROT_WRITE)
+            except (socket.error, EnvironmentError):
+                # the socket is left in TPACKET_V3 mode, start over with a new one
+                self.sock.close()
+                self.sock = self.open_socket()
+        if self.ring is None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, block_size * block_nr)
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.block_index = 0
+
+    def open_socket(self):
+        # not bound, so the packets of all the interfaces are captured
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        if self.sniff_filter:
+            scapyall.attach_filter(sock, self.sniff_filter)
+        return sock
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+        self.sock.close()
+
+    def recv_block(self, timeout):
+        '''
+        @summary: Receive the packets of the next block of the ring
+        @return: list of (data, timestamp), empty if no block is ready in time
+        '''
+        ring = self.ring
+        base = self.block_index * self.block_size
+        status_offset = base + BLOCK_STATUS_OFFSET
+        if not BLOCK_HDR.unpack_from(ring, status_offset)[0] & TP_STATUS_USER:
+            select.select([self.sock], [], [], timeout)
+            if not BLOCK_HDR.unpack_from(ring, status_offset)[0] & TP_STATUS_USER:
+                # clear pending socket error e.g. network is down
+                self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                return []
+
+        _, num_pkts, offset = BLOCK_HDR.unpack_from(ring, status_offset)
+        packets = []
+        for _ in range(num_pkts):
+            pkt = base + offset
+            (next_offset, sec, nsec, snaplen, _, status, mac, _, _, vlan_tci,
+             vlan_tpid) = PKT_HDR.unpack_from(ring, pkt)
+            data = ring[pkt + mac:pkt + mac + snaplen]
+            if vlan_tci != 0 or status & TP_STATUS_VLAN_VALID:
+                # Insert VLAN tag
+                if not status & TP_STATUS_VLAN_TPID_VALID:
+                    vlan_tpid = ETH_P_8021Q
+                data = data[:12] + struct.pack('!HH', vlan_tpid, vlan_tci) + data[12:]
+            packets.append((data, sec + nsec / 1e9))
+            offset += next_offset
+
+        # return the block to the kernel
+        ring[status_offset:status_offset + 4] = struct.pack('I', TP_STATUS_KERNEL)
+        self.block_index = (self.block_index + 1) % self.block_nr
+        return packets
+
+    def recv(self, timeout):
+        '''
+        @summary: Receive the packets captured, one by one without the ring
+        @return: list of (data, timestamp), empty if no packet is captured in time
+        '''
+        if self.ring is not None:
+            return self.recv_block(timeout)
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return []
+        data = self.sock.recv(PCAP_SNAPLEN)
+        sec, usec = struct.unpack('ll', ioctl(self.sock, SIOCGSTAMP, struct.pack('ll', 0, 0)))
+        return [(data, sec + usec / 1e6)]
+
+    def run(self, timeout, callback):
+        '''
+        @summary: Call callback(data, timestamp) for each packet captured until timeout
+        @return: number of packets captured
+        '''
+        count = 0
+        deadline = time.time() + timeout
+        remaining = timeout
+        while remaining > 0:
+            for data, timestamp in self.recv(min(remaining, 1.0)):
+                callback(data, timestamp)
+                count += 1
+            remaining = deadline - time.time()
+        return count
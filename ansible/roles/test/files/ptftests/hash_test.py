@@ -25,6 +25,7 @@ from ptf.testutils import verify_packet_any_port
 
 import fib
 import lpm
+from pkt_batch import PacketBatch, get_batch_size, get_router_mac
 
 class HashTest(BaseTest):
 
@@ -81,6 +82,8 @@ class HashTest(BaseTest):
 
         self.ignore_ttl = self.test_params.get('ignore_ttl', False)
         self.single_fib = self.test_params.get('single_fib_for_duts', False)
+        # send the packets in batches of this size and verify them by their payload id, 0 for one at a time
+        self.batch_size = get_batch_size(self.test_params.get('batch_size', 0))
 
     def get_src_and_exp_ports(self, dst_ip):
         while True:
@@ -132,19 +135,34 @@ class HashTest(BaseTest):
         if hash_key == 'ingress-port':
             # Unenough samples for hash_key ingress-port, check it loosely
             # Just verify if the asic actually use the hash field as a load-balancing factor
-            for ingress_port in self.get_ingress_ports(exp_port_list, dst_ip):
-                logging.info('Checking hash key {}, src_port={}, exp_ports={}, dst_ip={}'\
-                    .format(hash_key, ingress_port, exp_port_list, dst_ip))
-                (matched_index, _) = self.check_ip_route(hash_key, ingress_port, dst_ip, exp_port_list)
-                hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+            ingress_ports = self.get_ingress_ports(exp_port_list, dst_ip)
+            if self.batch_size:
+                logging.info('Checking hash key {}, src_ports={}, exp_ports={}, dst_ip={}'\
+                    .format(hash_key, ingress_ports, exp_port_list, dst_ip))
+                entries = [(ingress_port, exp_port_list) for ingress_port in ingress_ports]
+                for matched_port in self.check_ip_routes_batch(hash_key, dst_ip, entries):
+                    hit_count_map[matched_port] = hit_count_map.get(matched_port, 0) + 1
+            else:
+                for ingress_port in ingress_ports:
+                    logging.info('Checking hash key {}, src_port={}, exp_ports={}, dst_ip={}'\
+                        .format(hash_key, ingress_port, exp_port_list, dst_ip))
+                    (matched_index, _) = self.check_ip_route(hash_key, ingress_port, dst_ip, exp_port_list)
+                    hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
             logging.info("hit count map: {}".format(hit_count_map))
             assert True if len(hit_count_map.keys()) == 1 else False
         else:
-            for _ in range(0, self.balancing_test_times*len(exp_port_list)):
+            if self.batch_size:
                 logging.info('Checking hash key {}, src_port={}, exp_ports={}, dst_ip={}'\
                     .format(hash_key, src_port, exp_port_list, dst_ip))
-                (matched_index, _) = self.check_ip_route(hash_key, src_port, dst_ip, exp_port_list)
-                hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
+                entries = [(src_port, exp_port_list)] * (self.balancing_test_times*len(exp_port_list))
+                for matched_port in self.check_ip_routes_batch(hash_key, dst_ip, entries):
+                    hit_count_map[matched_port] = hit_count_map.get(matched_port, 0) + 1
+            else:
+                for _ in range(0, self.balancing_test_times*len(exp_port_list)):
+                    logging.info('Checking hash key {}, src_port={}, exp_ports={}, dst_ip={}'\
+                        .format(hash_key, src_port, exp_port_list, dst_ip))
+                    (matched_index, _) = self.check_ip_route(hash_key, src_port, dst_ip, exp_port_list)
+                    hit_count_map[matched_index] = hit_count_map.get(matched_index, 0) + 1
             logging.info("hash_key={}, hit count map: {}".format(hash_key, hit_count_map))
 
             self.check_balancing(next_hop.get_next_hop(), hit_count_map)
@@ -163,6 +181,26 @@ class HashTest(BaseTest):
 
         return (matched_port, received)
 
+    def check_ip_routes_batch(self, hash_key, dst_ip, entries):
+        '''
+        @summary: Send the packets of the entries in batches and verify them
+        @param entries: list of (src_port, dst_port_list)
+        @return list of the ports the packets were received on
+        '''
+        ipv4 = ip_network(unicode(dst_ip)).version == 4
+        build = self.ipv4_packets if ipv4 else self.ipv6_packets
+        mask = self.mask_ipv4_exp_pkt if ipv4 else self.mask_ipv6_exp_pkt
+        matched_ports = []
+        for start in range(0, len(entries), self.batch_size):
+            batch_entries = entries[start:start + self.batch_size]
+            batch = PacketBatch(self, mask)
+            for src_port, dst_port_list in batch_entries:
+                pkt, exp_pkt = build(hash_key, src_port)
+                batch.add(src_port, pkt, exp_pkt, dst_port_list)
+            matched_ports.extend(batch.run_ports(
+                lambda port: get_router_mac(self.router_macs, self.ptf_test_port_map, port)))
+        return matched_ports
+
     def _get_ip_proto(self, ipv6=False):
         # ip_proto 2 is IGMP, should not be forwarded by router
         # ip_proto 254 is experimental
@@ -177,12 +215,12 @@ class HashTest(BaseTest):
             if ip_proto not in skip_ports:
                 return ip_proto
 
-    def check_ipv4_route(self, hash_key, src_port, dst_port_list):
+    def ipv4_packets(self, hash_key, src_port):
         '''
-        @summary: Check IPv4 route works.
+        @summary: Build the IPv4 packet to send and the packet expected back from the switch
         @param hash_key: hash key to build packet with.
         @param src_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return (pkt, exp_pkt)
         '''
         base_mac = self.dataplane.get_mac(0, 0)
         ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
@@ -219,6 +257,9 @@ class HashTest(BaseTest):
         if hash_key == 'ip-proto':
             pkt['IP'].proto = ip_proto
             exp_pkt['IP'].proto = ip_proto
+        return pkt, exp_pkt
+
+    def mask_ipv4_exp_pkt(self, exp_pkt):
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "dst")
         # mask the chksum also if masking the ttl
@@ -227,6 +268,19 @@ class HashTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IP, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
+        return masked_exp_pkt
+
+    def check_ipv4_route(self, hash_key, src_port, dst_port_list):
+        '''
+        @summary: Check IPv4 route works.
+        @param hash_key: hash key to build packet with.
+        @param src_port: index of port to use for sending packet to switch
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        '''
+        pkt, exp_pkt = self.ipv4_packets(hash_key, src_port)
+        masked_exp_pkt = self.mask_ipv4_exp_pkt(exp_pkt)
+        ip_src, ip_dst = pkt['IP'].src, pkt['IP'].dst
+        sport, dport = pkt['TCP'].sport, pkt['TCP'].dport
 
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IP(src={}, dst={})/TCP(sport={}, dport={} on port {})'\
@@ -254,13 +308,12 @@ class HashTest(BaseTest):
                             format(ip_src, ip_dst, src_port, dst_port_list[rcvd_port], exp_src_mac, actual_src_mac))
         return (rcvd_port, rcvd_pkt)
 
-    def check_ipv6_route(self, hash_key, src_port, dst_port_list):
+    def ipv6_packets(self, hash_key, src_port):
         '''
-        @summary: Check IPv6 route works.
+        @summary: Build the IPv6 packet to send and the packet expected back from the switch
         @param hash_key: hash key to build packet with.
-        @param in_port: index of port to use for sending packet to switch
-        @param dst_port_list: list of ports on which to expect packet to come back from the switch
-        @return Boolean
+        @param src_port: index of port to use for sending packet to switch
+        @return (pkt, exp_pkt)
         '''
         base_mac = self.dataplane.get_mac(0, 0)
         ip_src = self.src_ip_interval.get_random_ip() if hash_key == 'src-ip' else self.src_ip_interval.get_first_ip()
@@ -297,7 +350,9 @@ class HashTest(BaseTest):
         if hash_key == 'ip-proto':
             pkt['IPv6'].nh = ip_proto
             exp_pkt['IPv6'].nh = ip_proto
+        return pkt, exp_pkt
 
+    def mask_ipv6_exp_pkt(self, exp_pkt):
         masked_exp_pkt = Mask(exp_pkt)
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether,"dst")
         # mask the chksum also if masking the ttl
@@ -306,6 +361,20 @@ class HashTest(BaseTest):
             masked_exp_pkt.set_do_not_care_scapy(scapy.IPv6, "chksum")
             masked_exp_pkt.set_do_not_care_scapy(scapy.TCP, "chksum")
         masked_exp_pkt.set_do_not_care_scapy(scapy.Ether, "src")
+        return masked_exp_pkt
+
+    def check_ipv6_route(self, hash_key, src_port, dst_port_list):
+        '''
+        @summary: Check IPv6 route works.
+        @param hash_key: hash key to build packet with.
+        @param in_port: index of port to use for sending packet to switch
+        @param dst_port_list: list of ports on which to expect packet to come back from the switch
+        @return Boolean
+        '''
+        pkt, exp_pkt = self.ipv6_packets(hash_key, src_port)
+        masked_exp_pkt = self.mask_ipv6_exp_pkt(exp_pkt)
+        ip_src, ip_dst = pkt['IPv6'].src, pkt['IPv6'].dst
+        sport, dport = pkt['TCP'].sport, pkt['TCP'].dport
 
         send_packet(self, src_port, pkt)
         logging.info('Sent Ether(src={}, dst={})/IPv6(src={}, dst={})/TCP(sport={}, dport={} on port {})'\
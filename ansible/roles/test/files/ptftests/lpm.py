@@ -1,25 +1,31 @@
 import random
+import socket
+import struct
 
-from ipaddress import ip_address, ip_network
-from SubnetTree import SubnetTree
+from array import array
+from bisect import bisect_right
+from ipaddress import IPv4Address, IPv6Address
 
 '''
 LpmDict is a class used in FIB test for LPM and IP segmentation.
 
-This class contains a class variable SubnetTree() _subnet_tree to solve the
-LPM search functionality, which is achieved using Patricia tree. In order to
-have IP segmentation functionality: segment the whole IP space into different
-segments from start to end according to the prefixes (networks) it reads.
+The prefixes are kept as integers (IPv4 as uint32, IPv6 as two uint64 joined
+into one integer) with their prefix lengths. In order to have IP segmentation
+functionality: segment the whole IP space into different segments from start
+to end according to the prefixes (networks) it reads.
 
 Initially, the whole IP space contains only one range. After inserting
-prefixes, the IP space is segmented into multiple ranges. The ranges()
-function returns all ranges in the LpmDict with a list of IpIntervals. The
-sub-class IpInterval then could be used to get the first/last/random IP within
-this range. It could also check the length of the range and if an IP is within
-this range.
+prefixes, the IP space is segmented into multiple ranges. The range starts are
+sorted once into an integer array, together with the longest prefix matching
+each range, and rebuilt only after the prefixes change. The ranges()
+function returns all ranges in the LpmDict as a sequence of IpIntervals, which
+are created when they are accessed. The sub-class IpInterval then could be
+used to get the first/last/random IP within this range. It could also check
+the length of the range and if an IP is within this range.
 
 To achieve the LPM functionality, use the LpmDict as a dictionary and use
-[] operator to get the corresponding value using the key (IP).
+[] operator to get the corresponding value using the key (IP). The lookup is
+a bisect of the range starts.
 
 Please check the test_lpm.py file to see the details of how this class works.
 '''
@@ -54,55 +60,130 @@ class LpmDict():
         def __str__(self):
             return str(self._start) + ' - ' + str(self._end)
 
+    class IpRanges:
+        '''
+        Sequence of the IpIntervals between the sorted range starts, the
+        IpIntervals are created on access. Slices are lists of IpIntervals.
+        '''
+        def __init__(self, starts, last, address_class):
+            self._starts = starts
+            self._last = last
+            self._address_class = address_class
+
+        def __len__(self):
+            return len(self._starts)
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return [self[i] for i in range(*index.indices(len(self._starts)))]
+            if index < 0:
+                index += len(self._starts)
+            start = self._starts[index]
+            end = self._starts[index + 1] - 1 if index + 1 < len(self._starts) else self._last
+            return LpmDict.IpInterval(self._address_class(start), self._address_class(end))
+
+        def __iter__(self):
+            for index in range(len(self._starts)):
+                yield self[index]
+
     def __init__(self, ipv4=True):
         self._ipv4 = ipv4
-        self._prefix_set = set()
-        self._subnet_tree = SubnetTree()
-        # 0.0.0.0 is a non-routable meta-address that needs to be skipped
-        self._boundaries = { ip_address(u'0.0.0.0') : 1} if ipv4 else { ip_address(u'::') : 1}
+        if ipv4:
+            self._family, self._bits, self._address_class = socket.AF_INET, 32, IPv4Address
+        else:
+            self._family, self._bits, self._address_class = socket.AF_INET6, 128, IPv6Address
+        self._last = (1 << self._bits) - 1
+        # (network, prefix length) -> value
+        self._prefixes = {}
+        # sorted range starts and the (network, prefix length) matching each range, None when stale
+        self._starts = None
+        self._matches = None
+
+    def _address(self, address):
+        packed = socket.inet_pton(self._family, address)
+        if self._ipv4:
+            return struct.unpack('!I', packed)[0]
+        high, low = struct.unpack('!QQ', packed)
+        return (high << 64) | low
+
+    def _prefix(self, key):
+        address, _, prefixlen = str(key).partition('/')
+        network = self._address(address)
+        prefixlen = int(prefixlen) if prefixlen else self._bits
+        if prefixlen < 0 or prefixlen > self._bits:
+            raise ValueError('{} has invalid prefix length'.format(key))
+        if network & self._hostmask(prefixlen):
+            raise ValueError('{} has host bits set'.format(key))
+        return network, prefixlen
+
+    def _hostmask(self, prefixlen):
+        return (1 << (self._bits - prefixlen)) - 1
+
+    def _lookup_key(self, key):
+        if not isinstance(key, (str, type(u''))):
+            # ipaddress objects
+            return int(key)
+        return self._address(str(key).split('/')[0])
+
+    def _build(self):
+        '''
+        Sort the range starts and find the longest prefix of each range
+        '''
+        default = (0, 0) if (0, 0) in self._prefixes else None
+        # outer prefixes before the nested ones starting at the same address
+        prefixes = sorted([key for key in self._prefixes if key[1]])
+
+        # 0 is a non-routable meta-address that needs to be skipped, it is always a boundary
+        boundaries = set([0])
+        for network, prefixlen in prefixes:
+            boundaries.add(network)
+            end = network | self._hostmask(prefixlen)
+            if end != self._last:
+                boundaries.add(end + 1)
+        starts = sorted(boundaries)
+
+        # prefixes either nest or don't overlap, so the active prefixes are a stack
+        matches = []
+        stack = []
+        index = 0
+        for start in starts:
+            while stack and stack[-1][0] < start:
+                stack.pop()
+            while index < len(prefixes) and prefixes[index][0] == start:
+                network, prefixlen = prefixes[index]
+                stack.append((network | self._hostmask(prefixlen), prefixes[index]))
+                index += 1
+            matches.append(stack[-1][1] if stack else default)
+
+        if self._ipv4:
+            self._starts = array('I' if array('I').itemsize >= 4 else 'L', starts)
+        else:
+            self._starts = starts
+        self._matches = matches
+
+    def _match(self, key):
+        if self._starts is None:
+            self._build()
+        return self._matches[bisect_right(self._starts, self._lookup_key(key)) - 1]
 
     def __setitem__(self, key, value):
-        prefix = ip_network(unicode(key))
-        # add the current key to self._prefix_set only when it is not the default route and it is not a duplicate key
-        if prefix.prefixlen and key not in self._prefix_set:
-            boundary = prefix[0]
-            self._boundaries[boundary] = self._boundaries.get(boundary, 0) + 1
-            if prefix[-1] != ip_address(u'255.255.255.255') and prefix[-1] != ip_address(u'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'):
-                next_boundary = prefix[-1] + 1
-                self._boundaries[next_boundary] = self._boundaries.get(next_boundary, 0) + 1
-            self._prefix_set.add(key)
-        self._subnet_tree.__setitem__(key, value)
+        self._prefixes[self._prefix(key)] = value
+        self._starts = None
 
     def __getitem__(self, key):
-        return self._subnet_tree[key]
+        match = self._match(key)
+        if match is None:
+            raise KeyError(key)
+        return self._prefixes[match]
 
     def __delitem__(self, key):
-        if '/0' not in key:
-            prefix = ip_network(unicode(key))
-            boundary = prefix[0]
-            next_boundary = prefix[-1] + 1
-            self._boundaries[boundary] = self._boundaries.get(boundary) - 1
-            if not self._boundaries[boundary]:
-                del self._boundaries[boundary]
-            self._boundaries[next_boundary] = self._boundaries.get(next_boundary) - 1
-            if not self._boundaries[next_boundary]:
-                del self._boundaries[next_boundary]
-            self._prefix_set.remove(key)
-        self._subnet_tree.__delitem__(key)
+        del self._prefixes[self._prefix(key)]
+        self._starts = None
 
     def ranges(self):
-        sorted_boundaries = sorted(self._boundaries.keys())
-        ranges = []
-        for index, boundary in enumerate(sorted_boundaries):
-            if index != len(sorted_boundaries) - 1:
-                interval = self.IpInterval(sorted_boundaries[index], sorted_boundaries[index + 1] - 1)
-            else:
-                if self._ipv4:
-                    interval = self.IpInterval(sorted_boundaries[index], ip_address(u'255.255.255.255'))
-                else:
-                    interval = self.IpInterval(sorted_boundaries[index], ip_address(u'ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff'))
-            ranges.append(interval)
-        return ranges
+        if self._starts is None:
+            self._build()
+        return self.IpRanges(self._starts, self._last, self._address_class)
 
     def contains(self, key):
-        return key in self._subnet_tree
+        return self._match(key) is not None
@@ -0,0 +1,202 @@
+'''
+PacketBatch is a class used in the FIB and hash tests to send and verify the
+packets in batches instead of one round trip per packet.
+
+Each packet added to the batch carries a unique id at the start of its payload.
+run() sends all the packets back to back, then polls the received packets and
+matches them to the expected ones by the id, so the packets of the batch are
+in flight at the same time. The packets of previous batches received late and
+the packets without id are ignored.
+
+The dataplane keeps at most --qlen received packets of a port and drops the
+oldest ones, so the batch size is capped by get_batch_size().
+
+Usage:
+    batch_size = get_batch_size(self.test_params.get('batch_size', 0))
+    batch = PacketBatch(self, mask_exp_pkt)
+    for src_port, pkt, exp_pkt, exp_ports in packets[:batch_size]:
+        batch.add(src_port, pkt, exp_pkt, exp_ports)
+    for rcvd_port in batch.run_ports(exp_src_mac):
+        ...
+'''
+
+import itertools
+import logging
+import random
+import struct
+import time
+
+import ptf
+import ptf.packet as scapy
+from ptf.testutils import dp_poll
+from ptf.testutils import send_packet
+
+TAG = b'PTFBATCH'
+ID = struct.Struct('!I')
+
+# ids are unique across the batches of the test run
+_ids = itertools.count(random.randint(0, 1 << 24))
+
+
+def tag_packet(pkt, pkt_id):
+    '''
+    @summary: Write the id at the start of the payload, keeping the packet length
+    '''
+    tag = TAG + ID.pack(pkt_id)
+    raw = pkt.getlayer(scapy.Raw)
+    if raw is None or len(raw.load) < len(tag):
+        raise ValueError('Payload of the packet is too short for the batch id')
+    raw.load = tag + raw.load[len(tag):]
+
+
+def get_packet_id(data):
+    pos = data.find(TAG)
+    if pos < 0 or pos + len(TAG) + ID.size > len(data):
+        return None
+    return ID.unpack_from(data, pos + len(TAG))[0]
+
+
+def get_src_mac(data):
+    return ':'.join(['%02x' % octet for octet in bytearray(data[6:12])])
+
+
+def get_router_mac(router_macs, ptf_test_port_map, port):
+    '''
+    @summary: Get MAC of the DUT the PTF port is connected to, the source MAC of the packets received on the port
+    '''
+    return router_macs[ptf_test_port_map[str(port)]['target_dut']]
+
+
+def get_batch_size(batch_size):
+    '''
+    @summary: Cap the batch size at the length of the dataplane queue of a port
+    '''
+    qlen = ptf.config.get('qlen')
+    if batch_size and qlen and batch_size > qlen:
+        logging.warning('Batch size {} is capped at the PTF queue length {}'.format(batch_size, qlen))
+        return qlen
+    return batch_size
+
+
+class PacketBatch(object):
+    def __init__(self, test, mask_exp_pkt=None, timeout=None, device_number=0):
+        '''
+        @param test: PTF test sending the packets
+        @param mask_exp_pkt: callback returning the Mask of the expected packet, the packet is
+                             tagged before it is called
+        @param timeout: seconds to wait for the next packet after the last one received
+        '''
+        self.test = test
+        self.mask_exp_pkt = mask_exp_pkt
+        self.timeout = timeout if timeout is not None else ptf.ptfutils.default_timeout
+        self.device_number = device_number
+        self.entries = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, src_port, pkt, exp_pkt, exp_ports):
+        '''
+        @summary: Add the packet sent on src_port and expected on one of exp_ports
+        @return: index of the packet in the batch
+        '''
+        pkt_id = next(_ids) & 0xffffffff
+        tag_packet(pkt, pkt_id)
+        tag_packet(exp_pkt, pkt_id)
+        masked_exp_pkt = self.mask_exp_pkt(exp_pkt) if self.mask_exp_pkt else exp_pkt
+        self.index[pkt_id] = len(self.entries)
+        self.entries.append((src_port, pkt, masked_exp_pkt, exp_ports))
+        return len(self.entries) - 1
+
+    def send(self):
+        self.test.dataplane.flush()
+        for src_port, pkt, _, _ in self.entries:
+            send_packet(self.test, src_port, pkt)
+
+    def receive(self, timeout):
+        '''
+        @summary: Poll the packets of the batch until all of them are received or none is received in timeout
+        @return: list of (packet index, received port, received packet), received packets not matching
+                 the expected ones
+        '''
+        received = []
+        unexpected = []
+        seen = set()
+        while len(seen) < len(self.entries):
+            result = dp_poll(self.test, device_number=self.device_number, timeout=timeout)
+            if not isinstance(result, self.test.dataplane.PollSuccess):
+                break
+            data = result.packet
+            index = self.index.get(get_packet_id(data))
+            if index is None or index in seen:
+                continue
+            _, _, masked_exp_pkt, exp_ports = self.entries[index]
+            # The packet is received once, a packet not matching the expected one is not reported as not received
+            seen.add(index)
+            if result.port not in exp_ports or not ptf.dataplane.match_exp_pkt(masked_exp_pkt, data):
+                unexpected.append((index, result.port, data))
+                continue
+            received.append((index, result.port, data))
+        return received, unexpected
+
+    def describe(self, index):
+        src_port, pkt, _, exp_ports = self.entries[index]
+        return '{} sent on port {} expected on {}'.format(pkt.summary(), src_port, exp_ports)
+
+    def run(self):
+        '''
+        @summary: Send the packets and verify each of them is received on one of its expected ports
+        @return: list of (index in expected ports, received packet) in the order of the packets added
+        '''
+        start = time.time()
+        self.send()
+        received, unexpected = self.receive(self.timeout)
+        logging.info('Batch of {} packets verified in {:.3f} seconds'.format(len(self.entries), time.time() - start))
+
+        results = [None] * len(self.entries)
+        for index, port, data in received:
+            results[index] = (self.entries[index][3].index(port), data)
+        errors = []
+        for index, port, data in unexpected:
+            errors.append('{} was received on port {} not matching the expected packet'.format(self.describe(index), port))
+        unexpected_indexes = set([index for index, _, _ in unexpected])
+        for index, result in enumerate(results):
+            if result is None and index not in unexpected_indexes:
+                errors.append('{} was not received'.format(self.describe(index)))
+        if errors:
+            for error in errors:
+                logging.error(error)
+            self.test.fail('{} of {} packets failed, first: {}'.format(len(errors), len(self.entries), errors[0]))
+        return results
+
+    def run_ports(self, exp_src_mac=None):
+        '''
+        @summary: Send the packets, verify them and their source MAC
+        @param exp_src_mac: callback returning the expected source MAC of a packet received on the port,
+                            None to not check the source MAC
+        @return: list of the ports the packets were received on, in the order of the packets added
+        '''
+        rcvd_ports = []
+        for index, (rcvd_index, rcvd_pkt) in enumerate(self.run()):
+            rcvd_port = self.entries[index][3][rcvd_index]
+            if exp_src_mac:
+                expected, actual = exp_src_mac(rcvd_port).lower(), get_src_mac(rcvd_pkt)
+                if expected != actual:
+                    raise Exception("{} was received on port {} which is one of the expected ports, "
+                                    "but the src mac doesn't match, expected {}, got {}".
+                                    format(self.describe(index), rcvd_port, expected, actual))
+            rcvd_ports.append(rcvd_port)
+        return rcvd_ports
+
+    def run_no_packet(self, timeout=None):
+        '''
+        @summary: Send the packets and verify none of them is received on its expected ports
+        '''
+        self.send()
+        received, _ = self.receive(timeout if timeout is not None else ptf.ptfutils.default_negative_timeout)
+        if received:
+            for index, port, _ in received:
+                logging.error('{} was received on port {}'.format(self.describe(index), port))
+            self.test.fail('{} of {} packets expected to be dropped were received, first: {}'
+                           .format(len(received), len(self.entries), self.describe(received[0][0])))
@@ -0,0 +1 @@
+../../../../module_utils/route_set.py
\ No newline at end of file
@@ -16,10 +16,17 @@ Usage:          Examples of how to use log analyzer
 #---------------------------------------------------------------------
 # Global imports
 #---------------------------------------------------------------------
+import os
 import sys
 import getopt
+import glob
+import gzip
+import json
 import re
+import sre_parse
+import sre_constants
 import csv
+import time
 import pprint
 import logging
 import logging.handlers
@@ -40,6 +47,100 @@ err_no_start_marker = -4
 err_invalid_string_format = -5
 err_invalid_input = -6
 
+#-- Streaming mode parameters
+stream_head_size = 256
+stream_end_marker_timeout = 10
+
+class MessageRules:
+    '''
+    @summary: Set of regular expressions compiled once and applied to log lines.
+
+    Each rule is prefiltered by the longest literal substring which any matching line
+    must contain (rule anchor). When every rule has an anchor, a line which contains none
+    of the anchors is rejected by a single search, without running the full expressions.
+    Per-rule hit counters are reported by count_hits().
+    '''
+
+    _cache = {}
+
+    @classmethod
+    def get(cls, regex_list):
+        '''
+        @summary: Get compiled rules for the list of regular expressions, compile only once per process.
+        '''
+        key = tuple(regex_list)
+        if key not in cls._cache:
+            cls._cache[key] = cls(regex_list)
+        return cls._cache[key]
+
+    def __init__(self, regex_list):
+        self.regex_list = list(regex_list)
+        self.rules = [re.compile(regex) for regex in self.regex_list]
+        self.anchors = [self.get_anchor(regex) for regex in self.regex_list]
+        self.combined = re.compile('|'.join(self.regex_list)) if self.regex_list else None
+
+        self.prefilter = None
+        if self.rules and all(self.anchors):
+            self.prefilter = re.compile('|'.join(re.escape(anchor) for anchor in sorted(set(self.anchors))))
+    #---------------------------------------------------------------------
+
+    @staticmethod
+    def get_anchor(regex):
+        '''
+        @summary: Get the longest literal substring which is required by the regular expression.
+
+        @return: Literal string or None if the expression has no such substring.
+        '''
+        try:
+            parsed = sre_parse.parse(regex)
+        except (sre_constants.error, OverflowError):
+            return None
+
+        if parsed.pattern.flags & (sre_parse.SRE_FLAG_IGNORECASE | sre_parse.SRE_FLAG_VERBOSE):
+            return None
+
+        anchor = ''
+        current = ''
+        for op, av in parsed:
+            # Only plain ASCII literals are used, so the anchor can be searched in both str and unicode lines
+            if op == sre_constants.LITERAL and av < 128:
+                current += chr(av)
+                continue
+            anchor = max(anchor, current, key=len)
+            current = ''
+        anchor = max(anchor, current, key=len)
+
+        return anchor or None
+    #---------------------------------------------------------------------
+
+    def search(self, line):
+        '''
+        @summary: Check whether line matches any of the rules.
+        '''
+        if self.combined is None:
+            return False
+        if self.prefilter is not None and not self.prefilter.search(line):
+            return False
+        return self.combined.search(line) is not None
+    #---------------------------------------------------------------------
+
+    def count_hits(self, lines):
+        '''
+        @summary: Count per-rule hits in the lines, in one pass over the lines.
+
+        @return: List of hit counters, one per rule.
+        '''
+        hits = [0] * len(self.rules)
+        for line in lines:
+            for index, rule in enumerate(self.rules):
+                anchor = self.anchors[index]
+                if anchor and anchor not in line:
+                    continue
+                if rule.search(line):
+                    hits[index] += 1
+        return hits
+    #---------------------------------------------------------------------
+
 class AnsibleLogAnalyzer:
     '''
     @summary: Overview of functionality
@@ -193,7 +294,7 @@ class AnsibleLogAnalyzer:
 
         @param file_list : List of file paths, contains search expressions.
 
-        @return: A regex class instance, corresponding to loaded regex expressions.
+        @return: A MessageRules instance, corresponding to loaded regex expressions.
             Will be used for matching operations by callers.
         '''
         messages_regex = []
@@ -242,7 +343,7 @@ class AnsibleLogAnalyzer:
                         sys.exit(err_invalid_string_format)
 
         if (len(messages_regex)):
-            regex = re.compile('|'.join(messages_regex))
+            regex = MessageRules.get(messages_regex)
         else:
             regex = None
         return regex, messages_regex
@@ -259,21 +360,21 @@ class AnsibleLogAnalyzer:
             'ignore' set - will not be reported (will be ignored)
 
         @param match_messages_regex:
-            regex class instance containing messages to match against.
+            MessageRules or regex class instance containing messages to match against.
 
         @param ignore_messages_regex:
-            regex class instance containing messages to ignore match against.
+            MessageRules or regex class instance containing messages to ignore match against.
 
         @return: True is str matches regex criteria, otherwise False.
         '''
 
         ret_code = False
 
-        if ((match_messages_regex is not None) and (match_messages_regex.findall(str))):
+        if ((match_messages_regex is not None) and (match_messages_regex.search(str))):
             if (ignore_messages_regex is None):
                 ret_code = True
 
-            elif (not ignore_messages_regex.findall(str)):
+            elif (not ignore_messages_regex.search(str)):
                 self.print_diagnostic_message('matching line: %s' % str)
                 ret_code = True
 
@@ -287,7 +388,7 @@ class AnsibleLogAnalyzer:
         '''
 
         ret_code = False
-        if (expect_messages_regex is not None) and (expect_messages_regex.findall(str)):
+        if (expect_messages_regex is not None) and (expect_messages_regex.search(str)):
             ret_code = True
 
         return ret_code
@@ -416,15 +517,241 @@ class AnsibleLogAnalyzer:
         return res
     #---------------------------------------------------------------------
 
+    def get_stream_state_file(self, out_dir):
+        return os.path.join(out_dir, "loganalyzer." + self.run_id + ".pos")
+    #---------------------------------------------------------------------
+
+    def read_file_head(self, file_path):
+        '''
+        @summary: Read the first line of the file (limited to stream_head_size bytes).
+            The head is used to identify the file after it was rotated and compressed,
+            when the inode can not be used anymore.
+        '''
+        opener = gzip.open if file_path.endswith(".gz") else open
+        try:
+            with opener(file_path, 'rb') as log_file:
+                return log_file.readline(stream_head_size).decode('utf-8', 'replace')
+        except IOError:
+            return ""
+    #---------------------------------------------------------------------
+
+    def get_file_position(self, log_file):
+        '''
+        @summary: Get the current position of the log file.
+
+        @param log_file: Path to the log file.
+
+        @return: Dictionary with file path, inode, offset and head of the file.
+        '''
+        if not os.path.exists(log_file):
+            return {"file": log_file, "inode": None, "offset": 0, "head": ""}
+
+        stat = os.stat(log_file)
+        return {"file": log_file,
+                "inode": stat.st_ino,
+                "offset": stat.st_size,
+                "head": self.read_file_head(log_file)}
+    #---------------------------------------------------------------------
+
+    def save_stream_state(self, log_file_list, out_dir):
+        '''
+        @summary: Record current offset and inode of each log file, so only the content appended
+            after this point will be analyzed by the 'analyze_stream' action.
+        '''
+        state = [self.get_file_position(log_file) for log_file in log_file_list]
+        with open(self.get_stream_state_file(out_dir), 'w') as state_file:
+            json.dump(state, state_file)
+    #---------------------------------------------------------------------
+
+    def get_rotated_files(self, log_file):
+        '''
+        @summary: Get list of the log file and its rotated copies, the newest file goes first.
+        '''
+        def rotation_index(file_path):
+            suffix = file_path[len(log_file) + 1:].split('.')[0]
+            return int(suffix) if suffix.isdigit() else -1
+
+        rotated = [f for f in glob.glob(log_file + ".*") if rotation_index(f) >= 0]
+        rotated.sort(key=rotation_index)
+        if os.path.exists(log_file):
+            rotated.insert(0, log_file)
+        return rotated
+    #---------------------------------------------------------------------
+
+    def is_same_file(self, file_path, position):
+        '''
+        @summary: Check whether file_path is the file described by position, possibly renamed
+            or compressed by logrotate.
+        '''
+        if position["inode"] is None:
+            return False
+
+        if not file_path.endswith(".gz"):
+            if os.stat(file_path).st_ino != position["inode"]:
+                return False
+            # Inode might be reused, so also compare the head when it is known
+            return not position["head"] or self.read_file_head(file_path) == position["head"]
+
+        return bool(position["head"]) and self.read_file_head(file_path) == position["head"]
+    #---------------------------------------------------------------------
+
+    def get_stream_segments(self, position):
+        '''
+        @summary: Get list of (file path, offset) to be read to get all the content
+            appended to the log file after position was recorded. Log rotation is followed by
+            inode (or file head for compressed files).
+
+        @return: List of segments in chronological order.
+        '''
+        segments = []
+        for file_path in self.get_rotated_files(position["file"]):
+            if self.is_same_file(file_path, position):
+                offset = position["offset"]
+                if not file_path.endswith(".gz") and os.path.getsize(file_path) < offset:
+                    # File was truncated, read it from the beginning
+                    offset = 0
+                segments.append((file_path, offset))
+                break
+            segments.append((file_path, 0))
+        else:
+            self.print_diagnostic_message('File {} is not found after rotation, reading all rotated files'.format(position["file"]))
+
+        segments.reverse()
+        return segments
+    #---------------------------------------------------------------------
+
+    def analyze_stream_file(self, segments, scan, start_string, match_messages_regex, ignore_messages_regex, expect_messages_regex):
+        '''
+        @summary: Analyze content of the log file segments till the end marker. See line_matches()
+            for details on matching criteria. Only complete lines are analyzed, so the analysis can
+            be resumed from where reading stopped.
+
+        @param segments: List of (file path, offset) to read, see get_stream_segments().
+
+        @param scan: Dictionary with the state of the analysis updated in place: "match" and
+            "expect" lines, number of analyzed "lines", "in_range" flag whether start string was
+            found and (file path, offset) where reading stopped in "end".
+
+        @param start_string: Optional string to start analysis from. If empty, analysis starts
+            from the recorded position.
+
+        @return: True if end marker was found.
+        '''
+        is_sairedis_rec = bool(segments) and self.is_filename_sairedis_rec(segments[-1][0])
+        start_marker = self.create_start_marker()
+        end_marker = self.create_end_marker()
+
+        for file_path, offset in segments:
+            scan["end"] = (file_path, offset)
+            opener = gzip.open if file_path.endswith(".gz") else open
+            with opener(file_path, 'rb') as log_file:
+                if offset:
+                    log_file.seek(offset)
+                for line in iter(log_file.readline, ''):
+                    if not line.endswith('\n'):
+                        # Line is still being written, read it again on the next call
+                        break
+                    offset += len(line)
+                    scan["end"] = (file_path, offset)
+
+                    if line.find(end_marker) != -1:
+                        return True
+
+                    if not scan["in_range"]:
+                        if line.find(start_string) != -1 and 'nsible' not in line:
+                            scan["in_range"] = True
+                        continue
+
+                    if line.find(start_marker) != -1:
+                        continue
+
+                    scan["lines"] += 1
+                    if is_sairedis_rec and len(line) > 1000:
+                        continue
+                    if self.line_is_expected(line, expect_messages_regex):
+                        scan["expect"].append(line)
+                    elif self.line_matches(line, match_messages_regex, ignore_messages_regex):
+                        scan["match"].append(line)
+
+        return False
+    #---------------------------------------------------------------------
+
+    def analyze_stream(self, out_dir, stream_config):
+        '''
+        @summary: Analyze all the log files recorded by save_stream_state(). Only matching and
+            expected lines along with counters are returned, so there is no need to extract
+            and download the whole log.
+
+        @param out_dir: Directory where the stream state was saved.
+
+        @param stream_config: Dictionary with "match", "ignore", "expect" lists of regular
+            expressions and "start_strings" map <file_name, start_string>.
+
+        @return: Map <file_name, result>
+        '''
+        state_file = self.get_stream_state_file(out_dir)
+        with open(state_file) as f:
+            state = json.load(f)
+
+        def compile_regex(regex_list):
+            return MessageRules.get(regex_list) if regex_list else None
+
+        match_messages_regex = compile_regex(stream_config.get("match", []))
+        ignore_messages_regex = compile_regex(stream_config.get("ignore", []))
+        expect_messages_regex = compile_regex(stream_config.get("expect", []))
+        # Lines are read as byte strings, start strings loaded from JSON are unicode
+        start_strings = {}
+        for log_file, start_string in stream_config.get("start_strings", {}).items():
+            if isinstance(start_string, unicode):
+                start_string = start_string.encode('utf-8')
+            start_strings[log_file] = start_string
+
+        res = {}
+        for position in state:
+            log_file = position["file"]
+            start_string = start_strings.get(log_file)
+            scan = {"match": [], "expect": [], "lines": 0, "in_range": not start_string, "end": None}
+            segments = self.get_stream_segments(position)
+            # End marker is placed only into syslog, other files are analyzed till the end
+            wait_end_marker = log_file == system_log_file
+            end = time.time() + stream_end_marker_timeout
+            while True:
+                found_end_marker = self.analyze_stream_file(
+                    segments, scan, start_string, match_messages_regex,
+                    ignore_messages_regex, expect_messages_regex)
+                # End marker to syslog is written asynchronously, give it some time to appear
+                if found_end_marker or not wait_end_marker or time.time() > end:
+                    break
+                time.sleep(0.5)
+                # Resume from where reading stopped
+                if scan["end"] is not None:
+                    segments = [scan["end"]]
+
+            if wait_end_marker and not found_end_marker:
+                print 'ERROR: end marker was not found in {}'.format(log_file)
+                sys.exit(err_no_end_marker)
+
+            res[log_file] = {"match": scan["match"],
+                             "expect": scan["expect"],
+                             "lines": scan["lines"]}
+
+        os.remove(state_file)
+        return res
+    #---------------------------------------------------------------------
+
 def usage():
     print 'loganalyzer input parameters:'
     print '--help                           Print usage'
     print '--verbose                        Print verbose output during the run'
-    print '--action                         init|analyze - action to perform.'
+    print '--action                         init|analyze|add_end_marker|init_stream|analyze_stream - action to perform.'
     print '                                 init - initialize analysis by placing start-marker'
     print '                                 to all log files specified in --logs parameter.'
     print '                                 analyze - perform log analysis of files specified in --logs parameter.'
     print '                                 add_end_marker - add end marker to all log files specified in --logs parameter.'
+    print '                                 init_stream - place start-marker into syslog and record current position'
+    print '                                 of syslog and files specified in --logs parameter into --out_dir.'
+    print '                                 analyze_stream - place end-marker into syslog and analyze only the content'
+    print '                                 appended after init_stream. Result is printed to stdout in JSON format.'
     print '--out_dir path                   Directory path where to place output files, '
     print '                                 must be present when --action == analyze'
     print '--logs path{,path}               List of full paths to log files to be analyzed.'
@@ -443,10 +770,12 @@ def usage():
     print '                                 All the strings from these files will be expected to present'
     print '                                 in one of specified log files during the analysis. Must be present'
     print '                                 when action == analyze.'
+    print '--stream_config path             Path to JSON file with "match", "ignore" and "expect" lists of regular'
+    print '                                 expressions. Must be present when action == analyze_stream.'
 
 #---------------------------------------------------------------------
 
-def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in):
+def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, stream_config=None):
     '''
     @summary: This function validates command line parameter 'action' and
         other related parameters.
@@ -469,6 +798,18 @@ def check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in,
             print 'ERROR: missing required match_files_in for analyze action'
             ret_code = False
 
+    elif (action == 'init_stream'):
+        if out_dir is None or len(out_dir) == 0:
+            print 'ERROR: missing required out_dir for init_stream action'
+            ret_code = False
+    elif (action == 'analyze_stream'):
+        if out_dir is None or len(out_dir) == 0:
+            print 'ERROR: missing required out_dir for analyze_stream action'
+            ret_code = False
+
+        elif stream_config is None or len(stream_config) == 0:
+            print 'ERROR: missing required stream_config for analyze_stream action'
+            ret_code = False
 
     else:
         ret_code = False
@@ -533,11 +874,9 @@ def write_result_file(run_id, out_dir, analysis_result_per_file, messages_regex_
         out_file.write("\n-------------------------------------------------\n\n")
         out_file.write('Total matches:%d\n' % match_cnt)
         # Find unused regex matches
-        for regex in messages_regex_e:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
+        expect_rules = MessageRules.get(messages_regex_e)
+        for regex, hits in zip(messages_regex_e, expect_rules.count_hits(expected_lines_total)):
+            if not hits:
                 unused_regex_messages.append(regex)
 
         out_file.write('Total expected and found matches:%d\n' % expected_cnt)
@@ -596,10 +935,11 @@ def main(argv):
     match_files_in = None
     ignore_files_in = None
     expect_files_in = None
+    stream_config = None
     verbose = False
 
     try:
-        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "verbose", "help"])
+        opts, args = getopt.getopt(argv, "a:r:s:l:o:m:i:e:c:vh", ["action=", "run_id=", "start_marker=", "logs=", "out_dir=", "match_files_in=", "ignore_files_in=", "expect_files_in=", "stream_config=", "verbose", "help"])
 
     except getopt.GetoptError:
         print "Invalid option specified"
@@ -635,10 +975,13 @@ def main(argv):
         elif (opt in ("-e", "--expect_files_in")):
             expect_files_in = arg
 
+        elif (opt in ("-c", "--stream_config")):
+            stream_config = arg
+
         elif (opt in ("-v", "--verbose")):
             verbose = True
 
-    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in) and check_run_id(run_id)):
+    if not (check_action(action, log_files_in, out_dir, match_files_in, ignore_files_in, expect_files_in, stream_config) and check_run_id(run_id)):
         usage()
         sys.exit(err_invalid_input)
 
@@ -673,6 +1016,17 @@ def main(argv):
     elif (action == "add_end_marker"):
         analyzer.place_marker(log_file_list, analyzer.create_end_marker())
         return 0
+    elif (action == "init_stream"):
+        analyzer.save_stream_state([system_log_file] + log_file_list, out_dir)
+        analyzer.place_marker_to_syslog(analyzer.create_start_marker())
+        return 0
+    elif (action == "analyze_stream"):
+        with open(stream_config) as f:
+            config = json.load(f)
+        analyzer.place_marker_to_syslog(analyzer.create_end_marker())
+        result = analyzer.analyze_stream(out_dir, config)
+        print json.dumps(result)
+        return 0
 
     else:
         print 'Unknown action:%s specified' % action
@@ -0,0 +1,241 @@
+# This file contains the structured (JSON) data sources of the show commands.
+# The JSON output is converted to the same rows as the TextFSM template of the
+# command gives, so the callers don't see the difference, but the scaled route
+# and neighbor tables are not parsed with the template regular expressions.
+# The DUTs not supporting the JSON output are remembered and use the template.
+
+import re
+import json
+from collections import OrderedDict
+
+from spytest import st
+
+# dut -> {source name: False} for the sources not supported by the DUT
+unsupported = dict()
+
+# output of a command not supported, not of a command failing for its arguments
+unsupported_regex = re.compile(r"Unknown command|Invalid input|command not found|"
+                               r"invalid option|unrecognized option|No such file")
+
+# FRR route type codes
+route_codes = {
+    "kernel": "K", "connected": "C", "static": "S", "rip": "R", "ripng": "R",
+    "ospf": "O", "ospf6": "O", "isis": "I", "bgp": "B", "eigrp": "E", "nhrp": "N",
+    "table": "T", "vnc": "v", "babel": "A", "sharp": "D", "pbr": "F", "openfabric": "f",
+    "vrrp": "Y", "pim": "P", "local": "L"
+}
+
+counters_keys = ["state", "rx_ok", "rx_bps", "rx_pps", "rx_util", "rx_err", "rx_drp", "rx_ovr",
+                 "tx_ok", "tx_bps", "tx_pps", "tx_util", "tx_err", "tx_drp", "tx_ovr"]
+
+
+def is_supported(dut, name):
+    if st.is_dry_run():
+        # the sample data is in CLI format
+        return False
+    if st.getenv("SPYTEST_STRUCTURED_SHOW", "1") == "0":
+        return False
+    return unsupported.get(dut, {}).get(name, True)
+
+
+def reset(dut=None):
+    """
+    forget the unsupported sources e.g. after upgrading the DUT
+    :param dut: None for all the DUTs
+    """
+    if dut is None:
+        unsupported.clear()
+    else:
+        unsupported.pop(dut, None)
+
+
+def _set_unsupported(dut, name):
+    unsupported.setdefault(dut, dict())[name] = False
+
+
+def _load(output):
+    start = [index for index in [output.find("{"), output.find("[")] if index >= 0]
+    if not start:
+        return None
+    try:
+        # keep the order of the CLI output
+        return json.loads(output[min(start):], object_pairs_hook=OrderedDict)
+    except ValueError:
+        return None
+
+
+def show(dut, cmd, name, json_cmd, normalize, **kwargs):
+    """
+    Get the rows of the show command, from the JSON output when the DUT supports it
+    :param dut:
+    :param cmd: show command parsed with the template
+    :param name: name of the structured source e.g. portstat-json
+    :param json_cmd: command giving the JSON output
+    :param normalize: callback(data) converting the JSON output to the template rows
+    :param kwargs: st.show arguments of both commands
+    :return: rows same as st.show(dut, cmd, **kwargs)
+    """
+    if is_supported(dut, name):
+        json_kwargs = dict(kwargs, skip_tmpl=True, skip_error_check=True)
+        output = st.show(dut, json_cmd, **json_kwargs)
+        data = _load(output)
+        if data is not None:
+            try:
+                return normalize(data)
+            except Exception as exp:
+                # e.g. the nested output of 'show ip route vrf all json', it fails the same way every time
+                st.warn("failed to convert {} output: {}, using {}".format(json_cmd, exp, cmd), dut=dut)
+                _set_unsupported(dut, name)
+        elif unsupported_regex.search(output):
+            st.log("{} is not supported, using {}".format(json_cmd, cmd), dut=dut)
+            _set_unsupported(dut, name)
+    return st.show(dut, cmd, **kwargs)
+
+
+def vtysh_show(dut, cmd, normalize, **kwargs):
+    """
+    Get the rows of the vtysh show command from its JSON output
+    :param dut:
+    :param cmd: vtysh show command
+    :param normalize: callback(data) converting the JSON output to the template rows
+    :return:
+    """
+    kwargs["type"] = "vtysh"
+    name = "vtysh-json-{}".format(normalize.__name__)
+    return show(dut, cmd, name, "{} json".format(cmd), normalize, **kwargs)
+
+
+def _str(value):
+    return "" if value is None else str(value)
+
+
+def route_rows(data):
+    """
+    show ip route json -> show_ip_route.tmpl rows
+    """
+    rows = []
+    for prefix, routes in data.items():
+        for route in routes:
+            vrf_name = route.get("vrfName", "default")
+            common = {
+                "type": route_codes.get(route.get("protocol"), "?"),
+                "selected": ">" if route.get("selected") else " ",
+                "not_installed": "q" if route.get("queued") else ("r" if route.get("failed") else ""),
+                "ip_address": _str(route.get("prefix", prefix)),
+                "duration": _str(route.get("uptime")),
+                "distance": _str(route.get("distance")),
+                "cost": _str(route.get("metric")),
+                "vrf_name": "" if vrf_name == "default" else _str(vrf_name),
+            }
+            for nexthop in route.get("nexthops", []) or [{}]:
+                row = dict(common)
+                row["fib"] = "*" if nexthop.get("fib") else " "
+                row["nexthop"] = _str(nexthop.get("ip"))
+                row["interface"] = _str(nexthop.get("interfaceName"))
+                row["nh_type"] = ""
+                nh_vrf = nexthop.get("vrf", vrf_name)
+                row["dest_vrf_name"] = "" if nh_vrf == vrf_name else _str(nh_vrf)
+                rows.append(row)
+    return rows
+
+
+def _summary(data):
+    # single address family or keyed by the address family
+    if "peers" in data:
+        return data
+    for value in data.values():
+        if isinstance(value, dict) and "peers" in value:
+            return value
+    return {}
+
+
+def _peer_state(peer):
+    if peer.get("state") == "Established":
+        return _str(peer.get("pfxRcd", peer.get("prefixReceivedCount", 0)))
+    return _str(peer.get("state", "")).split(" ")[0]
+
+
+def bgp_summary_rows(data):
+    """
+    show bgp ipv4|ipv6 summary json -> show_ip_bgp_summary.tmpl rows
+    """
+    summary = _summary(data)
+    if not summary:
+        return []
+    fill = {
+        "routerid": _str(summary.get("routerId")),
+        "localasnnumber": _str(summary.get("as")),
+        "vrfid": _str(summary.get("vrfId")),
+        "ribentries": _str(summary.get("ribCount")),
+        "ribmemoryinbytes": _str(summary.get("ribMemory")),
+        "peers": _str(summary.get("peerCount")),
+        "peersmemoryinkbytes": _str(summary.get("peerMemory", 0) // 1024),
+        "total_nbr": "", "estd_nbr": "", "dynnbr": "", "dynlimit": ""
+    }
+    rows, established = [], 0
+    for neighbor, peer in summary.get("peers", {}).items():
+        row = dict(fill)
+        row["neighbor"] = _str(neighbor)
+        row["version"] = _str(peer.get("version", 4))
+        row["asn"] = _str(peer.get("remoteAs"))
+        row["msgrcvd"] = _str(peer.get("msgRcvd"))
+        row["msgsent"] = _str(peer.get("msgSent"))
+        row["tblver"] = _str(peer.get("tableVersion"))
+        row["inq"] = _str(peer.get("inq"))
+        row["outq"] = _str(peer.get("outq"))
+        row["updown"] = _str(peer.get("peerUptime"))
+        row["state"] = _peer_state(peer)
+        if peer.get("state") == "Established":
+            established = established + 1
+        rows.append(row)
+
+    # the template records the neighbor counts in a row of their own
+    row = dict(fill)
+    for key in ["neighbor", "version", "asn", "msgrcvd", "msgsent", "tblver",
+                "inq", "outq", "updown", "state"]:
+        row[key] = ""
+    row["total_nbr"] = _str(summary.get("totalPeers", len(rows)))
+    row["estd_nbr"] = _str(established)
+    rows.append(row)
+    return rows
+
+
+def evpn_summary_rows(data):
+    """
+    show bgp l2vpn evpn summary json -> show_bgp_l2vpn_evpn_summary.tmpl rows
+    """
+    summary = _summary(data)
+    rows = []
+    for neighbor, peer in summary.get("peers", {}).items():
+        rows.append({
+            "identifier": _str(summary.get("routerId")),
+            "local_as": _str(summary.get("as")),
+            "vrf_id": _str(summary.get("vrfId")),
+            "rib_entries": _str(summary.get("ribCount")),
+            "no_peers": _str(summary.get("peerCount")),
+            "neighbor": _str(neighbor),
+            "version": _str(peer.get("version", 4)),
+            "as_no": _str(peer.get("remoteAs")),
+            "msgrcvd": _str(peer.get("msgRcvd")),
+            "msgsent": _str(peer.get("msgSent")),
+            "tblver": _str(peer.get("tableVersion")),
+            "inq": _str(peer.get("inq")),
+            "outq": _str(peer.get("outq")),
+            "updown": _str(peer.get("peerUptime")),
+            "pfxrcd": _peer_state(peer)
+        })
+    return rows
+
+
+def counters_rows(data):
+    """
+    portstat -j -> show_interfaces_counters.tmpl rows
+    """
+    rows = []
+    for iface, counters in data.items():
+        values = dict([(key.lower(), _str(value)) for key, value in counters.items()])
+        row = {"iface": _str(iface)}
+        for key in counters_keys:
+            row[key] = values.get(key, "")
+        rows.append(row)
+    return rows
@@ -7,6 +7,7 @@ from spytest import st, putils
 
 import apis.system.reboot as reboot
 from apis.system.rest import config_rest, delete_rest, get_rest , rest_status
+from apis.common import structured
 
 from utilities.utils import fail_on_error, get_interface_number_from_name, is_valid_ip_address, convert_microsecs_to_time
 from utilities.common import filter_and_select
@@ -888,6 +889,8 @@ def show_bgp_ipv4_summary_vtysh(dut, vrf='default', **kwargs):
             command = "show ip bgp summary"
         else:
             command = "show ip bgp vrf {} summary".format(vrf)
+        if not skip_tmpl:
+            return structured.vtysh_show(dut, command, structured.bgp_summary_rows)
         return st.show(dut, command, type='vtysh', skip_tmpl=skip_tmpl)
     elif cli_type == "klish":
         if vrf == 'default':
@@ -921,7 +924,7 @@ def show_bgp_ipv6_summary_vtysh(dut, vrf='default', **kwargs):
             command = "show bgp ipv6 summary"
         else:
             command = "show bgp vrf {} ipv6 summary".format(vrf)
-        return st.show(dut, command, type='vtysh')
+        return structured.vtysh_show(dut, command, structured.bgp_summary_rows)
     elif cli_type == "klish":
         if vrf == 'default':
             command = "show bgp ipv6 unicast summary"
@@ -1022,6 +1025,8 @@ def show_bgp_ipv4_summary(dut, **kwargs):
     else:
         st.log("UNSUPPORTED CLI TYPE -- {}".format(cli_type))
         return []
+    if cli_type == "vtysh":
+        return structured.vtysh_show(dut, command, structured.bgp_summary_rows)
     return st.show(dut, command, type=cli_type)
 
 
@@ -1052,6 +1057,8 @@ def show_bgp_ipv6_summary(dut, **kwargs):
     else:
         st.log("UNSUPPORTED CLI TYPE -- {}".format(cli_type))
         return []
+    if cli_type == "vtysh":
+        return structured.vtysh_show(dut, command, structured.bgp_summary_rows)
     return st.show(dut, command, type=cli_type)
 
 def get_bgp_nbr_count(dut, **kwargs):
@@ -5,6 +5,7 @@ from spytest import st, utils
 
 import apis.system.port as port1
 from apis.system.rest import get_rest,delete_rest,config_rest
+from apis.common import structured
 
 from utilities.utils import get_interface_number_from_name
 
@@ -872,7 +873,10 @@ def verify_bgp_l2vpn_evpn_summary(dut,**kwargs):
                 st.log("Neighbors {} not present in show output".format(kwargs["neighbor"]))
                 return False
     else:
-        output = st.show(dut,"show bgp l2vpn evpn summary",type=cli_type)
+        if cli_type == "vtysh":
+            output = structured.vtysh_show(dut, "show bgp l2vpn evpn summary", structured.evpn_summary_rows)
+        else:
+            output = st.show(dut,"show bgp l2vpn evpn summary",type=cli_type)
         if len(output) == 0:
             st.error("Output is Empty")
             return False
@@ -2576,7 +2580,10 @@ def fetch_evpn_neigh_output(dut,**kwargs):
     '''
     cli_type = kwargs.pop('cli_type', st.get_ui_type(dut,**kwargs))
     cli_type = "vtysh" if cli_type == 'click' else "klish"
-    output = st.show(dut,"show bgp l2vpn evpn summary",type=cli_type)
+    if cli_type == "vtysh":
+        output = structured.vtysh_show(dut, "show bgp l2vpn evpn summary", structured.evpn_summary_rows)
+    else:
+        output = st.show(dut,"show bgp l2vpn evpn summary",type=cli_type)
     if len(output) == 0:
         st.error("Output is Empty")
         return False
@@ -9,6 +9,7 @@ from spytest import st
 from spytest.utils import filter_and_select
 
 from apis.system.rest import config_rest, delete_rest ,get_rest
+from apis.common import structured
 from apis.routing.ip_rest import get_subinterface_index
 from apis.routing.sag import config_sag_ip
 
@@ -638,6 +639,8 @@ def show_ip_route(dut, family="ipv4", shell="sonic", vrf_name=None, **kwargs):
         else:
             cmd = "show ipv6 route" + summary_routes
 
+    if cli_type == "vtysh" and not summary_routes:
+        return structured.vtysh_show(dut, cmd, structured.route_rows)
     output = st.show(dut, cmd, type=cli_type)
     return output
 
@@ -682,7 +685,10 @@ def verify_ip_route(dut, family="ipv4", shell="sonic", vrf_name=None, **kwargs):
         else:
             cmd = "show ip route"
 
-    result = st.show(dut, cmd, type=cli_type)
+    if cli_type == "vtysh":
+        result = structured.vtysh_show(dut, cmd, structured.route_rows)
+    else:
+        result = st.show(dut, cmd, type=cli_type)
 
     ret_val = False
 
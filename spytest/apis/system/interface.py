@@ -10,6 +10,7 @@ from spytest import st
 import apis.system.port as portapi
 from apis.system.port_rest import rest_get_queue_counters
 from apis.system.rest import config_rest, get_rest, delete_rest
+from apis.common import structured
 
 from utilities.common import filter_and_select, make_list, exec_all, dicts_list_values, convert_to_bits
 from utilities.utils import get_interface_number_from_name
@@ -454,7 +455,7 @@ def show_interfaces_counters(dut, interface=None, property=None, cli_type=""):
     """
     if cli_type == "click":
         command = 'show interfaces counters'
-        output = st.show(dut, command)
+        output = structured.show(dut, command, "portstat-json", "portstat -j", structured.counters_rows)
         if interface:
             if property:
                 output = filter_and_select(output, [property], {'iface': interface})
@@ -489,7 +490,8 @@ def show_interface_counters_all(dut, cli_type=''):
     cli_type = st.get_ui_type(dut, cli_type=cli_type)
     if cli_type == 'click':
         command = "show interfaces counters -a"
-        return st.show(dut, command, type=cli_type)
+        return structured.show(dut, command, "portstat-json", "portstat -a -j", structured.counters_rows,
+                               type=cli_type)
     elif cli_type == 'klish':
         command = "show interface counters"
         return st.show(dut, command, type=cli_type)
@@ -6,6 +6,7 @@ defaults = {
     "SPYTEST_NO_CONSOLE_LOG": "0",
     "SPYTEST_PROMPTS_FILENAME": None,
     "SPYTEST_TEXTFSM_INDEX_FILENAME": "index",
+    "SPYTEST_TEXTFSM_CACHE_DIR": None,
     "SPYTEST_UI_POSITIVE_CASES_ONLY": "0",
     "SPYTEST_REPEAT_MODULE_SUPPORT": "0",
     "SPYTEST_FILE_PREFIX": "results",
@@ -42,10 +42,13 @@ from spytest.st_time import get_timestamp
 import spytest.compare as compare
 import spytest.tcmap as tcmap
 import spytest.paths as paths
+import spytest.profile as profile
 import spytest.cmdargs as cmdargs
 import spytest.env as env
 import spytest.syslog as syslog
 from spytest.feature import Feature
+from spytest.template import get_parse_stats
+from spytest.template import clear_parse_stats
 
 root_path = os.path.join(os.path.dirname(__file__), '..')
 root_path = os.path.abspath(root_path)
@@ -2541,6 +2544,7 @@ class WorkArea(object):
             stats.tc_cmd_time = utils.time_format(stats.tc_cmd_time, True)
             stats.helper_cmd_time = utils.time_format(stats.helper_cmd_time, True)
             stats.tg_cmd_time = utils.time_format(stats.tg_cmd_time, True)
+            stats.parallel_saved_time = utils.time_format(stats.parallel_saved_time, True)
             ofh.write("\nRESULT = {}".format(res))
             ofh.write("\nDESCRIPTION = {}".format(desc))
             ofh.write("\nTOTAL Test Time = {}".format(time_taken))
@@ -2550,6 +2554,7 @@ class WorkArea(object):
             ofh.write("\nTOTAL HELPER Time = {}".format(stats.helper_cmd_time))
             ofh.write("\nTOTAL TG Time = {}".format(stats.tg_cmd_time))
             ofh.write("\nTOTAL PROMPT NFOUND = {}".format(stats.pnfound))
+            ofh.write("\nTOTAL PARALLEL Saved Time = {}".format(stats.parallel_saved_time))
             for [start_time, thid, ctype, dut, cmd, ctime] in stats.cmds:
                 start_msg = "\n{} {}".format(get_timestamp(this=start_time), thid)
                 if ctype == "CMD":
@@ -2564,6 +2569,15 @@ class WorkArea(object):
                     ofh.write("{}TGWAIT TIME: {} = {}".format(start_msg, ctime, cmd))
                 elif ctype == "PROMPT_NFOUND":
                     ofh.write("{}PROMPT NFOUND: {}".format(start_msg, cmd))
+                elif ctype == "PARALLEL":
+                    ofh.write("{}PARALLEL TIME: {} = {}".format(start_msg, ctime, cmd))
+            parse_stats = get_parse_stats()
+            clear_parse_stats()
+            for cmd, [count, total, longest] in sorted(parse_stats.items(),
+                                                       key=lambda x: x[1][1], reverse=True):
+                total = utils.time_format(int(total * 1000), True)
+                longest = utils.time_format(int(longest * 1000), True)
+                ofh.write("\nPARSE TIME: {} {} {} = {}".format(count, total, longest, cmd))
             ofh.write("\n=========================================================\n")
         self.stats_count = self.stats_count + 1
         row = [self.stats_count, module, func, res, time_taken, stats.helper_cmd_time,
@@ -3341,6 +3355,12 @@ class WorkArea(object):
         return putil.exec_all2(self.cfg.faster_init, "abort", entries,
                                first_on_main)
 
+    def submit(self, dut, func, *args, **kwargs):
+        return self.net.submit(dut, func, *args, **kwargs)
+
+    def wait_futures(self, futures):
+        return self.net.wait_futures(futures, "abort")
+
     def exec_each(self, items, func, *args, **kwargs):
         return putil.exec_foreach2(self.cfg.faster_init, "abort", items, func,
                                    *args, **kwargs)
@@ -4607,6 +4627,10 @@ def consolidate_results(progress=None, thread=False, count=None):
     align = {col: True for col in ["Module"]}
     Result.write_report_html(sysinfo_htm, consolidated, ReportType.SYSINFO, True, links=links, align=align)
 
+    # command profile
+    files = read_all_result_names(logs_path, "profile", "json")
+    profile.consolidate_report(logs_path, files)
+
     # CLI files
     all_file = paths.get_cli_log("", logs_path, True)
     files = read_all_result_names(logs_path, "", "cli")
@@ -5212,6 +5236,9 @@ def _report_data_generation(execution_start, execution_end,
     align = {col: True for col in ["Module"]}
     Result.write_report_html(sysinfo_htm, sysinfo_rows, ReportType.SYSINFO, False, links=links, align=align)
 
+    # command profile
+    profile.write_report(logs_path)
+
     tc_result_dict = {}
     for key in results_map:
         if key:
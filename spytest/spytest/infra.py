@@ -450,6 +450,22 @@ def poll_wait2(delay, timeout, method, *args, **kwargs):
 def exec_all(entries, first_on_main=False):
     return getwa().exec_all(entries, first_on_main=first_on_main)
 
+def submit(dut, func, *args, **kwargs):
+    """
+    Queue func(dut, *args, **kwargs) to the command worker thread of the DUT
+    :param dut: DUT name
+    :param func: function taking the DUT as first argument e.g. st.config or API
+    :return: future to be passed to wait_futures
+    """
+    return getwa().submit(dut, func, *args, **kwargs)
+
+def wait_futures(futures):
+    """
+    Wait for the futures returned by submit, the failures are reported same as exec_all
+    :return: [retvals, exceptions]
+    """
+    return getwa().wait_futures(futures)
+
 def exec_each(items, func, *args, **kwargs):
     return getwa().exec_each(items, func, *args, **kwargs)
 
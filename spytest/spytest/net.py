@@ -109,6 +109,8 @@ class Net(object):
         self.pending_downloads = dict()
         self.log_dutid_fmt = env.get("SPYTEST_LOG_DUTID_FMT", "LABEL")
         self.dut_log_lock = putils.Lock()
+        self.workers = dict()
+        self.workers_lock = putils.Lock()
 
     def is_use_last_prompt(self):
         fcli = env.get("SPYTEST_FASTER_CLI_OVERRIDE")
@@ -350,6 +352,7 @@ class Net(object):
     def unregister_devices(self):
         for _devname in self.topo["duts"]:
             self._disconnect_device(_devname)
+            self.stop_worker(_devname)
         self.topo["duts"] = {}
 
     def register_templates(self):
@@ -4516,6 +4519,50 @@ class Net(object):
     def get_stats(self):
         return profile.get_stats()
 
+    def _get_worker(self, devname):
+        self.workers_lock.acquire()
+        try:
+            worker = self.workers.get(devname)
+            if not worker:
+                worker = putils.Worker()
+                self.workers[devname] = worker
+            return worker
+        finally:
+            self.workers_lock.release()
+
+    def submit(self, devname, func, *args, **kwargs):
+        """
+        Queue func(devname, *args, **kwargs) to the worker thread of the device.
+        The functions submitted for a device are executed in order, the functions
+        submitted for different devices are executed in parallel.
+        :param devname: device name
+        :param func: function taking the device name as first argument e.g. st.config or API
+        :return: future to be passed to wait_futures
+        """
+        future = self._get_worker(devname).submit(func, devname, *args, **kwargs)
+        future.devname = devname
+        return future
+
+    def wait_futures(self, futures, on_except="abort"):
+        """
+        Wait for the futures returned by submit and profile the time saved
+        compared to executing the functions sequentially.
+        :return: [retvals, exceptions] same as exec_all
+        """
+        try:
+            return putils.wait_futures(on_except, futures)
+        finally:
+            profile.parallel([[future.devname, future.start_time, future.end_time] for future in futures])
+
+    def stop_worker(self, devname):
+        self.workers_lock.acquire()
+        try:
+            worker = self.workers.pop(devname, None)
+        finally:
+            self.workers_lock.release()
+        if worker:
+            worker.stop()
+
     def set_prev_tc(self, prev_tc=None):
         self.prev_testcase = prev_tc
         for devname in self.topo["duts"]:
@@ -68,6 +68,18 @@ def get_stats_htm(prefix=None, consolidated=False):
 def get_stats_txt(prefix=None, consolidated=False):
     return get_file_path("stats", "txt", prefix, consolidated)
 
+def get_profile_json(prefix=None, consolidated=False):
+    return get_file_path("profile", "json", prefix, consolidated)
+
+def get_profile_folded(prefix=None, consolidated=False):
+    return get_file_path("profile", "folded", prefix, consolidated)
+
+def get_profile_csv(prefix=None, consolidated=False):
+    return get_file_path("profile", "csv", prefix, consolidated)
+
+def get_profile_htm(prefix=None, consolidated=False):
+    return get_file_path("profile", "html", prefix, consolidated)
+
 def get_report_txt(prefix=None, consolidated=False):
     return get_file_path("summary", "txt", prefix, consolidated)
 
@@ -1,7 +1,116 @@
 
+import os
+import sys
+import json
+import heapq
+import textwrap
+import threading
+
 from spytest.st_time import get_timenow
+from spytest.st_time import get_timestamp
 from spytest.dicts import SpyTestDict
 import spytest.logger as logger
+import spytest.paths as paths
+import spytest.env as env
+import utilities.common as utils
+
+# frames of the files under this directory are attributed e.g. tests, apis and utilities
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# except the framework frames
+framework_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+# max frames in a stack
+MAX_DEPTH = 16
+# max length of the command in the stacks and tables
+MAX_CMD_LEN = 120
+
+class SessionProfile(object):
+    """
+    Session wide profile of the commands and waits
+    attributed to the calling test and API functions
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.top = int(env.get("SPYTEST_PROFILE_TOP_COUNT", "50"))
+        self.labels = dict()
+        self.stacks = dict()
+        self.commands = dict()
+        self.callers = dict()
+        self.waits = dict()
+        self.pnfound = dict()
+        self.slowest = []
+
+    def _label(self, code):
+        # cached per code object as the frames are walked for every command
+        label = self.labels.get(code, "")
+        if label == "":
+            filename = os.path.abspath(code.co_filename)
+            if filename.startswith(root_dir) and not filename.startswith(framework_dir):
+                label = "{}:{}".format(os.path.basename(filename), code.co_name)
+            else:
+                label = None
+            self.labels[code] = label
+        return label
+
+    def get_stack(self, depth=2):
+        frames = []
+        try:
+            frame = sys._getframe(depth)
+        except ValueError:
+            return frames
+        while frame is not None and len(frames) < MAX_DEPTH:
+            label = self._label(frame.f_code)
+            if label: frames.append(label)
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def add(self, ctype, dut, cmd, msec):
+        stack = self.get_stack(3)
+        cmd = cmd[:MAX_CMD_LEN]
+        module = stack[0].split(":")[0] if stack else "framework"
+        caller = stack[-1] if stack else "framework"
+        leaf = "{}:{}".format(ctype, cmd).replace(";", ",")
+        folded = ";".join(stack + [leaf])
+        with self.lock:
+            if ctype == "PROMPT_NFOUND":
+                self._count(self.pnfound, (module, cmd), 0)
+                return
+            self._count(self.stacks, folded, msec)
+            self._count(self.commands, (ctype, str(dut or ""), cmd), msec)
+            self._count(self.callers, caller, msec)
+            if ctype in ["WAIT", "TGWAIT"]:
+                self._count(self.waits, module, msec)
+            else:
+                entry = [msec, get_timestamp(), ctype, str(dut or ""), cmd, ";".join(stack)]
+                if len(self.slowest) < self.top:
+                    heapq.heappush(self.slowest, entry)
+                elif msec > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+    def _count(self, table, key, msec):
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1, msec, msec]
+        else:
+            entry[0] = entry[0] + 1
+            entry[1] = entry[1] + msec
+            entry[2] = max(entry[2], msec)
+
+    def get_data(self):
+        """
+        profile data in JSON friendly form, see merge
+        """
+        with self.lock:
+            data = SpyTestDict()
+            data.stacks = [[key] + value for key, value in self.stacks.items()]
+            data.commands = [list(key) + value for key, value in self.commands.items()]
+            data.callers = [[key] + value for key, value in self.callers.items()]
+            data.waits = [[key] + value for key, value in self.waits.items()]
+            data.pnfound = [list(key) + value for key, value in self.pnfound.items()]
+            data.slowest = [list(entry) for entry in self.slowest]
+        return data
 
 class Profile(object):
 
@@ -19,6 +128,8 @@ class Profile(object):
         self.cmds = []
         self.profile_ids = dict()
         self.canbe_parallel = []
+        self.parallel_cmds = []
+        self.parallel_saved_time = 0
 
     def init(self):
         self.__init__()
@@ -44,14 +155,17 @@ class Profile(object):
                 self.helper_cmds.append([start_time, thid, dut, msg, cmd_time])
                 self.helper_cmd_time = self.helper_cmd_time + cmd_time
                 self.cmds.append([start_time, thid, "HELPER", dut, msg, cmd_time])
+                session.add("HELPER", dut, msg, cmd_time)
             else:
                 self.tc_cmds.append([start_time, thid, dut, msg, cmd_time])
                 self.tc_cmd_time = self.tc_cmd_time + cmd_time
                 self.cmds.append([start_time, thid, "CMD", dut, msg, cmd_time])
+                session.add("CMD", dut, msg, cmd_time)
         else:
             self.tg_cmds.append([start_time, thid, dut, msg, cmd_time])
             self.tg_cmd_time = self.tg_cmd_time + cmd_time
             self.cmds.append([start_time, thid, "TG", dut, msg, cmd_time])
+            session.add("TG", dut, msg, cmd_time)
         return data
 
     def wait(self, val, is_tg=False):
@@ -60,15 +174,36 @@ class Profile(object):
         if is_tg:
             self.tg_total_wait = self.tg_total_wait + val
             self.cmds.append([start_time, thid, "TGWAIT", None, "TG sleep", val])
+            session.add("TGWAIT", None, "TG sleep", int(val * 1000))
         else:
             self.tc_total_wait = self.tc_total_wait + val
             self.cmds.append([start_time, thid, "WAIT", None, "static delay", val])
+            session.add("WAIT", None, "static delay", int(val * 1000))
+
+    def parallel(self, entries):
+        """
+        record the functions executed in parallel by the device workers
+        :param entries: list of [dut, start time, end time] with the times in seconds since epoch
+        """
+        entries = [entry for entry in entries if entry[1] is not None and entry[2] is not None]
+        if not entries: return
+        start_time = get_timenow()
+        thid = logger.get_thread_name()
+        duts = sorted(set([str(entry[0]) for entry in entries]))
+        seq_time = int(sum([end - start for _, start, end in entries]) * 1000)
+        wall_time = int((max([entry[2] for entry in entries]) - min([entry[1] for entry in entries])) * 1000)
+        saved_time = max(0, seq_time - wall_time)
+        msg = "{} calls on {} sequential {} msec".format(len(entries), ",".join(duts), seq_time)
+        self.parallel_cmds.append([start_time, thid, duts, len(entries), seq_time, wall_time])
+        self.parallel_saved_time = self.parallel_saved_time + saved_time
+        self.cmds.append([start_time, thid, "PARALLEL", None, msg, wall_time])
 
     def prompt_nfound(self, cmd):
         start_time = get_timenow()
         thid = logger.get_thread_name()
         self.pnfound = self.pnfound + 1
         self.cmds.append([start_time, thid, "PROMPT_NFOUND", None, cmd, ""])
+        session.add("PROMPT_NFOUND", None, cmd, 0)
 
     def get_stats(self):
         stats = SpyTestDict()
@@ -82,10 +217,13 @@ class Profile(object):
         stats.helper_cmds = self.helper_cmds
         stats.cmds = self.cmds
         stats.canbe_parallel = self.canbe_parallel
+        stats.parallel_cmds = self.parallel_cmds
+        stats.parallel_saved_time = self.parallel_saved_time
         stats.pnfound = self.pnfound
         return stats
 
 obj = Profile()
+session = SessionProfile()
 def init():
     return obj.init()
 
@@ -101,6 +239,144 @@ def wait(val, is_tg=False):
 def get_stats():
     return obj.get_stats()
 
+def parallel(entries):
+    return obj.parallel(entries)
+
 def prompt_nfound(cmd):
     return obj.prompt_nfound(cmd)
 
+def get_session():
+    return session
+
+# number of key columns in the profile data tables
+data_keys = dict(stacks=1, commands=3, callers=1, waits=1, pnfound=2)
+
+def merge(data_list):
+    """
+    merge the profile data of the nodes
+    :param data_list: list of SessionProfile.get_data
+    """
+    tables = dict([(name, dict()) for name in data_keys])
+    slowest = []
+    for data in data_list:
+        for name, nkeys in data_keys.items():
+            table = tables[name]
+            for row in data.get(name, []):
+                key = tuple(row[:nkeys])
+                entry = table.setdefault(key, [0, 0, 0])
+                entry[0] = entry[0] + row[nkeys]
+                entry[1] = entry[1] + row[nkeys+1]
+                entry[2] = max(entry[2], row[nkeys+2])
+        slowest.extend(data.get("slowest", []))
+    retval = SpyTestDict()
+    for name, table in tables.items():
+        retval[name] = [list(key) + value for key, value in table.items()]
+    retval.slowest = heapq.nlargest(session.top, slowest)
+    return retval
+
+profile_tmpl = textwrap.dedent("""\
+    <html>
+    <head>
+      <style>
+        body {font-family: monospace; font-size: 12px;}
+        table {border-collapse: collapse; margin-bottom: 20px;}
+        th, td {border: 1px solid #999; padding: 0px 5px; text-align: left;}
+        div.frame {white-space: nowrap; overflow: hidden; margin: 1px 0px;}
+        span.bar {display: inline-block; background-color: #f0a050; height: 12px; vertical-align: middle;}
+      </style>
+    </head>
+    <body>
+    <h3>Time: {{total}} CMD: {{totals.CMD}} HELPER: {{totals.HELPER}} TG: {{totals.TG}}
+      WAIT: {{totals.WAIT}} TGWAIT: {{totals.TGWAIT}} PROMPT NFOUND: {{pnfound_count}}</h3>
+    <h3>Time by Stack</h3>
+    {%- for row in frames %}
+    <div class="frame" style="padding-left:{{row[0]*12}}px" title="{{row[1]|e}}">
+      <span class="bar" style="width:{{row[3]*3}}px"></span> {{row[3]}}% {{row[2]}} {{row[1]|e}}</div>
+    {%- endfor %}
+    {%- for table in tables %}
+    <h3>{{table[0]}}</h3>
+    <table>
+      <tr>{% for col in table[1] %}<th>{{col}}</th>{% endfor %}</tr>
+      {%- for row in table[2] %}
+      <tr>{% for cell in row %}<td>{{cell|e}}</td>{% endfor %}</tr>
+      {%- endfor %}
+    </table>
+    {%- endfor %}
+    </body>
+    </html>
+""")
+
+def _flame_rows(stacks, total, min_percent=0.5):
+    # tree of the stacks as (depth, name, time, percent) rows in depth first order
+    tree = dict()
+    for row in stacks:
+        node = tree
+        for name in row[0].split(";"):
+            child = node.setdefault(name, [0, dict()])
+            child[0] = child[0] + row[2]
+            node = child[1]
+    rows = []
+    def walk(node, depth):
+        for name, child in sorted(node.items(), key=lambda item: -item[1][0]):
+            percent = round(child[0] * 100.0 / total, 1) if total else 0
+            if percent < min_percent: continue
+            rows.append([depth, name, utils.time_format(child[0], True), percent])
+            walk(child[1], depth + 1)
+    walk(tree, 0)
+    return rows
+
+def _top(rows, index, count):
+    return sorted(rows, key=lambda row: -row[index])[:count]
+
+def write_report(logs_path, data=None, consolidated=False):
+    """
+    write the profile data as collapsed stacks, CSV and HTML report
+    the collapsed stacks can be given to flamegraph.pl
+    """
+    data = data or session.get_data()
+    with open(paths.get_profile_json(logs_path, consolidated), "w") as ofh:
+        json.dump(data, ofh)
+
+    lines = ["{} {}".format(row[0], row[2]) for row in sorted(data.stacks)]
+    utils.write_file(paths.get_profile_folded(logs_path, consolidated), "\n".join(lines) + "\n")
+
+    cols = ["Type", "Device", "Command", "Count", "Total", "Max", "Avg"]
+    rows = []
+    for row in _top(data.commands, 4, len(data.commands)):
+        rows.append(row[:4] + [utils.time_format(value, True) for value in [row[4], row[5], row[4]//row[3]]])
+    utils.write_csv_file(cols, rows, paths.get_profile_csv(logs_path, consolidated))
+
+    totals = SpyTestDict([(ctype, 0) for ctype in ["CMD", "HELPER", "TG", "WAIT", "TGWAIT"]])
+    for row in data.commands:
+        totals[row[0]] = totals.get(row[0], 0) + row[4]
+    total = sum(totals.values())
+    top = session.top
+    tables = []
+    tables.append(["Top {} Slowest Commands".format(top), ["Time", "Timestamp", "Type", "Device", "Command", "Stack"],
+                   [[utils.time_format(row[0], True)] + row[1:] for row in sorted(data.slowest, reverse=True)]])
+    tables.append(["Top {} Commands by Total Time".format(top), cols, rows[:top]])
+    tables.append(["Top {} Functions by Total Time".format(top), ["Function", "Count", "Total", "Max"],
+                   [row[:2] + [utils.time_format(row[2], True), utils.time_format(row[3], True)]
+                    for row in _top(data.callers, 2, top)]])
+    tables.append(["Static Sleep by Module", ["Module", "Count", "Total"],
+                   [row[:2] + [utils.time_format(row[2], True)] for row in _top(data.waits, 2, len(data.waits))]])
+    tables.append(["Prompt Not Found", ["Module", "Command", "Count"],
+                   [row[:3] for row in _top(data.pnfound, 2, len(data.pnfound))]])
+    html = utils.j2_apply(profile_tmpl, total=utils.time_format(total, True),
+                          totals=SpyTestDict([(k, utils.time_format(v, True)) for k, v in totals.items()]),
+                          pnfound_count=sum([row[2] for row in data.pnfound]),
+                          frames=_flame_rows(data.stacks, total), tables=tables)
+    utils.write_file(paths.get_profile_htm(logs_path, consolidated), html)
+
+def consolidate_report(logs_path, files):
+    """
+    merge the profile data files of the nodes into the consolidated report
+    """
+    data_list = []
+    for filepath in files:
+        try:
+            with open(filepath) as ifh:
+                data_list.append(json.load(ifh))
+        except Exception as exp:
+            print("failed to read {}: {}".format(filepath, exp))
+    write_report(logs_path, merge(data_list), True)
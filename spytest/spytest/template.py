@@ -2,6 +2,11 @@ import sys
 import os
 import re
 import json
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
 
 import textfsm
 try:
@@ -9,8 +14,102 @@ try:
 except Exception:
     import textfsm.clitable as clitable
 
+try:
+    # same conversion as textfsm applies to the table rows
+    from builtins import str as _tostr
+except Exception:
+    _tostr = str
+
 import spytest.env as env
 
+# compiled FSMs not in use: template path -> list of TextFSM
+fsm_pool = dict()
+fsm_lock = threading.Lock()
+
+# parse time per command: cmd -> [count, total seconds, max seconds]
+parse_stats = dict()
+stats_lock = threading.Lock()
+
+def _cache_file(cache_dir, tmpl_path):
+    stat = os.stat(tmpl_path)
+    key = "{}-{}-{}-{}-{}".format(tmpl_path, stat.st_mtime, stat.st_size,
+                                 getattr(textfsm, "__version__", ""), sys.version_info[0])
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+    name = os.path.splitext(os.path.basename(tmpl_path))[0]
+    return os.path.join(cache_dir, "{}-{}.fsm".format(name, digest))
+
+def _compile(tmpl_path):
+    cache_dir = env.get("SPYTEST_TEXTFSM_CACHE_DIR", "")
+    if not cache_dir:
+        with open(tmpl_path, "r") as tmpl_fp:
+            return textfsm.TextFSM(tmpl_fp)
+
+    # precompiled FSM is keyed by template mtime and size
+    cache_file = _cache_file(cache_dir, tmpl_path)
+    try:
+        with open(cache_file, "rb") as fp:
+            return pickle.load(fp)
+    except Exception:
+        pass
+    with open(tmpl_path, "r") as tmpl_fp:
+        fsm = textfsm.TextFSM(tmpl_fp)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(fsm, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, cache_file)
+    except Exception:
+        pass
+    return fsm
+
+def _acquire_fsm(tmpl_path):
+    with fsm_lock:
+        idle = fsm_pool.setdefault(tmpl_path, [])
+        if idle:
+            return idle.pop()
+    return _compile(tmpl_path)
+
+def _release_fsm(tmpl_path, fsm):
+    with fsm_lock:
+        fsm_pool[tmpl_path].append(fsm)
+
+def parse_text(tmpl_path, data):
+    """
+    parse the data with the template compiled once per process
+    :return: [header, records]
+    """
+    fsm = _acquire_fsm(tmpl_path)
+    try:
+        fsm.Reset()
+        return [fsm.header, fsm.ParseText(data)]
+    finally:
+        _release_fsm(tmpl_path, fsm)
+
+def get_parse_stats():
+    """
+    parse time of the commands
+    :return: dict of command to [count, total seconds, max seconds]
+    """
+    with stats_lock:
+        return dict((cmd, list(stats)) for cmd, stats in parse_stats.items())
+
+def clear_parse_stats():
+    with stats_lock:
+        parse_stats.clear()
+
+def _add_parse_stats(cmd, elapsed):
+    # Template.apply runs from the exec_all threads
+    with stats_lock:
+        stats = parse_stats.get(cmd)
+        if stats is None:
+            parse_stats[cmd] = [1, elapsed, elapsed]
+        else:
+            stats[0] = stats[0] + 1
+            stats[1] = stats[1] + elapsed
+            stats[2] = max(stats[2], elapsed)
+
 class Template(object):
 
     def __init__(self, platform=None, cli=None):
@@ -23,14 +122,22 @@ class Template(object):
         self.cli_table = clitable.CliTable(index_file, self.root)
         self.platform = platform
         self.cli = cli
+        # index lookups: attributes -> templates
+        self.tmpl_cache = dict()
+
+    def _lookup(self, attrs):
+        key = tuple(sorted(attrs.items()))
+        if key not in self.tmpl_cache:
+            row_idx = self.cli_table.index.GetRowMatch(attrs)
+            if row_idx == 0:
+                self.tmpl_cache[key] = None
+            else:
+                self.tmpl_cache[key] = self.cli_table.index.index[row_idx]['Template']
+        return self.tmpl_cache[key]
 
     # find the template given command
     def get_tmpl(self, cmd):
-        attrs = dict(Command=cmd)
-        row_idx = self.cli_table.index.GetRowMatch(attrs)
-        if row_idx == 0:
-            return None
-        return self.cli_table.index.index[row_idx]['Template']
+        return self._lookup(dict(Command=cmd))
 
     # retrive template and sameple file given the command
     def read_sample(self, cmd):
@@ -60,28 +167,39 @@ class Template(object):
         attrs = dict(Command=cmd)
         if self.platform: attrs["Platform"] = self.platform
         if self.cli: attrs["cli"] = self.cli
+        start = time.time()
         try:
-            self.cli_table.ParseCmd(output, attrs)
+            templates = self._lookup(attrs)
+            if not templates:
+                raise clitable.CliTableError('No template found for attributes: "%s"' % attrs)
+            if ':' in templates:
+                # tables of multiple templates are merged by clitable
+                self.cli_table.ParseCmd(output, attrs, templates)
+                header, records = self.cli_table.header, self.cli_table
+            else:
+                header, records = parse_text(os.path.join(self.root, templates), output)
+                records = [[_tostr(v) if not isinstance(v, list) else [_tostr(i) for i in v] for v in record]
+                           for record in records]
+            header = [name.lower() for name in header]
             objs = []
-            for row in self.cli_table:
+            for row in records:
                 temp_dict = {}
                 for index, element in enumerate(row):
-                    if index >= len(self.cli_table.header):
-                        print("HEADER: {} ROW: {}".format(self.cli_table.header, row))
-                    temp_dict[self.cli_table.header[index].lower()] = element
+                    if index >= len(header):
+                        print("HEADER: {} ROW: {}".format(header, row))
+                    temp_dict[header[index]] = element
                 objs.append(temp_dict)
             tmpl_file = self.get_tmpl(cmd)
             return [tmpl_file, objs]
         except clitable.CliTableError as e:
             raise Exception('Unable to parse command "%s" - %s' % (cmd, str(e)))
+        finally:
+            _add_parse_stats(cmd, time.time() - start)
 
     # apply the given template on given data
     def apply_textfsm(self, tmpl_file, data):
         tmpl_file2 = os.path.join(self.root, tmpl_file)
-        tmpl_fp = open(tmpl_file2, "r")
-        out = textfsm.TextFSM(tmpl_fp).ParseText(data)
-        tmpl_fp.close()
-        return out
+        return parse_text(tmpl_file2, data)[1]
 
 if __name__ == "__main__":
     template = Template()
@@ -101,4 +219,3 @@ if __name__ == "__main__":
     except Exception as exp:
         print("============ ERROR: {}".format(exp))
         print (rv)
-
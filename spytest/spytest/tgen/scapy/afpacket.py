@@ -6,12 +6,23 @@ in the data returned by recv. Instead, it delivers the VLAN TCI in a control
 message. Python 2.x doesn't have built-in support for recvmsg, so we have to
 use ctypes to call it. The recv function exported by this module reconstructs
 the VLAN tag if it was offloaded.
+
+RxRing receives the packets from a memory mapped TPACKET_V3 ring instead.
+The kernel fills blocks of packets in the ring, which are read a whole block
+at a time without a system call per packet. The VLAN tag is reconstructed
+from the packet header in the ring.
+
+The sendmmsg function sends a batch of packets with a single system call.
 """
 
+import mmap
+import select
 import struct
+import socket
 from ctypes import sizeof
 from ctypes import get_errno
 from ctypes import byref
+from ctypes import addressof
 from ctypes import c_void_p
 from ctypes import cast
 from ctypes import pointer
@@ -29,6 +40,20 @@ ETH_P_8021Q = 0x8100
 SOL_PACKET = 263
 PACKET_AUXDATA = 8
 TP_STATUS_VLAN_VALID = 1 << 4
+TP_STATUS_VLAN_TPID_VALID = 1 << 6
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_block_desc: version, offset_to_priv, then struct tpacket_hdr_v1
+# block_status, num_pkts, offset_to_first_pkt, ...
+BLOCK_HDR_FMT = "III"
+BLOCK_STATUS_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+# tp_status, tp_mac, tp_net, tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+PKT_HDR_FMT = "IIIIIIHHIIH"
 
 class struct_iovec(Structure):
     _fields_ = [
@@ -47,6 +72,12 @@ class struct_msghdr(Structure):
         ("msg_flags", c_int),
     ]
 
+class struct_mmsghdr(Structure):
+    _fields_ = [
+        ("msg_hdr", struct_msghdr),
+        ("msg_len", c_uint),
+    ]
+
 class struct_cmsghdr(Structure):
     _fields_ = [
         ("cmsg_len", c_size_t),
@@ -69,6 +100,12 @@ libc = CDLL("libc.so.6")
 recvmsg = libc.recvmsg
 recvmsg.argtypes = [c_int, POINTER(struct_msghdr), c_int]
 recvmsg.retype = c_int
+try:
+    libc_sendmmsg = libc.sendmmsg
+    libc_sendmmsg.argtypes = [c_int, POINTER(struct_mmsghdr), c_uint, c_int]
+    libc_sendmmsg.restype = c_int
+except AttributeError:
+    libc_sendmmsg = None
 
 def enable_auxdata(sk):
     """
@@ -124,3 +161,104 @@ def recv(sk, bufsize):
         return buf.raw[:12] + tag + buf.raw[12:rv]
     else:
         return buf.raw[:rv]
+
+def sendmmsg(sk, frames):
+    """
+    Send a batch of packets on a bound AF_PACKET socket
+    @sk Socket
+    @frames list of packets
+    @return number of packets sent
+    """
+    if not libc_sendmmsg or len(frames) == 1:
+        for frame in frames:
+            sk.send(frame)
+        return len(frames)
+
+    count = len(frames)
+    bufs = [create_string_buffer(bytes(frame), len(frame)) for frame in frames]
+    iovs = (struct_iovec * count)()
+    msgs = (struct_mmsghdr * count)()
+    for index, buf in enumerate(bufs):
+        iovs[index].iov_base = cast(buf, c_void_p)
+        iovs[index].iov_len = len(buf)
+        msgs[index].msg_hdr.msg_iov = pointer(iovs[index])
+        msgs[index].msg_hdr.msg_iovlen = 1
+
+    sent = 0
+    while sent < count:
+        first = cast(addressof(msgs) + sent * sizeof(struct_mmsghdr), POINTER(struct_mmsghdr))
+        rv = libc_sendmmsg(sk.fileno(), first, count - sent, 0)
+        if rv <= 0:
+            # send the rest one by one to get the error of the first failing packet
+            for frame in frames[sent:]:
+                sk.send(frame)
+            return count
+        sent = sent + rv
+    return sent
+
+class RxRing(object):
+    """
+    Memory mapped TPACKET_V3 receive ring of an AF_PACKET socket
+
+    Must be created before the socket is bound.
+    @sk Socket
+    @block_size Size of a ring block, multiple of the page size
+    @block_nr Number of blocks in the ring
+    @frame_size Max size of a packet
+    @block_timeout Time in ms after which the kernel hands over a not full block
+    """
+
+    def __init__(self, sk, block_size=1 << 20, block_nr=8, frame_size=16384, block_timeout=10):
+        self.sk = sk
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.block_index = 0
+        sk.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        frame_nr = (block_size * block_nr) // frame_size
+        req = struct.pack("IIIIIII", block_size, block_nr, frame_size, frame_nr, block_timeout, 0, 0)
+        sk.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+        self.ring = mmap.mmap(sk.fileno(), block_size * block_nr, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def close(self):
+        try: self.ring.close()
+        except Exception: pass
+
+    def block_ready(self, base):
+        status = struct.unpack_from("I", self.ring, base + BLOCK_STATUS_OFFSET)[0]
+        return bool(status & TP_STATUS_USER)
+
+    def recv_block(self, timeout=1.0):
+        """
+        Receive the packets of the next block of the ring
+        @timeout Max time in seconds to wait for a block
+        @return list of packets, empty if no block is ready in time
+        """
+        base = self.block_index * self.block_size
+        if not self.block_ready(base):
+            select.select([self.sk], [], [], timeout)
+            if not self.block_ready(base):
+                # clear pending socket error e.g. network is down
+                self.sk.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                return []
+
+        ring = self.ring
+        _, num_pkts, offset = struct.unpack_from(BLOCK_HDR_FMT, ring, base + BLOCK_STATUS_OFFSET)
+        packets = []
+        for _ in range(num_pkts):
+            pkt = base + offset
+            (next_offset, _, _, snaplen, _, status, mac, _, _, vlan_tci,
+             vlan_tpid) = struct.unpack_from(PKT_HDR_FMT, ring, pkt)
+            data = ring[pkt + mac:pkt + mac + snaplen]
+            if vlan_tci != 0 or status & TP_STATUS_VLAN_VALID:
+                # Insert VLAN tag
+                if not status & TP_STATUS_VLAN_TPID_VALID:
+                    vlan_tpid = ETH_P_8021Q
+                data = data[:12] + struct.pack("!HH", vlan_tpid, vlan_tci) + data[12:]
+            packets.append(data)
+            offset = offset + next_offset
+
+        # return the block to the kernel
+        ring[base + BLOCK_STATUS_OFFSET:base + BLOCK_STATUS_OFFSET + 4] = struct.pack("I", TP_STATUS_KERNEL)
+        self.block_index = (self.block_index + 1) % self.block_nr
+        return packets
@@ -0,0 +1,214 @@
+"""
+Hardware free benchmark of the scapy traffic generator
+
+A veth pair is created in a network namespace and used as ports 1/1 and 1/2
+of the traffic generator, the streams are sent on 1/1 and received on 1/2.
+For each stream profile the benchmark measures the achieved TX rate in pps
+and bps, the RX accounting accuracy, the latency and its spread (max - min)
+and the CPU time per packet including the TX worker processes.
+
+The results are saved as JSON, use --compare with the results of a previous
+version to see the regressions.
+
+Run as root on a dedicated box or VM, the server deletes all the network
+namespaces when it starts, same as it does when started by service.sh:
+    python benchmark.py --duration 10 --rate 100000 --output results.json
+    python benchmark.py --profiles fixed,l4_ports --compare results.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from collections import OrderedDict
+from datetime import datetime
+
+NETNS = "scapy-bench"
+
+# time to wait for the frames in flight after the stream is stopped
+DRAIN_TIME = 2
+
+# regression reported when a metric is worse by more than this percentage
+REGRESSION_PERCENT = 10
+
+PROFILES = OrderedDict([
+    ("fixed", dict()),
+    ("mac_incr", dict(mac_src_mode="increment", mac_src_count=100,
+                      mac_dst_mode="increment", mac_dst_count=100)),
+    ("mac_list", dict(mac_dst_mode="list", mac_dst=["00.00.00.00.00.02", "00.00.00.00.00.04",
+                                                    "00.00.00.00.00.06", "00.00.00.00.00.08"])),
+    ("ip_incr", dict(ip_src_mode="increment", ip_src_count=1000,
+                     ip_dst_mode="increment", ip_dst_count=1000)),
+    ("l4_ports", dict(l4_protocol="udp", udp_src_port=1024, udp_src_port_mode="increment",
+                      udp_src_port_count=1000, udp_dst_port=5000, udp_dst_port_mode="decrement",
+                      udp_dst_port_count=100)),
+    ("burst", dict(transmit_mode="continuous_burst", pkts_per_burst=100)),
+    ("single_burst", dict(transmit_mode="single_burst", pkts_per_burst=10000)),
+])
+
+# metrics compared with --compare: name, True if higher is better
+COMPARED = [("tx_pps", True), ("rx_accuracy", True), ("cpu_usec_per_pkt", False),
+            ("latency_avg_usec", False), ("latency_spread_usec", False)]
+
+def sh(cmd, check=True):
+    print("CMD: {}".format(cmd))
+    rv = subprocess.call(cmd, shell=True)
+    if check and rv != 0:
+        raise RuntimeError("failed: {}".format(cmd))
+    return rv
+
+def setup_netns(ns):
+    sh("ip netns del {} 2>/dev/null".format(ns), False)
+    sh("ip netns add {}".format(ns))
+    sh("ip -n {} link add eth0 type veth peer name eth1".format(ns))
+    for dev in ["lo", "eth0", "eth1"]:
+        sh("ip -n {} link set {} up".format(ns, dev))
+    sh("ip netns exec {} sysctl -q -w net.ipv6.conf.all.disable_ipv6=1".format(ns))
+
+def git_version():
+    try:
+        cmd = ["git", "-C", os.path.dirname(os.path.abspath(__file__)), "describe", "--always", "--dirty"]
+        return subprocess.check_output(cmd).decode().strip()
+    except Exception:
+        return "unknown"
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def count_value(value):
+    # detailed stats have the value in count
+    return value["count"] if isinstance(value, dict) else value
+
+def run_profile(server, ports, name, extra, args):
+    from ut_streams import ut_stream_get
+
+    (tx_ph, rx_ph) = (ports["1/1"], ports["1/2"])
+    for action in ["reset", "clear_stats"]:
+        server.exposed_tg_traffic_control("", action=action, port_handle=[tx_ph, rx_ph])
+    kws = ut_stream_get(0, port_handle=tx_ph, port_handle2=rx_ph, l3_protocol="ipv4",
+                        frame_size=args.frame_size, rate_pps=args.rate)
+    kws.update(extra)
+    stream_id = server.exposed_tg_traffic_config("", **kws)["stream_id"]
+
+    cpu0, start = cpu_time(), time.time()
+    server.exposed_tg_traffic_control("", action="run", handle=stream_id)
+    time.sleep(args.duration)
+    server.exposed_tg_traffic_control("", action="stop", handle=stream_id)
+    elapsed = time.time() - start
+    time.sleep(DRAIN_TIME)
+    cpu = cpu_time() - cpu0
+
+    def stats(**kws):
+        return server.exposed_tg_traffic_stats("", stats_wait=False, **kws)
+    tx = stats(port_handle=tx_ph, mode="aggregate")[tx_ph]["aggregate"]["tx"]
+    rx = stats(port_handle=rx_ph, mode="aggregate")[rx_ph]["aggregate"]["rx"]
+    srx = stats(mode="aggregate", stream=stream_id)["aggregate"]["rx"]
+
+    tx_pkts, tx_bytes = int(tx["total_pkts"]), int(tx["pkt_byte_count"])
+    stream_rx_pkts = int(count_value(srx["total_pkts"]))
+    res = OrderedDict()
+    res["kws"] = extra
+    res["elapsed"] = round(elapsed, 3)
+    res["tx_pkts"] = tx_pkts
+    res["tx_pps"] = round(float(tx["total_pkt_rate"]) or tx_pkts / elapsed, 1)
+    res["tx_bps"] = round(tx_bytes * 8 / elapsed, 1)
+    res["rx_pkts"] = int(rx["total_pkts"])
+    res["stream_rx_pkts"] = stream_rx_pkts
+    res["rx_accuracy"] = round(float(stream_rx_pkts) / tx_pkts, 6) if tx_pkts else 0
+    res["loss_pkts"] = int(count_value(srx["loss_pkts"]))
+    res["reorder_pkts"] = int(count_value(srx["reorder_pkts"]))
+    # delays are reported in nano seconds
+    res["latency_min_usec"] = count_value(srx["min_delay"]) / 1000.0
+    res["latency_avg_usec"] = count_value(srx["avg_delay"]) / 1000.0
+    res["latency_max_usec"] = count_value(srx["max_delay"]) / 1000.0
+    res["latency_spread_usec"] = res["latency_max_usec"] - res["latency_min_usec"]
+    res["cpu_sec"] = round(cpu, 3)
+    res["cpu_usec_per_pkt"] = round(cpu * 1000000 / tx_pkts, 3) if tx_pkts else 0
+    print("{}: {}".format(name, json.dumps(res)))
+    return res
+
+def compare(results, baseline_file):
+    with open(baseline_file) as fp:
+        baseline = json.load(fp)
+    regressions = []
+    print("comparing with {} version {}".format(baseline_file, baseline.get("version")))
+    for name, res in results["profiles"].items():
+        base = baseline.get("profiles", {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED:
+            old, new = base.get(metric), res.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) * 100.0 / old
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > REGRESSION_PERCENT else ""
+            print("{:<14} {:<20} {:>14.3f} {:>14.3f} {:>+8.1f}% {}".format(name, metric, old, new, change, flag))
+            if flag:
+                regressions.append("{} {}".format(name, metric))
+    return regressions
+
+def run(args):
+    from logger import Logger
+    from server import ScapyServer
+
+    Logger.setup()
+    os.environ["SCAPY_TGEN_PORTMAP"] = "eth1"
+    server = ScapyServer(dry=False, dbg=0, name="scapy-bench")
+    ports = server.exposed_tg_connect("", port_list=["1/1", "1/2"])["port_handle"]
+
+    results = OrderedDict()
+    results["version"] = git_version()
+    results["time"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    results["host"] = platform.node()
+    results["python"] = platform.python_version()
+    results["cpus"] = os.sysconf("SC_NPROCESSORS_ONLN")
+    results["duration"] = args.duration
+    results["rate_pps"] = args.rate
+    results["frame_size"] = args.frame_size
+    results["profiles"] = OrderedDict()
+    for name in args.profiles.split(","):
+        results["profiles"][name] = run_profile(server, ports, name, PROFILES[name], args)
+    server.exposed_tg_disconnect("")
+
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print("results saved in {}".format(args.output))
+
+    if args.compare and compare(results, args.compare):
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="scapy traffic generator benchmark")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of sending per profile")
+    parser.add_argument("--rate", type=int, default=100000, help="requested rate in pps")
+    parser.add_argument("--frame-size", type=int, default=128, help="frame size in bytes")
+    parser.add_argument("--profiles", default=",".join(PROFILES.keys()),
+                        help="comma separated profiles: {}".format(",".join(PROFILES.keys())))
+    parser.add_argument("--output", default="scapy-bench-{}.json".format(git_version()), help="results file")
+    parser.add_argument("--compare", default=None, help="results file of the baseline version")
+    parser.add_argument("--netns", default=NETNS, help="network namespace of the veth ports")
+    parser.add_argument("--inner", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    for name in args.profiles.split(","):
+        if name not in PROFILES:
+            parser.error("unknown profile {}".format(name))
+    if args.inner:
+        return run(args)
+
+    # run again in the namespace with the veth ports
+    setup_netns(args.netns)
+    try:
+        cmd = ["ip", "netns", "exec", args.netns, sys.executable, os.path.abspath(__file__), "--inner"]
+        return subprocess.call(cmd + sys.argv[1:])
+    finally:
+        sh("ip netns del {} 2>/dev/null".format(args.netns), False)
+
+if __name__ == '__main__':
+    sys.exit(main())
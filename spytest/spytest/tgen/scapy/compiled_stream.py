@@ -0,0 +1,301 @@
+"""
+Compiled streams for the scapy traffic generator TX path
+
+The legacy TX path mutates scapy layers field by field for every frame and
+serializes the packet again. A compiled stream renders the first frame once
+and applies the stream modifiers (MAC, IP, VLAN, L4 port increment/decrement
+and MAC lists) as patches at precomputed offsets of the raw frame, updating
+the IPv4 header and L4 checksums incrementally (RFC 1624).
+
+When the modifiers repeat with a short period all the frames of the period
+are rendered upfront into a ring and sending a frame is just picking the next
+buffer. Otherwise a single buffer is patched in place before each send.
+"""
+
+import sys
+import zlib
+import struct
+import socket
+import binascii
+
+from utils import Utils
+
+# max frames and bytes of the pre-rendered ring
+RING_MAX_FRAMES = 4096
+RING_MAX_BYTES = 16 * 1024 * 1024
+
+# length of the stream signature inserted before the CRC
+SIG_LEN = 8
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_8021Q = 0x8100
+ETH_P_IPV6 = 0x86DD
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_ICMPV6 = 58
+
+if sys.version_info[0] >= 3:
+    def buf_view(buf, size):
+        return memoryview(buf)[:size]
+    def gcd(a, b):
+        while b: a, b = b, a % b
+        return a
+else:
+    def buf_view(buf, size):
+        return buffer(buf, 0, size) # pylint: disable=undefined-variable
+    from fractions import gcd
+
+def lcm(a, b):
+    return a * b // gcd(a, b)
+
+def mac2int(mac):
+    return int(mac.replace(':', '').replace(".", ''), 16)
+
+def ipv4_2int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def bytes2int(data):
+    return int(binascii.hexlify(data), 16)
+
+def int2bytes(value, width):
+    return bytearray(binascii.unhexlify("%0*x" % (2 * width, value)))
+
+def fold_csum(s):
+    while s >> 16:
+        s = (s & 0xFFFF) + (s >> 16)
+    return s
+
+def csum_update(buf, csum_offset, old, new, zero_is_none=False):
+    """
+    Incrementally update the 16-bit ones complement checksum at csum_offset
+    for the change of bytes old to new: HC' = ~(~HC + ~m + m')
+    The changed bytes must be 16-bit aligned relative to the checksummed data
+    """
+    hc = struct.unpack_from('!H', buf, csum_offset)[0]
+    if zero_is_none and hc == 0:
+        return # UDP over IPv4 without checksum
+    s = ~hc & 0xFFFF
+    for i in range(0, len(old), 2):
+        s += ~((old[i] << 8) | old[i+1]) & 0xFFFF
+        s += (new[i] << 8) | new[i+1]
+    hc = ~fold_csum(s) & 0xFFFF
+    if zero_is_none and hc == 0:
+        hc = 0xFFFF
+    struct.pack_into('!H', buf, csum_offset, hc)
+
+class FrameField(object):
+    """
+    Stream modifier of a frame field
+    @offset offset of the field in the frame
+    @width width of the field in bytes
+    @values list of the field values for list mode
+    @csums list of (checksum offset, zero means no checksum) covering the field
+    """
+
+    def __init__(self, name, offset, width, mode, base, step, count, values=None, csums=None, mask=None):
+        self.name = name
+        self.offset = offset
+        self.width = width
+        self.mode = mode
+        self.base = base
+        self.step = step
+        self.count = count
+        self.values = values
+        self.csums = csums or []
+        self.bits = 8 * width
+        self.mask = mask if mask is not None else (1 << self.bits) - 1
+
+    def period(self):
+        """number of frames after which the field repeats, 0 if it does not repeat soon"""
+        if self.mode == "list":
+            return len(self.values)
+        return self.count
+
+    def value(self, index):
+        if self.mode == "list":
+            return self.values[index % len(self.values)]
+        if self.count > 0:
+            index = index % self.count
+        if self.mode in ["increment", "incr"]:
+            return (self.base + self.step * index) & self.mask
+        return (self.base - self.step * index) & self.mask
+
+    def patch(self, buf, index):
+        offset, width = self.offset, self.width
+        old = bytearray(buf[offset:offset+width])
+        value = self.value(index)
+        if self.mask != (1 << self.bits) - 1:
+            # keep the bits outside of the mask e.g. VLAN priority
+            value = value | (bytes2int(old) & ~self.mask)
+        new = int2bytes(value, width)
+        if old == new:
+            return
+        buf[offset:offset+width] = new
+        for csum_offset, zero_is_none in self.csums:
+            csum_update(buf, csum_offset, old, new, zero_is_none)
+
+class CompiledStream(object):
+    """
+    Pre-rendered frames of a stream
+    @frame first frame of the stream including the signature and CRC
+    @fields list of FrameField modifiers
+    """
+
+    def __init__(self, frame, fields):
+        self.fields = fields
+        self.index = 0
+        self.ring = None
+        self.stamp_buf = None
+        self.buf = bytearray(frame)
+        self.size = len(self.buf)
+
+        period = 1
+        for field in fields:
+            field_period = field.period()
+            if field_period <= 0:
+                period = 0
+                break
+            period = lcm(period, field_period)
+            if period > RING_MAX_FRAMES:
+                break
+
+        if 0 < period <= RING_MAX_FRAMES and period * self.size <= RING_MAX_BYTES:
+            self.ring = []
+            for index in range(period):
+                self.apply(index)
+                self.ring.append(bytes(self.buf))
+            self.buf = None
+
+    def apply(self, index):
+        for field in self.fields:
+            field.patch(self.buf, index)
+        self.update_crc(self.buf)
+
+    def update_crc(self, buf):
+        crc = zlib.crc32(buf_view(buf, self.size - 4)) & 0xFFFFFFFF
+        struct.pack_into('!I', buf, self.size - 4, socket.htonl(crc))
+
+    def next_frame(self, trailer=None):
+        """
+        frame to be sent next, valid till the next call of advance
+        @trailer bytes to be inserted before the signature e.g. sequence number
+        """
+        if self.ring is not None:
+            frame = self.ring[self.index % len(self.ring)]
+            if trailer is None:
+                return frame
+            if self.stamp_buf is None:
+                self.stamp_buf = bytearray(self.size)
+            self.stamp_buf[:] = frame
+            frame = self.stamp_buf
+        else:
+            for field in self.fields:
+                field.patch(self.buf, self.index)
+            frame = self.buf
+        if trailer is not None:
+            end = self.size - 4 - SIG_LEN
+            frame[end-len(trailer):end] = trailer
+        self.update_crc(frame)
+        return frame
+
+    def advance(self):
+        self.index = self.index + 1
+
+def get_mode(kws, name, modes):
+    mode = kws.get(name, "fixed").strip()
+    if mode != "fixed" and mode not in modes:
+        raise ValueError("unsupported {} = {}".format(name, mode))
+    return mode
+
+def add_mac_field(fields, kws, prefix, offset, addr_key, default_addr):
+    mode = get_mode(kws, prefix + "_mode", ["increment", "decrement", "list"])
+    if mode == "fixed":
+        return
+    base, values = 0, None
+    if mode == "list":
+        values = [mac2int(mac) for mac in Utils.make_list(kws[addr_key])]
+        if len(values) <= 1:
+            return
+    else:
+        base = mac2int(Utils.make_list(kws.get(addr_key, default_addr))[0].replace(".", ":"))
+    step = mac2int(kws.get(prefix + "_step", "00:00:00:00:00:01"))
+    count = Utils.intval(kws, prefix + "_count", 0)
+    fields.append(FrameField(prefix, offset, 6, mode, base, step, count, values))
+
+def add_int_field(fields, kws, prefix, offset, width, csums, base, step_default, mask=None, parse=int):
+    mode = get_mode(kws, prefix + "_mode", ["increment", "decrement", "incr", "decr"])
+    if mode == "fixed":
+        return
+    step = parse(str(kws.get(prefix + "_step", step_default)))
+    count = Utils.intval(kws, prefix + "_count", 0)
+    fields.append(FrameField(prefix, offset, width, mode, base, step, count, csums=csums, mask=mask))
+
+def compile_stream(frame, kws):
+    """
+    Compile the stream to pre-rendered frames
+    @frame first frame of the stream as sent by the legacy path
+    @kws stream parameters, after build_first
+    @return CompiledStream or raises ValueError if the stream can't be compiled
+    """
+    frame = bytearray(frame)
+    fields = []
+
+    # Ethernet and VLAN
+    add_mac_field(fields, kws, "mac_dst", 0, "mac_dst", "00:00:00:00:00:00")
+    add_mac_field(fields, kws, "mac_src", 6, "mac_src", "00:00:01:00:00:01")
+    offset = 12
+    ether_type = struct.unpack_from('!H', frame, offset)[0]
+    if ether_type == ETH_P_8021Q:
+        vlan_id = Utils.intval(kws, "vlan_id", 0)
+        add_int_field(fields, kws, "vlan_id", 14, 2, [], vlan_id, 1, mask=0x0FFF)
+        offset = offset + 4
+        ether_type = struct.unpack_from('!H', frame, offset)[0]
+    offset = offset + 2
+
+    if ether_type == ETH_P_ARP:
+        add_mac_field(fields, kws, "arp_src_hw", offset + 8, "arp_src_hw_addr", "00:00:01:00:00:02")
+        add_mac_field(fields, kws, "arp_dst_hw", offset + 18, "arp_dst_hw_addr", "00:00:00:00:00:00")
+    elif ether_type == ETH_P_IP:
+        ihl = (frame[offset] & 0x0F) * 4
+        proto = frame[offset + 9]
+        l4_offset = offset + ihl
+        l4_csums = []
+        if proto == IPPROTO_TCP:
+            l4_csums = [(l4_offset + 16, False)]
+        elif proto == IPPROTO_UDP:
+            l4_csums = [(l4_offset + 6, True)]
+        csums = [(offset + 10, False)] + l4_csums
+        for prefix, field_offset, default in [("ip_src", 12, "0.0.0.0"), ("ip_dst", 16, "192.0.0.1")]:
+            base = ipv4_2int(kws.get(prefix + "_addr", default))
+            add_int_field(fields, kws, prefix, offset + field_offset, 4, csums, base, "0.0.0.1", parse=ipv4_2int)
+        add_l4_fields(fields, kws, proto, l4_offset, l4_csums)
+    elif ether_type == ETH_P_IPV6:
+        proto = frame[offset + 6]
+        l4_offset = offset + 40
+        l4_csums = []
+        if proto == IPPROTO_TCP:
+            l4_csums = [(l4_offset + 16, False)]
+        elif proto == IPPROTO_UDP:
+            l4_csums = [(l4_offset + 6, False)]
+        elif proto == IPPROTO_ICMPV6:
+            l4_csums = [(l4_offset + 2, False)]
+        for prefix, field_offset, default in [("ipv6_src", 8, "fe80:0:0:0:0:0:0:12"),
+                                              ("ipv6_dst", 24, "fe80:0:0:0:0:0:0:22")]:
+            base = Utils.ipv6_ip2long(kws.get(prefix + "_addr", default))
+            add_int_field(fields, kws, prefix, offset + field_offset, 16, l4_csums, base, "::1",
+                          parse=Utils.ipv6_ip2long)
+        add_l4_fields(fields, kws, proto, l4_offset, l4_csums)
+
+    return CompiledStream(frame, fields)
+
+def add_l4_fields(fields, kws, proto, l4_offset, l4_csums):
+    if proto == IPPROTO_TCP:
+        prefix = "tcp"
+    elif proto == IPPROTO_UDP:
+        prefix = "udp"
+    else:
+        return
+    for name, field_offset in [("src_port", 0), ("dst_port", 2)]:
+        base = Utils.intval(kws, "{}_{}".format(prefix, name), 0)
+        add_int_field(fields, kws, "{}_{}".format(prefix, name), l4_offset + field_offset, 2, l4_csums, base, 1)
@@ -5,6 +5,8 @@ import threading
 
 from packet import ScapyPacket
 from or_event import OrEvent
+from pcap_replay import flow_key
+from txengine import TxEngine, TxWorker, TX_BATCH, POLL_INTERVAL
 from utils import Utils
 from logger import Logger
 
@@ -29,6 +31,9 @@ class ScapyDriver(object):
         self.utils = Utils(self.dry, logger=self.logger)
         self.iface = port.iface
         self.iface_status = None
+        self.tx_count = 0
+        self.tx_process = self.utils.get_env_int("SPYTEST_SCAPY_TX_PROCESS", 1)
+        self.tx_batch = self.utils.get_env_int("SPYTEST_SCAPY_TX_BATCH", TX_BATCH)
         self.packet = ScapyPacket(port.iface, dry=self.dry, dbg=self.dbg,
                                   logger=self.logger)
         self.rxInit()
@@ -118,8 +123,7 @@ class ScapyDriver(object):
             # read packets
             while self.rx_any_enable():
                 try:
-                    packet = self.packet.readp(iface=self.iface)
-                    if packet:
+                    for packet in self.packet.readp(iface=self.iface):
                         self.handle_recv(None, packet)
                 except Exception as e:
                     if str(e) != "[Errno 100] Network is down":
@@ -150,11 +154,21 @@ class ScapyDriver(object):
             self.logger.debug("{} framesReceived: {}".format(self.iface, framesReceived))
         if pktlen > 1518:
             self.port.incrStat('oversizeFramesReceived')
-        for stream in self.port.track_streams:
-            if self.packet.match_stream(stream, packet):
-                stream.incrStat('framesReceived')
-                stream.incrStat('bytesReceived', pktlen)
-                break # no need to check in other streams
+        # lookup the stream by the signature inserted before CRC
+        if pktlen < 12:
+            return
+        stream = self.port.track_index.get(packet[-12:-4])
+        if not stream and self.port.track_flows:
+            # frames of replayed pcap files are counted per flow
+            key = flow_key(packet)
+            stream = self.port.track_flows.get(key)
+            if stream:
+                stream.incrFlowStat(key, pktlen)
+        if stream:
+            stream.incrStat('framesReceived')
+            stream.incrStat('bytesReceived', pktlen)
+            if stream.rx_seq:
+                self.packet.track_seq(stream, packet)
 
     def handle_capture(self, packet):
         self.pkts_captured.append(packet)
@@ -237,6 +251,8 @@ class ScapyDriver(object):
         for stream in self.port.streams.values():
             if stream.kws.get("transmit_mode", "continuous") != "continuous":
                 non_continuous = True
+            elif stream.replay and stream.replay.loops:
+                non_continuous = True
 
         if non_continuous:
             # wait for max 30 seconds to finish ????
@@ -301,7 +317,6 @@ class ScapyDriver(object):
                     self.logger.debug(" start {} {}/{}".format(stream.stream_id, stream.enable, stream.enable2))
                 if stream.enable and stream.enable2:
                     pwa = self.packet.build_first(stream)
-                    pwa.tx_time = time.clock()
                     pwa_list.append(pwa)
                     sids[stream.stream_id] = 0
                     self.stop_ack_wait(stream.stream_id)
@@ -319,79 +334,88 @@ class ScapyDriver(object):
             self.logger.debug("txThreadMainInner {} Nothing Todo".format(self.iface))
             return
 
-        tx_count = 0
-        while (self.txState.is_set()):
+        self.tx_count = 0
+        if self.tx_process and not self.dry:
+            self.txWorkersMain(pwa_list, sids)
+        else:
+            self.txEngineMain(pwa_list, sids)
+        self.logger.debug("txThreadMainInner {} Completed {}".format(self.iface, self.tx_count))
+
+    def txEngineMain(self, pwa_list, sids):
+
+        def is_enabled(entry):
+            return self.is_tx_enabled(entry.pwa)
+
+        def on_sent(entry, frames, nbytes):
+            self.tx_sent(entry.pwa, frames, nbytes, entry.achieved_rate())
+
+        def on_error(entry):
+            entry.pwa.stream.enable2 = False
+
+        def poll(engine):
+            if not self.txState.is_set():
+                return False
             # call start again to see if new streams are created
             # while there are transmitting streams
-            if not self.txThreadMainInnerStart(pwa_list, sids):
+            new_list = []
+            self.txThreadMainInnerStart(new_list, sids)
+            for pwa in new_list:
+                engine.add(pwa)
+            return bool(engine.heap)
+
+        engine = TxEngine(self.packet, self.iface, self.tx_batch, is_enabled,
+                          on_sent, on_error, poll, self.logger)
+        for pwa in pwa_list:
+            engine.add(pwa)
+        engine.run()
+
+    def txWorkersMain(self, pwa_list, sids):
+        workers = [TxWorker(self.packet, self.iface, self.tx_batch, pwa_list, self.logger)]
+        while self.txState.is_set():
+            time.sleep(POLL_INTERVAL)
+
+            # streams created while transmitting run in a new worker
+            new_list = []
+            if self.txThreadMainInnerStart(new_list, sids):
+                workers.append(TxWorker(self.packet, self.iface, self.tx_batch, new_list, self.logger))
+
+            alive = False
+            for worker in workers:
+                alive = worker.is_alive() or alive
+                worker.sync(self.is_tx_enabled, self.tx_sent)
+            if not alive:
                 break
 
-            # sort based on next packet send time
-            pwa_list.sort(key=self.pwa_sort)
+        for worker in workers:
+            worker.stop()
+            worker.sync(self.is_tx_enabled, self.tx_sent)
 
-            pwa_next_list = []
-            for pwa in pwa_list:
-                if not pwa.stream.enable or not pwa.stream.enable2:
-                    continue
-                self.pwa_wait(pwa)
-                try:
-                    send_start_time = time.clock()
-                    pkt = self.send_packet(pwa, pwa.stream.stream_id)
-                    bytesSent = len(pkt)
-                    send_time = time.clock() - send_start_time
-
-                    # increment port counters
-                    framesSent = self.port.incrStat('framesSent')
-                    self.port.incrStat('bytesSent', bytesSent)
-                    if self.dbg > 2:
-                        self.logger.debug("{} framesSent: {}".format(self.iface, framesSent))
-                    pwa.stream.incrStat('framesSent')
-                    pwa.stream.incrStat('bytesSent', bytesSent)
-                    tx_count = tx_count + 1
-
-                    # increment stream counters
-                    stream_tx = self.stream_pkts[pwa.stream.stream_id] + 1
-                    self.stream_pkts[pwa.stream.stream_id] = stream_tx
-                    if self.dbg > 2 or (self.dbg > 1 and stream_tx%100 == 99):
-                        self.logger.debug("{}/{} framesSent: {}".format(self.iface,
-                                            pwa.stream.stream_id, stream_tx))
-                except Exception as e:
-                    self.logger.log_exception(e, traceback.format_exc())
-                    pwa.stream.enable2 = False
-                else:
-                    build_start_time = time.clock()
-                    pwa = self.packet.build_next(pwa)
-                    if not pwa: continue
-                    build_time = time.clock() - build_start_time
-                    ipg = self.packet.build_ipg(pwa)
-                    pwa.tx_time = time.clock() + ipg - build_time - send_time
-                    pwa_next_list.append(pwa)
-            pwa_list = pwa_next_list
-        self.logger.debug("txThreadMainInner {} Completed {}".format(self.iface, tx_count))
-
-    def pwa_sort(self, pwa):
-        return pwa.tx_time
-
-    def pwa_wait(self, pwa):
-        delay = pwa.tx_time - time.clock()
-        if self.dbg > 2 or (self.dbg > 1 and pwa.left != 0):
-            self.logger.debug("stream: {} delay: {} pps: {}".format(pwa.stream.stream_id, delay, pwa.rate_pps))
-        if delay <= 0:
-            # yield
-            time.sleep(0)
-        elif delay > 1.0/10:
-            self.utils.msleep(delay * 1000, 10)
-        elif delay > 1.0/100:
-            self.utils.msleep(delay * 1000, 1)
-        elif delay > 1.0/200:
-            self.utils.usleep(delay * 1000 * 1000, 100)
-        elif delay > 1.0/500:
-            self.utils.usleep(delay * 1000 * 1000, 10)
-        else:
-            self.utils.usleep(delay * 1000 * 1000)
+    def is_tx_enabled(self, pwa):
+        return pwa.stream.enable and pwa.stream.enable2
+
+    def tx_sent(self, pwa, frames, nbytes, rate):
 
-    def send_packet(self, pwa, stream_name):
-        return self.packet.send_packet(pwa, self.iface, stream_name, pwa.left)
+        # increment port counters
+        framesSent = self.port.incrStat('framesSent', frames)
+        self.port.incrStat('bytesSent', nbytes)
+        if self.dbg > 2:
+            self.logger.debug("{} framesSent: {}".format(self.iface, framesSent))
+        pwa.stream.incrStat('framesSent', frames)
+        pwa.stream.incrStat('bytesSent', nbytes)
+        pwa.stream.stats.txRateRequested = pwa.rate_requested
+        pwa.stream.stats.txRateAchieved = int(rate)
+        # port rate is the sum of the rates of its streams
+        streams = list(self.port.streams.values())
+        self.port.stats.txRateRequested = sum([stream.stats.txRateRequested for stream in streams])
+        self.port.stats.txRateAchieved = sum([stream.stats.txRateAchieved for stream in streams])
+        self.tx_count = self.tx_count + frames
+
+        # increment stream counters
+        stream_tx = self.stream_pkts[pwa.stream.stream_id] + frames
+        self.stream_pkts[pwa.stream.stream_id] = stream_tx
+        if self.dbg > 2 or (self.dbg > 1 and stream_tx%100 < frames):
+            self.logger.debug("{}/{} framesSent: {}".format(self.iface,
+                                pwa.stream.stream_id, stream_tx))
 
     def createInterface(self, intf):
         return self.packet.if_create(intf)
@@ -3,6 +3,7 @@ import re
 import sys
 import zlib
 import time
+import struct
 import copy
 import random
 import textwrap
@@ -22,6 +23,8 @@ from scapy.config import Conf
 from dicts import SpyTestDict
 from utils import Utils
 from logger import Logger
+from compiled_stream import compile_stream, SIG_LEN
+from pcap_replay import ReplayCursor, ReplayTiming
 
 try: print("SCAPY VERSION = {}".format(Conf().version))
 except Exception: print("SCAPY VERSION = UNKNOWN")
@@ -35,12 +38,16 @@ this_dir = os.path.join(os.path.dirname(__file__))
 #dbg > 2 --- recv/send packet summary
 #dbg > 3 --- recv/send packet hex
 
+# sequence number and tx timestamp (usec, low 32 bits) inserted before the signature
+SEQ_TRAILER_FMT = '!II'
+SEQ_TRAILER_LEN = struct.calcsize(SEQ_TRAILER_FMT)
+
 stale_list_ignore = [
     "port_handle",
     "port_handle2",
     "stream_id",
     "mode",
-    "rate_percent", #TODO
+    "rate_percent",
 
     #
     "circuit_endpoint_type",
@@ -130,6 +137,9 @@ class ScapyPacket(object):
         except Exception: self.logger.info("SCAPY VERSION = UNKNOWN")
         self.utils = Utils(self.dry, logger=self.logger)
         self.max_rate_pps = self.utils.get_env_int("SPYTEST_SCAPY_MAX_RATE_PPS", 100)
+        self.compiled_streams = self.utils.get_env_int("SPYTEST_SCAPY_COMPILED_STREAMS", 1)
+        self.rx_ring_enable = self.utils.get_env_int("SPYTEST_SCAPY_RX_RING", 1)
+        self.rx_buffer_size = self.utils.get_env_int("SPYTEST_SCAPY_RX_BUFFER_KB", 8192) * 1024
         self.dbg = dbg
         self.show_summary = bool(self.dbg > 2)
         self.hex = hex
@@ -138,6 +148,7 @@ class ScapyPacket(object):
         self.tx_count = 0
         self.rx_count = 0
         self.rx_sock = None
+        self.rx_ring = None
         self.tx_sock = None
         self.finished = False
         self.exabgp_nslist = []
@@ -225,6 +236,9 @@ class ScapyPacket(object):
         self.logger.info("ScapyPacket {} cleanup...".format(self.iface))
         self.exabgpd_stop_all()
         self.finished = True
+        if self.rx_ring:
+            self.rx_ring.close()
+            self.rx_ring = None
         self.rx_sock = self.close_sock(self.rx_sock)
         self.tx_sock = self.close_sock(self.tx_sock)
         self.init_bridge(self.iface)
@@ -234,64 +248,75 @@ class ScapyPacket(object):
         if not self.iface or self.dry: return
         ETH_P_ALL = 3
         self.rx_sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-        self.rx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 12 * 1024)
+        self.rx_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rx_buffer_size)
+        if self.rx_ring_enable:
+            # ring of 1MB blocks, the ring must be setup before bind
+            block_size = 1 << 20
+            block_nr = max(self.rx_buffer_size // block_size, 2)
+            try:
+                self.rx_ring = afpacket.RxRing(self.rx_sock, block_size, block_nr)
+            except Exception as exp:
+                self.logger.info("Failed to setup RX ring {} {}".format(self.iface, exp))
+                self.rx_ring = None
         self.rx_sock.bind((self.iface+"-rx", 3))
-        afpacket.enable_auxdata(self.rx_sock)
+        if not self.rx_ring:
+            afpacket.enable_auxdata(self.rx_sock)
 
     def set_link(self, status):
         msg = "link:{} status:{}".format
         self.logger.debug(msg(iface, status))
 
     def readp(self, iface):
+        """
+        Receive the next batch of packets
+        @return list of raw frames, which are decoded only when tracing
+        """
 
         if self.dry:
             time.sleep(2)
-            return None
+            return []
 
         if not self.iface:
-            return None
+            return []
 
         try:
-            data = afpacket.recv(self.rx_sock, 12 * 1024)
+            if self.rx_ring:
+                frames = self.rx_ring.recv_block()
+            else:
+                frames = [afpacket.recv(self.rx_sock, 12 * 1024)]
         except Exception as exp:
             if self.finished:
-                return None
+                return []
             raise exp
-        packet = Ether(data)
-        self.rx_count = self.rx_count + 1
+        self.rx_count = self.rx_count + len(frames)
         self.trace_stats()
 
         if self.dbg > 1:
-            cmd = "" if not self.show_summary else packet.command()
-            msg = "readp:{} len:{} count:{} {}".format
-            self.logger.debug(msg(iface, len(data), self.rx_count, cmd))
+            for data in frames:
+                cmd = "" if not self.show_summary else Ether(data).command()
+                msg = "readp:{} len:{} count:{} {}".format
+                self.logger.debug(msg(iface, len(data), self.rx_count, cmd))
+                if self.dbg > 2:
+                    self.trace_packet(data, self.hex)
 
-        if self.dbg > 2:
-            self.trace_packet(packet, self.hex)
-
-        return packet
+        return frames
 
     def sendp(self, pkt, data, iface, stream_name, left):
         self.tx_count = self.tx_count + 1
         self.trace_stats()
 
         if self.dbg > 2 or (self.dbg > 1 and left != 0):
-            cmd = "" if not self.show_summary else pkt.command()
+            cmd = "" if not self.show_summary or pkt is None else pkt.command()
             msg = "sendp:{}:{} len:{} count:{} {}".format
             self.logger.debug(msg(iface, stream_name, len(data), self.tx_count, cmd))
 
-        if self.dbg > 2:
+        if self.dbg > 2 and pkt is not None:
             self.trace_packet(pkt, self.hex)
 
         if not self.dry:
-            if not self.tx_sock:
-                try:
-                    self.tx_sock = L2Socket(iface)
-                except Exception as exp:
-                    self.logger.debug("Failed to create L2Socket {} {}".format(iface, exp))
-
-            if self.tx_sock:
-                try: return self.tx_sock.send(data)
+            sock = self.get_tx_sock(iface)
+            if sock:
+                try: return sock.send(data)
                 except Exception: pass
             try:
                 sendp(data, iface=iface, verbose=False)
@@ -317,6 +342,56 @@ class ScapyPacket(object):
         if hex: hexdump(pkt)
 
     def send_packet(self, pwa, iface, stream_name, left):
+        bstr = self.next_frame(pwa)
+        self.sendp(pwa.pkt, bstr, iface, stream_name, left)
+        return bstr
+
+    def next_frame(self, pwa):
+        """frame of the stream to be sent next, valid till build_next"""
+        if pwa.replay:
+            return pwa.replay.frame()
+        trailer = self.seq_trailer(pwa) if pwa.rx_seq else None
+        if pwa.compiled:
+            return pwa.compiled.next_frame(trailer)
+        return self.build_frame(pwa, trailer)
+
+    def send_frames(self, pwa, frames, iface, stream_name):
+        """
+        send batch of frames of the stream with single system call
+        @return number of frames sent
+        """
+        if self.dbg > 2 or (self.dbg > 1 and pwa.left != 0):
+            msg = "send_frames:{}:{} count:{} tx_count:{}"
+            self.logger.debug(msg.format(iface, stream_name, len(frames), self.tx_count))
+        sock = self.get_tx_sock(iface) if not self.dry else None
+        if sock:
+            try:
+                self.tx_count = self.tx_count + len(frames)
+                return afpacket.sendmmsg(sock, frames)
+            except Exception as exp:
+                self.logger.debug("Failed to send batch {} {}".format(iface, exp))
+                self.tx_count = self.tx_count - len(frames)
+        for data in frames:
+            self.sendp(pwa.pkt, data, iface, stream_name, pwa.left)
+        return len(frames)
+
+    def get_tx_sock(self, iface):
+        if not self.tx_sock:
+            try:
+                self.tx_sock = L2Socket(iface)
+            except Exception as exp:
+                self.logger.debug("Failed to create L2Socket {} {}".format(iface, exp))
+                return None
+        # send the raw frame directly, avoids copy of pre-rendered frames
+        return getattr(self.tx_sock, "outs", None) or self.tx_sock
+
+    def seq_trailer(self, pwa):
+        trailer = struct.pack(SEQ_TRAILER_FMT, pwa.seq & 0xFFFFFFFF,
+                              int(time.time() * 1000000) & 0xFFFFFFFF)
+        pwa.seq = pwa.seq + 1
+        return trailer
+
+    def build_frame(self, pwa, trailer=None):
         if pwa.padding:
             strpkt = str(pwa.pkt/pwa.padding)
         else:
@@ -328,15 +403,18 @@ class ScapyPacket(object):
             if not sid: sid = "DeadBeef"
             if sid: strpkt = strpkt[:-len(sid)] + sid
 
+        # insert sequence number and timestamp before stream id
+        if trailer:
+            end = len(strpkt) - SIG_LEN
+            strpkt = strpkt[:end-len(trailer)] + trailer + strpkt[end:]
+
         pkt_bytes = self.utils.tobytes(strpkt)
         try:
             crc1 = '{:08x}'.format(socket.htonl(zlib.crc32(pkt_bytes) & 0xFFFFFFFF))
             crc = binascii.unhexlify(crc1)
         except Exception:
             crc = binascii.unhexlify('00' * 4)
-        bstr = bytes(strpkt+crc)
-        self.sendp(pwa.pkt, bstr, iface, stream_name, left)
-        return bstr
+        return bytes(strpkt+crc)
 
     def check(self, pkt):
         pkt.do_build()
@@ -369,6 +447,13 @@ class ScapyPacket(object):
         except Exception:
             self.logger.info(traceback.format_exc())
 
+    def pop_float(self, d, prop, default):
+        val = d.pop(prop, "{}".format(default))
+        try:
+            return float(str(val))
+        except Exception:
+            self.logger.info(traceback.format_exc())
+
     def pop_hex(self, d, prop, default):
         val = d.pop(prop, "{}".format(default))
         try:
@@ -533,6 +618,9 @@ class ScapyPacket(object):
 
     def build_first(self, stream):
 
+        if stream.replay:
+            return self.build_replay(stream)
+
         self.fill_emulation_params(stream)
 
         kws = copy.deepcopy(stream.kws)
@@ -544,11 +632,9 @@ class ScapyPacket(object):
 
         duration = self.pop_int(kws, "duration", 1)
         duration2 = self.pop_int(kws, "duration2", 0)
-        rate_percent = self.pop_int(kws, "rate_percent", 0)
+        rate_percent = self.pop_float(kws, "rate_percent", 0)
+        rate_bps = self.pop_int(kws, "rate_bps", 0)
         rate_pps = self.pop_int(kws, "rate_pps", 1)
-        if rate_percent > 0:
-            rate_pps = self.max_rate_pps
-            self.banner("rate_percent {} not supported using {} pps".format(rate_percent, rate_pps))
         l2_encap = self.pop_str(kws, "l2_encap", "")
         l3_protocol = self.pop_str(kws, "l3_protocol", "")
         l4_protocol = self.pop_str(kws, "l4_protocol", "")
@@ -571,6 +657,8 @@ class ScapyPacket(object):
         length_mode = self.pop_str(kws, "length_mode", "fixed")
         l3_length = self.pop_int(kws, "l3_length", 110)
         data_pattern_mode = self.pop_str(kws, "data_pattern_mode", "fixed")
+        if rate_percent > 0 or rate_bps > 0:
+            rate_pps = self.rate_to_pps(rate_percent, rate_bps, frame_size)
 
         mac_dst_mode  = kws.get("mac_dst_mode", "fixed").strip()
         if mac_dst_mode not in ["fixed", "increment", "decrement", "list"]:
@@ -718,8 +806,10 @@ class ScapyPacket(object):
 
         # update padding length based on frame_size
         add_signature = False
+        padRoom = int(frame_size_min - len(pkt) - 4)
         if length_mode == "fixed":
             padLen = int(frame_size - len(pkt) - 4)
+            padRoom = padLen
             if padLen > 0:
                 padding = Padding(binascii.unhexlify('00' * padLen))
                 pkt = self.check(pkt/padding)
@@ -731,12 +821,13 @@ class ScapyPacket(object):
                 self.error("unhandled option {} = {}".format(key, value))
 
         pwa = SpyTestDict()
+        pwa.replay = None
         pwa.add_signature = add_signature
         pwa.pkt = pkt
         pwa.left = left
-        pwa.burst_sent = 0
         pwa.pkts_per_burst = pkts_per_burst
         pwa.transmit_mode = transmit_mode
+        pwa.rate_requested = rate_pps
         if rate_pps > self.max_rate_pps:
             self.error("drop the rate from {} to {}".format(rate_pps, self.max_rate_pps))
             rate_pps = self.max_rate_pps
@@ -768,6 +859,50 @@ class ScapyPacket(object):
         pwa.frame_size_step = frame_size_step
         self.add_padding(pwa, True)
 
+        # embed sequence number and timestamp when all the frames have room for them
+        pwa.rx_seq = bool(padRoom >= SIG_LEN + SEQ_TRAILER_LEN)
+        pwa.seq = 0
+        stream.rx_seq = pwa.rx_seq
+        stream.rx_next_seq = 0
+
+        # pre-render the frames when the length is fixed
+        pwa.compiled = None
+        if self.compiled_streams and length_mode == "fixed":
+            try:
+                pwa.compiled = compile_stream(self.build_frame(pwa), stream.kws)
+            except Exception as exp:
+                self.logger.debug("stream {} not compiled: {}".format(stream.stream_id, exp))
+
+        return pwa
+
+    def build_replay(self, stream):
+        replay = stream.replay
+        kws = stream.kws
+        self.logger.info("=========== build_replay {} = {}".format(stream.stream_id, replay))
+
+        rate_pps = self.utils.intval(kws, "rate_pps", 1)
+        rate_percent = float(kws.get("rate_percent", 0))
+        rate_bps = self.utils.intval(kws, "rate_bps", 0)
+        if rate_percent > 0 or rate_bps > 0:
+            rate_pps = self.rate_to_pps(rate_percent, rate_bps, replay.bytes // len(replay))
+
+        pwa = SpyTestDict()
+        pwa.stream = stream
+        pwa.pkt = None
+        pwa.left = 0
+        pwa.transmit_mode = "continuous"
+        pwa.pkts_per_burst = 1
+        pwa.rate_requested = rate_pps
+        if replay.timing == "rate" and rate_pps > self.max_rate_pps:
+            self.error("drop the rate from {} to {}".format(rate_pps, self.max_rate_pps))
+            rate_pps = self.max_rate_pps
+        pwa.rate_pps = rate_pps
+        pwa.add_signature = False
+        pwa.rx_seq = False
+        pwa.compiled = None
+        pwa.replay = ReplayCursor(replay)
+        if replay.timing == "original":
+            pwa.pacer = lambda now, size: ReplayTiming(pwa.replay, replay.speedup, size, now)
         return pwa
 
     def add_padding(self, pwa, first):
@@ -796,6 +931,11 @@ class ScapyPacket(object):
 
     def build_next_dma(self, pwa):
 
+        # compiled stream has the modifiers applied on the pre-rendered frames
+        if pwa.compiled:
+            pwa.compiled.advance()
+            return pwa
+
         # Change Ether SRC MAC
         mac_src_mode  = pwa.stream.kws.get("mac_src_mode", "fixed").strip()
         mac_src_step  = pwa.stream.kws.get("mac_src_step", "00:00:00:00:00:01")
@@ -985,9 +1125,9 @@ class ScapyPacket(object):
             tcp_dst_port_count  = self.utils.intval(pwa.stream.kws, "tcp_dst_port_count", 0)
             if tcp_dst_port_mode in ["increment", "decrement", "incr", "decr"]:
                 if tcp_dst_port_mode in ["increment", "incr"]:
-                    pwa.pkt[TCP].dport = pwa.pkt[TCP].sport + tcp_dst_port_step
+                    pwa.pkt[TCP].dport = pwa.pkt[TCP].dport + tcp_dst_port_step
                 else:
-                    pwa.pkt[TCP].dport = pwa.pkt[TCP].sport - tcp_dst_port_step
+                    pwa.pkt[TCP].dport = pwa.pkt[TCP].dport - tcp_dst_port_step
                 pwa.tcp_dst_port_count = pwa.tcp_dst_port_count + 1
                 if tcp_dst_port_count > 0 and pwa.tcp_dst_port_count >= tcp_dst_port_count:
                     pwa.pkt[TCP].dport = self.utils.intval(pwa.stream.kws, "tcp_dst_port", 0)
@@ -1019,9 +1159,9 @@ class ScapyPacket(object):
             udp_dst_port_count  = self.utils.intval(pwa.stream.kws, "udp_dst_port_count", 0)
             if udp_dst_port_mode in ["increment", "decrement", "incr", "decr"]:
                 if udp_dst_port_mode in ["increment", "incr"]:
-                    pwa.pkt[UDP].dport = pwa.pkt[UDP].sport + udp_dst_port_step
+                    pwa.pkt[UDP].dport = pwa.pkt[UDP].dport + udp_dst_port_step
                 else:
-                    pwa.pkt[UDP].dport = pwa.pkt[UDP].sport - udp_dst_port_step
+                    pwa.pkt[UDP].dport = pwa.pkt[UDP].dport - udp_dst_port_step
                 pwa.udp_dst_port_count = pwa.udp_dst_port_count + 1
                 if udp_dst_port_count > 0 and pwa.udp_dst_port_count >= udp_dst_port_count:
                     pwa.pkt[UDP].dport = self.utils.intval(pwa.stream.kws, "udp_dst_port", 0)
@@ -1038,6 +1178,9 @@ class ScapyPacket(object):
         if self.dbg > 2 or (self.dbg > 1 and pwa.left != 0):
             self.logger.debug("build_next {}/{} {} left={}".format(self.iface, pwa.stream.stream_id, pwa.transmit_mode, pwa.left))
 
+        if pwa.replay:
+            return pwa if pwa.replay.advance() else None
+
         if pwa.transmit_mode in ["continuous"] and pwa.duration2 > 0:
             if pwa.left <= 0: return None
             pwa.left = pwa.left - 1
@@ -1049,7 +1192,6 @@ class ScapyPacket(object):
             return pwa
 
         if pwa.transmit_mode in ["continuous_burst"]:
-            pwa.burst_sent = pwa.burst_sent + 1
             pwa = self.build_next_dma(pwa)
             return pwa
 
@@ -1057,31 +1199,69 @@ class ScapyPacket(object):
             pwa = self.build_next_dma(pwa)
             if not pwa: return None
 
-        pwa.burst_sent = pwa.burst_sent + 1
-
         if pwa.left > 1:
             pwa.left = pwa.left - 1
             return pwa
 
         return None
 
-    def build_ipg(self, pwa):
-        if pwa.burst_sent != 0 and pwa.burst_sent < pwa.pkts_per_burst:
-            return 0
-        pwa.burst_sent = 0
-        pps = self.utils.min_value(pwa.rate_pps, self.max_rate_pps)
-        return (1.0 * pwa.pkts_per_burst)/float(pps)
+    def get_link_speed(self):
+        """link speed in Mbps, 10G when not known e.g. for virtual interfaces"""
+        try:
+            with open("/sys/class/net/{}/speed".format(self.iface)) as fp:
+                speed = int(fp.read().strip())
+            if speed > 0:
+                return speed
+        except Exception:
+            pass
+        return 10000
+
+    def rate_to_pps(self, rate_percent, rate_bps, frame_size):
+        # frame takes 20 more bytes of preamble and inter frame gap on the wire
+        wire_bits = (frame_size + 20) * 8
+        if rate_bps > 0:
+            return max(1, int(rate_bps // wire_bits))
+        line_bps = self.get_link_speed() * 1000000
+        return max(1, int(line_bps * rate_percent / 100 // wire_bits))
 
     def match_stream(self, stream, pkt):
         sid = stream.get_sid()
         if not sid: return False
-        strpkt = str(pkt)
+        strpkt = pkt if isinstance(pkt, bytes) else str(pkt)
         if sid == strpkt[-12:-4]:
             self.logger.debug("{}: CMP0: {} {}".format(self.iface, sid, strpkt[-12:-4]))
             return True
         #self.logger.debug("{}: CMP1: {} {}".format(self.iface, sid, strpkt[-12:-4]))
         return False
 
+    def track_seq(self, stream, frame):
+        """
+        update latency and sequence counters of the stream
+        from the sequence number and timestamp embedded in the frame
+        """
+        end = len(frame) - 4 - SIG_LEN
+        seq, tx_time = struct.unpack(SEQ_TRAILER_FMT, frame[end-SEQ_TRAILER_LEN:end])
+        latency = (int(time.time() * 1000000) - tx_time) & 0xFFFFFFFF
+        if stream.incrStat('latencyFrames') == 1 or latency < stream.stats.latencyMin:
+            stream.stats.latencyMin = latency
+        if latency > stream.stats.latencyMax:
+            stream.stats.latencyMax = latency
+        stream.incrStat('latencyTotal', latency)
+
+        gap = (seq - stream.rx_next_seq) & 0xFFFFFFFF
+        if gap == 0:
+            stream.rx_next_seq = (seq + 1) & 0xFFFFFFFF
+        elif gap < 0x80000000:
+            # frames in between are lost unless they arrive later
+            stream.incrStat('sequenceErrors')
+            stream.incrStat('framesLost', gap)
+            stream.rx_next_seq = (seq + 1) & 0xFFFFFFFF
+        else:
+            # late frame, it was counted as lost
+            stream.incrStat('framesReordered')
+            if stream.stats.framesLost > 0:
+                stream.incrStat('framesLost', -1)
+
     def if_delete_cmds(self, index, intf):
         ns = "{}_{}".format(intf.name, index)
 
@@ -0,0 +1,298 @@
+"""
+Replay of pcap files by the scapy traffic generator
+
+The pcap file is memory mapped copy-on-write and indexed once: offset, length
+and capture time of each frame, plus the offsets of the VLAN tag, IPv4 header
+and L4 checksum. The requested MAC, VLAN and IPv4 rewrites are applied in the
+mapping using the offset tables, updating the checksums incrementally, so
+sending a frame is just a slice of the mapping.
+
+The frames are sent either at the stream rate or at the original timing of
+the capture. Received frames are counted per flow (addresses, protocol and
+ports) on the track port.
+"""
+
+import os
+import mmap
+import array
+import struct
+import socket
+import binascii
+
+from compiled_stream import csum_update, ETH_P_IP, ETH_P_IPV6
+from utils import Utils
+
+# pcap magic read as little endian: byte order, timestamp fraction unit
+PCAP_MAGIC = {
+    0xa1b2c3d4: ('<', 1e-6),
+    0xd4c3b2a1: ('>', 1e-6),
+    0xa1b23c4d: ('<', 1e-9),
+    0x4d3cb2a1: ('>', 1e-9),
+}
+PCAP_HDR_LEN = 24
+PCAP_REC_LEN = 16
+LINKTYPE_ETHERNET = 1
+
+VLAN_TPIDS = [0x8100, 0x88a8, 0x9100]
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+def flow_key(frame):
+    """
+    flow of the IPv4/IPv6 frame: addresses, protocol and TCP/UDP ports
+    @return bytes or None for other frames
+    """
+    try:
+        l3 = 14
+        ether_type = struct.unpack_from('!H', frame, 12)[0]
+        while ether_type in VLAN_TPIDS:
+            ether_type = struct.unpack_from('!H', frame, l3 + 2)[0]
+            l3 = l3 + 4
+        if ether_type == ETH_P_IP:
+            vihl, frag, proto = struct.unpack_from('!B5xH1xB', frame, l3)
+            addrs = frame[l3+12:l3+20]
+            l4 = l3 + (vihl & 0x0F) * 4
+            if frag & 0x1FFF:
+                proto = 0 # no ports in non first fragments
+        elif ether_type == ETH_P_IPV6:
+            proto = struct.unpack_from('!B', frame, l3 + 6)[0]
+            addrs = frame[l3+8:l3+40]
+            l4 = l3 + 40
+        else:
+            return None
+    except struct.error:
+        return None
+    ports = frame[l4:l4+4] if proto in [IPPROTO_TCP, IPPROTO_UDP] else b''
+    return bytes(addrs) + struct.pack('!B', proto) + bytes(ports)
+
+def flow_name(key):
+    """readable form of the flow_key"""
+    if len(key) in [9, 13]:
+        family, alen = socket.AF_INET, 4
+    else:
+        family, alen = socket.AF_INET6, 16
+    src = socket.inet_ntop(family, key[:alen])
+    dst = socket.inet_ntop(family, key[alen:2*alen])
+    proto = struct.unpack_from('!B', key, 2*alen)[0]
+    if len(key) == 2*alen + 5:
+        sport, dport = struct.unpack_from('!HH', key, 2*alen + 1)
+        return "{}:{} -> {}:{} proto {}".format(src, sport, dst, dport, proto)
+    return "{} -> {} proto {}".format(src, dst, proto)
+
+class PcapReplay(object):
+    """
+    Indexed and rewritten pcap file
+    @kws stream parameters
+        pcap_file: path of the pcap file
+        pcap_mac_src, pcap_mac_dst: MAC addresses set in all the frames
+        pcap_vlan_id: VLAN id set in the tagged frames
+        pcap_ip_map: dict of IPv4 addresses replaced in source and destination
+        pcap_timing: 'rate' to send at the stream rate or 'original'
+        pcap_speedup: speedup of the original timing
+        pcap_loop: number of times the file is sent, 0 to send till stopped
+    """
+
+    def __init__(self, kws):
+        self.path = kws["pcap_file"]
+        self.timing = kws.get("pcap_timing", "rate")
+        if self.timing not in ["rate", "original"]:
+            raise ValueError("unsupported pcap_timing = {}".format(self.timing))
+        self.speedup = float(kws.get("pcap_speedup", 1)) or 1.0
+        self.loops = Utils.intval(kws, "pcap_loop", 1)
+
+        # frame index and offset tables, -1 when not present
+        self.offsets = array.array('l')
+        self.lengths = array.array('l')
+        self.times = array.array('d')
+        self.vlan_offsets = array.array('l')
+        self.ip_offsets = array.array('l')
+        self.l4_csum_offsets = array.array('l')
+        self.udp_csum = array.array('b')
+
+        with open(self.path, "rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            self.index()
+            self.rewrite(kws)
+        except Exception:
+            self.close()
+            raise
+
+        count = len(self.offsets)
+        self.bytes = sum(self.lengths)
+        self.duration = self.times[-1] - self.times[0]
+        # time between the last frame and the first frame of next loop
+        gap = self.duration / (count - 1) if count > 1 else 0
+        self.period = self.duration + gap
+        self.flows = self.get_flows()
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+            self.mm = None
+
+    def index(self):
+        mm = self.mm
+        if len(mm) < PCAP_HDR_LEN:
+            raise ValueError("{} is not pcap file".format(self.path))
+        magic = struct.unpack_from('<I', mm, 0)[0]
+        if magic not in PCAP_MAGIC:
+            raise ValueError("{} is not pcap file, pcapng is not supported".format(self.path))
+        endian, unit = PCAP_MAGIC[magic]
+        linktype = struct.unpack_from(endian + 'I', mm, 20)[0]
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError("{} unsupported link type {}".format(self.path, linktype))
+
+        rec_fmt = endian + 'IIII'
+        offset, size = PCAP_HDR_LEN, len(mm)
+        while offset + PCAP_REC_LEN <= size:
+            ts_sec, ts_frac, incl_len, _ = struct.unpack_from(rec_fmt, mm, offset)
+            offset = offset + PCAP_REC_LEN
+            if offset + incl_len > size:
+                break # truncated file
+            self.offsets.append(offset)
+            self.lengths.append(incl_len)
+            self.times.append(ts_sec + ts_frac * unit)
+            self.index_frame(offset, incl_len)
+            offset = offset + incl_len
+        if not self.offsets:
+            raise ValueError("{} has no frames".format(self.path))
+
+    def index_frame(self, offset, length):
+        mm = self.mm
+        vlan_offset, ip_offset, l4_csum_offset, udp = -1, -1, -1, 0
+        end = offset + length
+        l3 = offset + 14
+        if l3 <= end:
+            ether_type = struct.unpack_from('!H', mm, l3 - 2)[0]
+            while ether_type in VLAN_TPIDS and l3 + 4 <= end:
+                if vlan_offset < 0:
+                    vlan_offset = l3
+                ether_type = struct.unpack_from('!H', mm, l3 + 2)[0]
+                l3 = l3 + 4
+            if ether_type == ETH_P_IP and l3 + 20 <= end:
+                ip_offset = l3
+                vihl, frag, proto = struct.unpack_from('!B5xH1xB', mm, l3)
+                l4 = l3 + (vihl & 0x0F) * 4
+                if not frag & 0x1FFF:
+                    if proto == IPPROTO_TCP and l4 + 18 <= end:
+                        l4_csum_offset = l4 + 16
+                    elif proto == IPPROTO_UDP and l4 + 8 <= end:
+                        l4_csum_offset, udp = l4 + 6, 1
+        self.vlan_offsets.append(vlan_offset)
+        self.ip_offsets.append(ip_offset)
+        self.l4_csum_offsets.append(l4_csum_offset)
+        self.udp_csum.append(udp)
+
+    def rewrite(self, kws):
+        mm = self.mm
+        mac_src = kws.get("pcap_mac_src", None)
+        mac_dst = kws.get("pcap_mac_dst", None)
+        vlan_id = kws.get("pcap_vlan_id", None)
+        ip_map = {}
+        for old, new in (kws.get("pcap_ip_map", None) or {}).items():
+            ip_map[socket.inet_aton(old)] = bytearray(socket.inet_aton(new))
+        if mac_dst is not None:
+            mac_dst = binascii.unhexlify(mac_dst.replace(":", "").replace(".", ""))
+        if mac_src is not None:
+            mac_src = binascii.unhexlify(mac_src.replace(":", "").replace(".", ""))
+        if mac_src is None and mac_dst is None and vlan_id is None and not ip_map:
+            return
+
+        for index, offset in enumerate(self.offsets):
+            if self.lengths[index] < 12:
+                continue
+            if mac_dst is not None:
+                mm[offset:offset+6] = mac_dst
+            if mac_src is not None:
+                mm[offset+6:offset+12] = mac_src
+            vlan_offset = self.vlan_offsets[index]
+            if vlan_id is not None and vlan_offset >= 0:
+                tci = struct.unpack_from('!H', mm, vlan_offset)[0]
+                tci = (tci & 0xF000) | (int(vlan_id) & 0x0FFF)
+                struct.pack_into('!H', mm, vlan_offset, tci)
+            ip_offset = self.ip_offsets[index]
+            if ip_map and ip_offset >= 0:
+                csums = [(ip_offset + 10, False)]
+                if self.l4_csum_offsets[index] >= 0:
+                    csums.append((self.l4_csum_offsets[index], bool(self.udp_csum[index])))
+                for addr_offset in [ip_offset + 12, ip_offset + 16]:
+                    old = mm[addr_offset:addr_offset+4]
+                    new = ip_map.get(old)
+                    if new is None:
+                        continue
+                    mm[addr_offset:addr_offset+4] = bytes(new)
+                    for csum_offset, zero_is_none in csums:
+                        csum_update(mm, csum_offset, bytearray(old), new, zero_is_none)
+
+    def frame(self, index):
+        offset = self.offsets[index]
+        return self.mm[offset:offset+self.lengths[index]]
+
+    def get_flows(self):
+        flows, seen = [], set()
+        for index in range(len(self.offsets)):
+            key = flow_key(self.frame(index))
+            if key is not None and key not in seen:
+                seen.add(key)
+                flows.append(key)
+        return flows
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __str__(self):
+        return "{} frames: {} bytes: {} duration: {:.3f}".format(os.path.basename(self.path),
+                                                                 len(self), self.bytes, self.duration)
+
+class ReplayCursor(object):
+    """
+    Position of a transmitting stream in the replay
+    """
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.index = 0
+        self.loop = 0
+
+    def frame(self):
+        return self.replay.frame(self.index)
+
+    def advance(self):
+        """move to the next frame, returns False when all the loops are sent"""
+        self.index = self.index + 1
+        if self.index >= len(self.replay):
+            self.index = 0
+            self.loop = self.loop + 1
+            if self.replay.loops and self.loop >= self.replay.loops:
+                return False
+        return True
+
+    def offset(self, ahead=0):
+        """capture time of the frame ahead of the position relative to the first frame"""
+        count = len(self.replay)
+        index = self.index + ahead
+        loop = self.loop + index // count
+        index = index % count
+        return loop * self.replay.period + self.replay.times[index] - self.replay.times[0]
+
+class ReplayTiming(object):
+    """
+    Paces the replay at the original timing, same interface as TokenBucket
+    """
+
+    def __init__(self, cursor, speedup, size, now):
+        self.cursor = cursor
+        self.speedup = speedup
+        self.size = size
+        self.start = now
+
+    def take(self, now, limit):
+        elapsed = (now - self.start) * self.speedup
+        count = 1
+        while count < limit and self.cursor.offset(count) <= elapsed:
+            count = count + 1
+        return count
+
+    def next_time(self, need=1):
+        return self.start + self.cursor.offset(need - 1) / self.speedup
@@ -1,18 +1,29 @@
 import copy
 import threading
+from collections import OrderedDict
 
 from dicts import SpyTestDict
 from driver import ScapyDriver
 from logger import Logger
 from utils import Utils
+from pcap_replay import PcapReplay, flow_name
 
 def initStatistics(stats):
     stats.clear()
     stats["framesSent"] = 0
     stats["bytesSent"] = 0
+    stats["txRateRequested"] = 0
+    stats["txRateAchieved"] = 0
     stats["framesReceived"] = 0
     stats["bytesReceived"] = 0
     stats["oversizeFramesReceived"] = 0
+    stats["latencyFrames"] = 0
+    stats["latencyMin"] = 0
+    stats["latencyMax"] = 0
+    stats["latencyTotal"] = 0
+    stats["sequenceErrors"] = 0
+    stats["framesLost"] = 0
+    stats["framesReordered"] = 0
     stats["userDefinedStat1"] = 0
     stats["userDefinedStat2"] = 0
     stats["captureFilter"] = 0
@@ -35,15 +46,52 @@ class ScapyStream(object):
         self.enable2 = False
         self.stats = SpyTestDict()
         initStatistics(self.stats)
+        self.rx_seq = False
+        self.rx_next_seq = 0
+        self.replay = None
+        # Map <flow key, [frames, bytes]> of received frames of replayed flows
+        self.flow_stats = OrderedDict()
+        self.load_replay()
         #print("ScapyStream: {} {} {}".format(self.port, self.stream_id, kws))
         if self.track_port:
             self.track_port.track_streams.append(self)
+            self.track_port.track_index[self.get_sid()] = self
+            self.track_flows()
         self.stream_lock = threading.Lock()
 
     def __del__(self):
         print("ScapyStream {} exiting...".format(self.stream_id))
         if self.track_port:
             self.track_port.track_streams.remove(self)
+            self.track_port.track_index.pop(self.get_sid(), None)
+            self.untrack_flows()
+        if self.replay:
+            self.replay.close()
+
+    def load_replay(self):
+        if self.replay:
+            self.replay.close()
+            self.replay = None
+        if "pcap_file" in self.kws:
+            self.replay = PcapReplay(self.kws)
+
+    def untrack_flows(self):
+        for key in self.flow_stats:
+            if self.track_port.track_flows.get(key) is self:
+                del self.track_port.track_flows[key]
+        self.flow_stats = OrderedDict()
+
+    def track_flows(self):
+        if not self.replay:
+            return
+        for key in self.replay.flows:
+            self.flow_stats[key] = [0, 0]
+            self.track_port.track_flows.setdefault(key, self)
+
+    def incrFlowStat(self, key, pktlen):
+        flow = self.flow_stats[key]
+        flow[0] = flow[0] + 1
+        flow[1] = flow[1] + pktlen
 
     def get_sid(self):
         #if not self.track_port: return None
@@ -110,6 +158,8 @@ class ScapyPort(object):
         self.utils = Utils(self.dry, logger=self.logger)
         self.streams = SpyTestDict()
         self.track_streams = []
+        self.track_index = dict()
+        self.track_flows = dict()
         self.interfaces = SpyTestDict()
         self.stats = SpyTestDict()
         initStatistics(self.stats)
@@ -134,6 +184,8 @@ class ScapyPort(object):
             stream.track_port = None
             stream.unlock()
         self.track_streams = []
+        self.track_index = dict()
+        self.track_flows = dict()
 
     def cleanup(self):
         self.logger.debug("ScapyPort {} cleanup...".format(self.name))
@@ -174,6 +226,13 @@ class ScapyPort(object):
             res.append([stream, stream.stats])
         return res
 
+    def getFlowStats(self):
+        res = []
+        for stream in self.track_streams:
+            for key, flow in stream.flow_stats.items():
+                res.append([stream, flow_name(key), flow[0], flow[1]])
+        return res
+
     def traffic_control_complete(self, *args, **kws):
         self.driver.startTransmitComplete(**kws)
 
@@ -194,6 +253,8 @@ class ScapyPort(object):
             initStatistics(self.stats)
             for stream in self.streams.values():
                 initStatistics(stream.stats)
+                for key in stream.flow_stats:
+                    stream.flow_stats[key] = [0, 0]
             self.driver.clear_stats()
         else:
             self.error("unsupported", "traffic_control: action", action)
@@ -250,7 +311,15 @@ class ScapyPort(object):
             stream_id = kws.get('stream_id', None)
             if stream_id not in self.streams:
                 self.error("invalid", "traffic_config-modify-stream_id", stream_id)
-            self.streams[stream_id].kws.update(kws)
+            stream = self.streams[stream_id]
+            stream.kws.update(kws)
+            if any(key.startswith("pcap_") for key in kws):
+                stream.lock()
+                stream.load_replay()
+                if stream.track_port:
+                    stream.untrack_flows()
+                    stream.track_flows()
+                stream.unlock()
         else:
             self.error("unsupported", "traffic_config: mode", mode)
         return res
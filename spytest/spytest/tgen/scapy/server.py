@@ -490,7 +490,8 @@ class ScapyServer(object):
         port_handle = kws.get('port_handle', None)
         stream_id = kws.get('stream', None)
         mode = kws.get('mode', "aggregate")
-        time.sleep(5)
+        if kws.pop('stats_wait', True):
+            time.sleep(5)
         if mode == "aggregate" and stream_id:
             for port in self.ports.values():
                 for stream, stats in port.getStreamStats():
@@ -520,6 +521,23 @@ class ScapyServer(object):
                     stream_id = stream.stream_id
                     res[port_handle]["stream"][stream_id] = SpyTestDict()
                     self.fill_stats(res[port_handle]["stream"][stream_id], stats, stats)
+        elif mode == "flow" and port_handle in self.ports and self.ports[port_handle].getFlowStats():
+            # flows of replayed pcap files received on the port
+            res[mode] = SpyTestDict()
+            for index, (stream, name, frames, nbytes) in enumerate(self.ports[port_handle].getFlowStats()):
+                flow = SpyTestDict()
+                flow["flow_name"] = name
+                flow["pgid_value"] = 'N/A'
+                flow["tracking"] = SpyTestDict()
+                flow["tracking"]["count"] = "1"
+                flow["tracking"]["1"] = SpyTestDict()
+                flow["tracking"]["1"]["tracking_name"] = "Traffic_Item"
+                flow["tracking"]["1"]["tracking_value"] = stream.stream_id
+                flow["tx"] = SpyTestDict()
+                flow["rx"] = SpyTestDict()
+                flow["rx"]["total_pkts"] = frames
+                flow["rx"]["pkt_byte_count"] = nbytes
+                res[mode][str(index + 1)] = flow
         elif mode == "flow":
             if not port_handle or port_handle not in self.ports:
                 self.error("Invalid", "port_handle", port_handle)
@@ -551,6 +569,30 @@ class ScapyServer(object):
              self.logger.todo("unhandled", "mode", mode)
         return self.trace_result(res)
 
+    def exposed_tg_batch(self, node_name, requests):
+        """
+        execute several requests in single call
+        @requests list of [function name e.g. tg_traffic_stats, kws]
+        @return list of {"result": value} or {"error": message} in the same order
+        """
+        if not self.validate_node_name(node_name, requests): return ""
+        retval, stats_wait = [], True
+        for func_name, kws in requests:
+            func = getattr(self, "exposed_" + str(func_name), None)
+            if not func or func_name == "tg_batch":
+                retval.append({"error": "Invalid request {}".format(func_name)})
+                continue
+            kws = dict(kws or {})
+            if func_name == "tg_traffic_stats":
+                # wait for the stats to settle only once for the batch
+                kws["stats_wait"] = stats_wait
+                stats_wait = False
+            try:
+                retval.append({"result": func(node_name, **kws)})
+            except Exception as exp:
+                retval.append({"error": str(exp)})
+        return self.trace_result(retval)
+
     def stat_value(self, val, detailed=False):
         if not detailed:
             return val
@@ -558,7 +600,8 @@ class ScapyServer(object):
 
     def fill_stats(self, res, tx_stats, rx_stats, detailed=False):
         res["tx"] = SpyTestDict()
-        res["tx"]["total_pkt_rate"] = self.stat_value(1, detailed)
+        res["tx"]["total_pkt_rate"] = self.stat_value(tx_stats.txRateAchieved, detailed)
+        res["tx"]["requested_pkt_rate"] = self.stat_value(tx_stats.txRateRequested, detailed)
         res["tx"]["raw_pkt_count"] = self.stat_value(tx_stats.framesSent, detailed)
         res["tx"]["pkt_byte_count"] = self.stat_value(tx_stats.bytesSent, detailed)
         res["tx"]["total_pkts"] = self.stat_value(tx_stats.framesSent, detailed)
@@ -568,6 +611,15 @@ class ScapyServer(object):
         res["rx"]["pkt_byte_count"] = self.stat_value(rx_stats.bytesReceived, detailed)
         res["rx"]["total_pkts"] = self.stat_value(rx_stats.framesReceived, detailed)
         res["rx"]["oversize_count"] = self.stat_value(rx_stats.oversizeFramesReceived, detailed)
+        # latency in nano seconds, measured for frames with embedded timestamp
+        latency_frames = rx_stats.latencyFrames
+        avg_delay = rx_stats.latencyTotal * 1000 // latency_frames if latency_frames else 0
+        res["rx"]["min_delay"] = self.stat_value(rx_stats.latencyMin * 1000, detailed)
+        res["rx"]["max_delay"] = self.stat_value(rx_stats.latencyMax * 1000, detailed)
+        res["rx"]["avg_delay"] = self.stat_value(avg_delay, detailed)
+        res["rx"]["loss_pkts"] = self.stat_value(rx_stats.framesLost, detailed)
+        res["rx"]["reorder_pkts"] = self.stat_value(rx_stats.framesReordered, detailed)
+        res["rx"]["sequence_errors"] = self.stat_value(rx_stats.sequenceErrors, detailed)
 
 if __name__ == '__main__':
     Logger.setup()
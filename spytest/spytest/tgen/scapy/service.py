@@ -75,4 +75,6 @@ class ScapyService(object):
     def tg_emulation_igmp_control(self, *args, **kws):
         self.server.trace_api(*args, **kws)
         return self.server.exposed_tg_emulation_igmp_control(*args, **kws)
-
+    def tg_batch(self, *args, **kws):
+        self.server.trace_api(*args, **kws)
+        return self.server.exposed_tg_batch(*args, **kws)
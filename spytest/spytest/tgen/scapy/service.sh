@@ -37,5 +37,8 @@ cleanup()
 }
 trap cleanup SIGINT SIGTERM EXIT
 
+python wire-service.py > $HOME/wire-service.log 2>&1 &
+echo $! > $HOME/wire-service.pid
+
 python pyro-service.py 2>&1 | tee $HOME/service.log
 
@@ -0,0 +1,275 @@
+"""
+Transmit engine of the scapy traffic generator
+
+The streams of a port are scheduled with a heap keyed on the time of the
+next send. Each stream is paced by a token bucket refilled at the stream
+rate. The frames which are due are sent in a batch with a single system
+call, the batch is limited by the bucket size and burst transmit modes
+wait till the whole burst is due.
+
+TxWorker runs the engine for a group of streams in a forked process so that
+the ports don't starve each other on the GIL. The counters are passed back
+to the driver in shared memory. The server is multithreaded, so the locks the
+process takes are held while forking: the process can't inherit a lock held
+by another thread.
+"""
+
+import time
+import heapq
+import logging
+import traceback
+import multiprocessing
+
+# max frames sent in single batch by continuous streams
+TX_BATCH = 32
+# interval of polling for new and disabled streams
+POLL_INTERVAL = 0.1
+# spin instead of sleep when the next frame is due sooner
+SPIN_TIME = 0.001
+
+class TokenBucket(object):
+    """
+    Token bucket refilled with rate tokens per second up to size tokens
+    """
+
+    def __init__(self, rate, size, now, tokens=1):
+        self.rate = float(rate)
+        self.size = size
+        self.tokens = float(tokens)
+        self.last = now
+
+    def take(self, now, limit):
+        """take up to limit tokens available at the given time"""
+        self.tokens = min(self.size, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        # tolerate rounding of the time when the tokens are due
+        count = min(int(self.tokens + 0.001), limit)
+        self.tokens = self.tokens - count
+        return count
+
+    def next_time(self, need=1):
+        """time when the given number of tokens is available"""
+        return self.last + max(0.0, need - self.tokens) / self.rate
+
+class TxEntry(object):
+    """
+    Scheduling state of a stream
+    @index index of the stream in the engine
+    @pwa stream build state returned by ScapyPacket.build_first
+    """
+
+    def __init__(self, index, pwa, batch, now):
+        self.index = index
+        self.pwa = pwa
+        self.need = 1
+        if pwa.transmit_mode in ["continuous_burst", "single_burst"]:
+            self.need = max(1, pwa.pkts_per_burst)
+        size = max(self.need, batch)
+        if pwa.get("pacer"):
+            self.bucket = pwa.pacer(now, size)
+        else:
+            self.bucket = TokenBucket(max(1, pwa.rate_pps), size, now, self.need)
+        self.next_time = now
+        self.sent = 0
+        self.first_time = None
+        self.last_time = None
+
+    def achieved_rate(self):
+        """achieved rate in pps between the first and the last sent frame"""
+        if self.sent < 2 or self.last_time <= self.first_time:
+            return 0
+        return (self.sent - 1) / (self.last_time - self.first_time)
+
+class TxEngine(object):
+    """
+    Heap scheduler of streams
+    @packet ScapyPacket used to build and send the frames
+    @is_enabled callback(entry) checking if the stream is still enabled
+    @on_sent callback(entry, frames, bytes) called after each batch
+    @on_error callback(entry) called when sending fails, the stream is dropped
+    @poll callback(engine) called every POLL_INTERVAL, returns False to stop
+    """
+
+    def __init__(self, packet, iface, batch, is_enabled, on_sent, on_error, poll, logger):
+        self.packet = packet
+        self.iface = iface
+        self.batch = max(1, batch)
+        self.is_enabled = is_enabled
+        self.on_sent = on_sent
+        self.on_error = on_error
+        self.poll = poll
+        self.logger = logger
+        self.heap = []
+        self.entries = []
+
+    def add(self, pwa):
+        entry = TxEntry(len(self.entries), pwa, self.batch, time.time())
+        self.entries.append(entry)
+        heapq.heappush(self.heap, (entry.next_time, entry.index))
+        return entry
+
+    def run(self):
+        next_poll = 0
+        while True:
+            now = time.time()
+            if now >= next_poll:
+                if not self.poll(self):
+                    break
+                next_poll = now + POLL_INTERVAL
+            if not self.heap:
+                time.sleep(max(0, next_poll - now))
+                continue
+
+            next_time, index = self.heap[0]
+            delay = next_time - now
+            if delay > SPIN_TIME:
+                time.sleep(max(0, min(delay - SPIN_TIME, next_poll - now)))
+                continue
+            if delay > 0:
+                continue
+
+            heapq.heappop(self.heap)
+            entry = self.entries[index]
+            if not self.is_enabled(entry):
+                continue
+            try:
+                if not self.send(entry, now):
+                    continue
+            except Exception as exp:
+                self.logger.log_exception(exp, traceback.format_exc())
+                self.on_error(entry)
+                continue
+            heapq.heappush(self.heap, (entry.next_time, index))
+
+    def send(self, entry, now):
+        """send the frames due, returns False when the stream is completed"""
+        pwa, completed = entry.pwa, False
+        count = entry.bucket.take(now, entry.bucket.size)
+        frames = []
+        for _ in range(count):
+            # copy as the compiled frame is reused for the next frame
+            frames.append(bytes(self.packet.next_frame(pwa)))
+            if not self.packet.build_next(pwa):
+                completed = True
+                break
+        if frames:
+            self.packet.send_frames(pwa, frames, self.iface, pwa.stream.stream_id)
+            if entry.first_time is None:
+                entry.first_time = now
+            entry.last_time = now
+            entry.sent = entry.sent + len(frames)
+            self.on_sent(entry, len(frames), sum([len(frame) for frame in frames]))
+        entry.next_time = entry.bucket.next_time(entry.need)
+        return not completed
+
+def fork_locks(logger, pwa_list):
+    """
+    locks taken by the TX process: the stream locks and the logging locks
+    @return list of the locks in the order they are taken by the server threads
+    """
+    locks = [getattr(pwa.stream, "stream_lock", None) for pwa in pwa_list]
+    locks.append(getattr(logger, "lock", None))
+    locks.append(getattr(logging, "_lock", None))
+    handlers = list(logging.getLogger().handlers)
+    if getattr(logger, "logger", None):
+        handlers.extend(logger.logger.handlers)
+    locks.extend([handler.lock for handler in handlers])
+    retval, seen = [], set()
+    for lock in locks:
+        if lock is not None and id(lock) not in seen:
+            seen.add(id(lock))
+            retval.append(lock)
+    return retval
+
+class TxWorker(object):
+    """
+    Runs TxEngine for a group of streams in a forked process
+    @pwa_list streams to be transmitted
+    """
+
+    # shared counters of each stream: frames, bytes, achieved rate
+    COUNTERS = 3
+
+    def __init__(self, packet, iface, batch, pwa_list, logger):
+        self.packet = packet
+        self.iface = iface
+        self.batch = batch
+        self.pwa_list = pwa_list
+        self.logger = logger
+        count = len(pwa_list)
+        self.enable = multiprocessing.Array('b', [1] * count, lock=False)
+        self.counters = multiprocessing.Array('d', self.COUNTERS * count, lock=False)
+        self.synced = [[0, 0] for _ in range(count)]
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=self.main)
+        self.process.daemon = True
+        self.locks = fork_locks(logger, pwa_list)
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            self.process.start()
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
+    def main(self):
+        for lock in reversed(self.locks):
+            try:
+                lock.release()
+            except Exception:
+                # already re-initialized by the fork handlers of python
+                pass
+        engine = TxEngine(self.packet, self.iface, self.batch, self.is_enabled,
+                          self.on_sent, self.on_error, self.poll, self.logger)
+        for pwa in self.pwa_list:
+            engine.add(pwa)
+        try:
+            engine.run()
+        except Exception as exp:
+            self.logger.log_exception(exp, traceback.format_exc())
+
+    def is_enabled(self, entry):
+        return self.enable[entry.index] > 0
+
+    def on_sent(self, entry, frames, nbytes):
+        base = self.COUNTERS * entry.index
+        self.counters[base] = self.counters[base] + frames
+        self.counters[base + 1] = self.counters[base + 1] + nbytes
+        self.counters[base + 2] = entry.achieved_rate()
+
+    def on_error(self, entry):
+        self.enable[entry.index] = -1
+
+    def poll(self, engine):
+        return bool(engine.heap) and not self.stop_event.is_set()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def sync(self, is_enabled, on_sent):
+        """
+        propagate the stream enable flags to the worker and the counters from the worker
+        @is_enabled callback(pwa)
+        @on_sent callback(pwa, frames, bytes, achieved rate) with the frames sent since last sync
+        """
+        for index, pwa in enumerate(self.pwa_list):
+            if self.enable[index] < 0:
+                # sending failed in the worker
+                pwa.stream.enable2 = False
+                self.enable[index] = 0
+            elif self.enable[index] > 0 and not is_enabled(pwa):
+                self.enable[index] = 0
+            base = self.COUNTERS * index
+            frames = int(self.counters[base])
+            nbytes = int(self.counters[base + 1])
+            synced = self.synced[index]
+            if frames > synced[0]:
+                on_sent(pwa, frames - synced[0], nbytes - synced[1], self.counters[base + 2])
+                synced[0], synced[1] = frames, nbytes
+
+    def stop(self, timeout=10):
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
@@ -0,0 +1,28 @@
+import os
+import logging
+from datetime import datetime
+
+from server import ScapyServer
+from wire import WireServer
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+def create_instance():
+    dry = bool(os.getenv("SPYTEST_SCAPY_DRYRUN", "0") == "1")
+    time_spec = datetime.utcnow().strftime("%Y_%m_%d_%H_%M_%S_%f")
+    name = "inst-{}".format(time_spec)
+    server = ScapyServer(dry=dry, name=name)
+    server.trace_api("scapy-wire-service-started")
+    logger.info("Created %s", id(server))
+    return server
+
+def main():
+    port = int(os.getenv("SPYTEST_SCAPY_WIRE_PORT", "8010"))
+    server = WireServer(create_instance, port=port, logger=logger)
+    logger.info("WIRE ScapyService started on port %d", port)
+    server.serve_forever()
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Compact RPC transport of the scapy traffic generator service
+
+Each message is length prefixed: 4 bytes of big endian length, one byte of
+codec ('M' msgpack or 'J' JSON) and the encoded message. msgpack is used when
+it is installed, the reply uses the codec of the request so both ends don't
+need to have it.
+
+Requests and replies:
+    {"id": n, "call": "tg_x", "args": [...], "kws": {...}}
+        -> {"id": n, "result": value} or {"id": n, "error": message}
+    {"id": n, "subscribe": "tg_x", "args": [...], "kws": {...}, "interval": secs}
+        -> {"id": n, "event": value} pushed every interval
+    {"id": n, "unsubscribe": subscription id}
+        -> {"id": n, "result": True}
+
+The calls of a connection are executed in order by the connection thread,
+the subscriptions are polled by their own threads. Each connection has its
+own server instance, same as the pyro session instance mode.
+
+This module is also loaded by the client, so it only depends on stdlib.
+"""
+
+import sys
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+import traceback
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# max length of message accepted
+MAX_MSG_LEN = 256 * 1024 * 1024
+# timeout of the calls in seconds, same as the rpyc sync timeout
+CALL_TIMEOUT = 300
+
+HDR_FMT = '!Ic'
+HDR_LEN = struct.calcsize(HDR_FMT)
+
+if sys.version_info[0] >= 3:
+    def to_native(value, dict_type=dict):
+        # python2 peer packs its str values as msgpack bin
+        if isinstance(value, bytes):
+            try:
+                return value.decode('utf-8')
+            except UnicodeDecodeError:
+                return value
+        if isinstance(value, dict):
+            return dict_type([(to_native(k), to_native(v, dict_type)) for k, v in value.items()])
+        if isinstance(value, list):
+            return [to_native(v, dict_type) for v in value]
+        return value
+else:
+    def to_native(value, dict_type=dict):
+        if isinstance(value, unicode): # pylint: disable=undefined-variable
+            return value.encode('utf-8')
+        if isinstance(value, dict):
+            return dict_type([(to_native(k), to_native(v, dict_type)) for k, v in value.items()])
+        if isinstance(value, list):
+            return [to_native(v, dict_type) for v in value]
+        return value
+
+def encode(msg, codec=None):
+    if codec is None:
+        codec = b'M' if msgpack else b'J'
+    if codec == b'M':
+        data = msgpack.packb(msg, use_bin_type=True)
+    else:
+        data = json.dumps(msg, default=str).encode('utf-8')
+    return struct.pack(HDR_FMT, len(data), codec) + data
+
+def decode(codec, data, dict_type=dict):
+    if codec == b'M':
+        if not msgpack:
+            raise ValueError("msgpack message received but msgpack is not installed")
+        msg = msgpack.unpackb(data, raw=False)
+    else:
+        msg = json.loads(data.decode('utf-8'))
+    return to_native(msg, dict_type)
+
+def recv_exact(sock, size):
+    chunks, remaining = [], size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining = remaining - len(chunk)
+    return b''.join(chunks)
+
+def recv_msg(sock, dict_type=dict):
+    """
+    receive the next message
+    @return (codec, message) or (None, None) when the connection is closed
+    """
+    hdr = recv_exact(sock, HDR_LEN)
+    if hdr is None:
+        return None, None
+    size, codec = struct.unpack(HDR_FMT, hdr)
+    if size > MAX_MSG_LEN:
+        raise ValueError("message too long {}".format(size))
+    data = recv_exact(sock, size)
+    if data is None:
+        return None, None
+    return codec, decode(codec, data, dict_type)
+
+class WireConnection(object):
+    """
+    Server side of a client connection
+    @server instance of ScapyServer serving the connection
+    """
+
+    def __init__(self, sock, server, logger):
+        self.sock = sock
+        self.server = server
+        self.logger = logger
+        self.codec = None
+        self.send_lock = threading.Lock()
+        self.call_lock = threading.Lock()
+        self.subscriptions = {}
+
+    def send(self, msg):
+        data = encode(msg, self.codec)
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def invoke(self, name, args, kws):
+        func = getattr(self.server, "exposed_" + str(name), None)
+        if not func:
+            raise ValueError("Invalid request {}".format(name))
+        with self.call_lock:
+            return func(*args, **kws)
+
+    def serve(self):
+        try:
+            while True:
+                codec, msg = recv_msg(self.sock)
+                if msg is None:
+                    break
+                self.codec = codec
+                self.handle(msg)
+        except Exception as exp:
+            self.logger.info("connection failed: %s", exp)
+        finally:
+            for event in self.subscriptions.values():
+                event.set()
+            self.subscriptions = {}
+            self.sock.close()
+
+    def handle(self, msg):
+        msg_id = msg.get("id")
+        try:
+            if "call" in msg:
+                res = self.invoke(msg["call"], msg.get("args", []), msg.get("kws", {}))
+            elif "subscribe" in msg:
+                res = self.subscribe(msg_id, msg)
+            elif "unsubscribe" in msg:
+                event = self.subscriptions.pop(msg["unsubscribe"], None)
+                if event: event.set()
+                res = bool(event)
+            else:
+                raise ValueError("Invalid message {}".format(msg))
+            if res is not None:
+                self.send({"id": msg_id, "result": res})
+        except socket.error:
+            raise
+        except Exception as exp:
+            self.logger.info("request %s failed: %s", msg_id, traceback.format_exc())
+            self.send({"id": msg_id, "error": str(exp)})
+
+    def subscribe(self, msg_id, msg):
+        event = threading.Event()
+        self.subscriptions[msg_id] = event
+        interval = float(msg.get("interval", 1))
+        args = (msg["subscribe"], msg.get("args", []), msg.get("kws", {}))
+        thread = threading.Thread(target=self.poll, args=(msg_id, event, interval) + args)
+        thread.daemon = True
+        thread.start()
+        return None
+
+    def poll(self, msg_id, event, interval, name, args, kws):
+        while not event.is_set():
+            try:
+                self.send({"id": msg_id, "event": self.invoke(name, args, kws)})
+            except socket.error:
+                break
+            except Exception as exp:
+                self.send({"id": msg_id, "error": str(exp)})
+                break
+            event.wait(interval)
+        self.subscriptions.pop(msg_id, None)
+
+class WireServer(object):
+    """
+    Accepts the connections and serves each in a thread
+    @factory callable returning the server instance of a new connection
+    """
+
+    def __init__(self, factory, host="0.0.0.0", port=8010, logger=None):
+        self.factory = factory
+        self.logger = logger or logging.getLogger()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(16)
+
+    def serve_forever(self):
+        while True:
+            sock, addr = self.sock.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.logger.info("client connects: %s", addr)
+            thread = threading.Thread(target=self.serve, args=(sock, addr))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, sock, addr):
+        server = self.factory()
+        try:
+            WireConnection(sock, server, self.logger).serve()
+        finally:
+            self.logger.info("client disconnects: %s", addr)
+            del server
+
+class Subscription(object):
+    """
+    Results pushed by the server for a subscribe request
+    """
+
+    def __init__(self, client, sub_id):
+        self.client = client
+        self.sub_id = sub_id
+        self.cond = threading.Condition()
+        self.count = 0
+        self.value = None
+        self.error = None
+
+    def push(self, msg):
+        with self.cond:
+            if "error" in msg:
+                self.error = msg["error"]
+            else:
+                self.value = msg["event"]
+                self.count = self.count + 1
+            self.cond.notify_all()
+
+    def latest(self):
+        """last result received, None if nothing is received yet"""
+        if self.error:
+            raise ValueError(self.error)
+        return self.value
+
+    def wait(self, count=1, timeout=CALL_TIMEOUT):
+        """wait till count more results are received and return the last one"""
+        end = time.time() + timeout
+        with self.cond:
+            target = self.count + count
+            while self.count < target and not self.error:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    raise ValueError("timeout waiting for subscription {}".format(self.sub_id))
+                self.cond.wait(remaining)
+        return self.latest()
+
+    def close(self):
+        self.client.unsubscribe(self)
+
+class WireClient(object):
+    """
+    Client of WireServer, the remote functions are called as methods
+    @dict_type type of the dicts in the results e.g. SpyTestDict
+    """
+
+    def __init__(self, host, port=8010, dict_type=dict, timeout=CALL_TIMEOUT):
+        self.dict_type = dict_type
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.pending = {}
+        self.subscriptions = {}
+        self.closed = False
+        self.reader = threading.Thread(target=self.read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def remote(*args, **kws):
+            return self.call(name, *args, **kws)
+        return remote
+
+    def read(self):
+        try:
+            while True:
+                _, msg = recv_msg(self.sock, self.dict_type)
+                if msg is None:
+                    break
+                sub = self.subscriptions.get(msg.get("id"))
+                if sub and ("event" in msg or "error" in msg):
+                    sub.push(msg)
+                    continue
+                waiter = self.pending.get(msg.get("id"))
+                if waiter:
+                    waiter[1] = msg
+                    waiter[0].set()
+        except Exception:
+            pass
+        self.closed = True
+        for waiter in list(self.pending.values()):
+            waiter[0].set()
+
+    def request(self, msg, sub=None):
+        with self.lock:
+            self.last_id = self.last_id + 1
+            msg["id"] = self.last_id
+            waiter = [threading.Event(), None]
+            self.pending[msg["id"]] = waiter
+            if sub:
+                sub.sub_id = msg["id"]
+                self.subscriptions[msg["id"]] = sub
+            self.sock.sendall(encode(msg))
+        return waiter
+
+    def wait(self, msg_id, waiter):
+        try:
+            if not waiter[0].wait(self.timeout):
+                raise ValueError("timeout waiting for reply of request {}".format(msg_id))
+        finally:
+            self.pending.pop(msg_id, None)
+        if waiter[1] is None:
+            raise ValueError("connection to scapy server closed")
+        if "error" in waiter[1]:
+            raise ValueError(waiter[1]["error"])
+        return waiter[1]["result"]
+
+    def call(self, name, *args, **kws):
+        if self.closed:
+            raise ValueError("connection to scapy server closed")
+        msg = {"call": name, "args": list(args), "kws": kws}
+        waiter = self.request(msg)
+        return self.wait(msg["id"], waiter)
+
+    def subscribe(self, name, interval, *args, **kws):
+        """
+        call the function every interval seconds and push the results
+        @return Subscription
+        """
+        sub = Subscription(self, None)
+        msg = {"subscribe": name, "interval": interval, "args": list(args), "kws": kws}
+        self.request(msg, sub)
+        # there is no reply to subscribe, errors are pushed as events
+        self.pending.pop(msg["id"], None)
+        return sub
+
+    def unsubscribe(self, sub):
+        if self.subscriptions.pop(sub.sub_id, None) and not self.closed:
+            msg = {"unsubscribe": sub.sub_id}
+            waiter = self.request(msg)
+            self.wait(msg["id"], waiter)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
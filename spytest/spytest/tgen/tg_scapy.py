@@ -12,7 +12,8 @@ class ScapyClient(object):
         self.base = base
         self.conn = None
         self.logger = logger or logging.getLogger()
-        self.use_pyro = True
+        self.transport = os.getenv("SPYTEST_SCAPY_TRANSPORT", "pyro")
+        self.use_pyro = bool(self.transport == "pyro")
         self.node_name = ""
         self.filemode = bool(os.getenv("SPYTEST_FILE_MODE", "0") != "0")
         self.tg_ip = tg_ip
@@ -103,13 +104,26 @@ class ScapyClient(object):
             print (e)
             raise ValueError("Failed to connect to scapy server {}".format(e))
 
+    def wire_connect(self):
+        import imp
+        from spytest.dicts import SpyTestDict
+        path = os.path.join(os.path.dirname(__file__), "scapy", "wire.py")
+        wire = imp.load_source("scapy_tgen_wire", path)
+        try:
+            port = int(os.getenv("SPYTEST_SCAPY_WIRE_PORT", "8010"))
+            return wire.WireClient(self.tg_ip, port, dict_type=SpyTestDict)
+        except Exception as e:
+            raise ValueError("Failed to connect to scapy server {}".format(e))
+
     def scapy_connect(self, dry_run=False):
         self.tg_ns = 'scapy'
 
         if self.filemode:
             return None
 
-        if self.use_pyro:
+        if self.transport == "wire":
+            self.conn = self.wire_connect()
+        elif self.use_pyro:
             import Pyro4
             #uri = "PYRO:scapy-tgen@{}:{}".format(self.tg_ip, self.tg_port)
             uri = "PYRONAME:scapy-tgen@{}".format(self.tg_ip)
@@ -270,3 +284,33 @@ class ScapyClient(object):
         if self.filemode: return self.sim_execute(*args, **kwargs)
         return self.execute(self.conn.tg_emulation_igmp_control, *args, **kwargs)
 
+    def tg_batch(self, requests):
+        """
+        execute several requests in single round trip
+        @requests list of (function name, kwargs) e.g. ("tg_traffic_stats", {"port_handle": "1/1"})
+        @return list of the results in the same order
+        """
+        if self.filemode:
+            return [getattr(self, func_name)(**kwargs) for func_name, kwargs in requests]
+        for func_name, kwargs in requests:
+            self._log_call(func_name, **kwargs)
+            self.fix_newstr(kwargs)
+        res = self.execute(self.conn.tg_batch, [[func_name, kwargs] for func_name, kwargs in requests])
+        retval = []
+        for (func_name, _), item in zip(requests, res):
+            if "error" in item:
+                msg = "{} failed: {}".format(func_name, item["error"])
+                self._api_fail(msg)
+                raise ValueError(msg)
+            retval.append(item["result"])
+        return retval
+    def tg_traffic_stats_subscribe(self, interval=1, **kwargs):
+        """
+        traffic stats pushed by the server every interval, supported only by the wire transport
+        @return subscription with latest() and wait(count, timeout) or None
+        """
+        self.log_api(**kwargs)
+        if self.filemode or self.transport != "wire": return None
+        self.fix_newstr(kwargs)
+        kwargs["stats_wait"] = False
+        return self.conn.subscribe("tg_traffic_stats", interval, self.node_name, **kwargs)
@@ -1,5 +1,6 @@
 import re
 import copy
+from collections import OrderedDict
 from spytest import st, SpyTestDict
 from spytest.tgen_api import get_chassis
 from apis.system.basic import get_techsupport
@@ -137,7 +138,7 @@ def _get_debug_dump(name='tg_stats_failed'):
     tg.collect_diagnosic(fail_reason=name)
 
 
-def _fetch_stats(obj, port, mode, comp_type, direction, stream_elem=None):
+def _fetch_stats(obj, port, mode, comp_type, direction, stream_elem=None, prefetched=None):
     """
     @author: Lakshminarayana D(lakshminarayana.d@broadcom.com)
     Fuction will fetch traffic stats based inputs and classify TgenFail based on stats available.
@@ -147,6 +148,7 @@ def _fetch_stats(obj, port, mode, comp_type, direction, stream_elem=None):
     :param comp_type: packet_count or packet_rate
     :param direction: Traffic direction ('tx' or 'rx')
     :param stream_elem: Stream handle need to provide when mode is streams or traffic_item
+    :param prefetched: Stats already fetched by _prefetch_stats, used for the first iteration
     :return: stats: A Dictionary object with tx/rx packets/bytes stats
     """
 
@@ -158,7 +160,10 @@ def _fetch_stats(obj, port, mode, comp_type, direction, stream_elem=None):
         if loop > 0:
             st.log('TG stats are not fully ready. Trying to fetch stats again.... iteration {}'.format(loop))
             st.wait(2, 'waiting before fetch stats again')
-        stats = obj.tg_traffic_stats(port_handle=port, mode=mode)
+        if loop > 0 or prefetched is None:
+            stats = obj.tg_traffic_stats(port_handle=port, mode=mode)
+        else:
+            stats = prefetched
         if obj.tg_type == 'stc':
             if mode == 'streams':
                 tx_counter = float(stats[port]['stream'][stream_elem][direction][counter_name])
@@ -185,6 +190,29 @@ def _fetch_stats(obj, port, mode, comp_type, direction, stream_elem=None):
 
     return stats
 
+def _prefetch_stats(requests):
+    """
+    Fetch traffic stats of all the given ports in single request per TG, for the TGs supporting batch requests.
+    :param requests: List of (TG object, port handle, mode)
+    :return: Dictionary of port handle to the stats
+    """
+    batches = OrderedDict()
+    for obj, port, mode in requests:
+        if obj.tg_type != 'scapy' or not hasattr(obj, 'tg_batch'):
+            continue
+        batches.setdefault(id(obj), (obj, OrderedDict()))[1][port] = mode
+    prefetched = dict()
+    for obj, ports in batches.values():
+        if len(ports) < 2:
+            continue
+        try:
+            results = obj.tg_batch([('tg_traffic_stats', {'port_handle': port, 'mode': mode}) for port, mode in ports.items()])
+        except Exception as exp:
+            st.warn('Failed to fetch TG stats in batch, fetching per port: {}'.format(exp))
+            continue
+        prefetched.update(zip(ports.keys(), results))
+    return prefetched
+
 def _verify_aggregate_stats(tr_details,mode,comp_type,tolerance_factor,delay_factor,retry,return_all):
 
     return_value = True
@@ -195,6 +223,11 @@ def _verify_aggregate_stats(tr_details,mode,comp_type,tolerance_factor,delay_fac
     st.tg_wait(delay, "aggregate_stats")
 
     port_stats = dict()
+    requests = []
+    for tr_pair in tr_details.values():
+        for port, obj in zip(list(tr_pair['tx_ports']) + list(tr_pair['rx_ports']), list(tr_pair['tx_obj']) + list(tr_pair['rx_obj'])):
+            requests.append((obj, obj.get_port_handle(port), mode))
+    prefetched = _prefetch_stats(requests)
     for tr_pair in range(1,len(tr_details)+1):
         tr_pair = str(tr_pair)
         tx_ports = tr_details[tr_pair]['tx_ports']
@@ -217,7 +250,7 @@ def _verify_aggregate_stats(tr_details,mode,comp_type,tolerance_factor,delay_fac
                 tx_ph = obj.get_port_handle(port)
                 # tx_stats = obj.tg_traffic_stats(port_handle=tx_ph, mode=mode)
                 if tx_ph not in port_stats:
-                    port_stats[tx_ph] = _fetch_stats(obj, tx_ph, mode, comp_type, 'tx')
+                    port_stats[tx_ph] = _fetch_stats(obj, tx_ph, mode, comp_type, 'tx', prefetched=prefetched.pop(tx_ph, None))
                 tx_stats = port_stats[tx_ph]
                 #st.debug(tx_stats)
                 counter_name = get_counter_name(mode,obj.tg_type,comp_type,'tx')
@@ -230,7 +263,7 @@ def _verify_aggregate_stats(tr_details,mode,comp_type,tolerance_factor,delay_fac
                 rx_ph = obj.get_port_handle(port)
                 # rx_stats = obj.tg_traffic_stats(port_handle=rx_ph, mode=mode)
                 if rx_ph not in port_stats:
-                    port_stats[rx_ph] = _fetch_stats(obj, rx_ph, mode, comp_type, 'rx')
+                    port_stats[rx_ph] = _fetch_stats(obj, rx_ph, mode, comp_type, 'rx', prefetched=prefetched.pop(rx_ph, None))
                 rx_stats = port_stats[rx_ph]
                 #st.debug(rx_stats)
                 counter_name = get_counter_name(mode,obj.tg_type,comp_type,'rx')
@@ -271,6 +304,10 @@ def _verify_streamlevel_stats(tr_details,mode,comp_type,tolerance_factor,delay_f
     st.tg_wait(delay, "streamlevel_stats")
 
     stream_stats = dict()
+    requests = []
+    for tr_pair in tr_details.values():
+        requests.append((tr_pair['rx_obj'][0], tr_pair['rx_obj'][0].get_port_handle(tr_pair['rx_ports'][0]), 'traffic_item'))
+    prefetched = _prefetch_stats(requests)
     for tr_pair in range(1,len(tr_details)+1):
         tr_pair = str(tr_pair)
         tx_ports = tr_details[tr_pair]['tx_ports']
@@ -315,7 +352,8 @@ def _verify_streamlevel_stats(tr_details,mode,comp_type,tolerance_factor,delay_f
                     elif rx_obj.tg_type in ['ixia', 'scapy']:
                         #rx_stats = rx_obj.tg_traffic_stats(port_handle=rx_ph, mode='traffic_item')
                         if rx_ph not in stream_stats:
-                            stream_stats[rx_ph] = _fetch_stats(rx_obj, rx_ph, 'traffic_item', comp_type, 'tx', stream_elem=strelem)
+                            stream_stats[rx_ph] = _fetch_stats(rx_obj, rx_ph, 'traffic_item', comp_type, 'tx', stream_elem=strelem,
+                                                               prefetched=prefetched.pop(rx_ph, None))
                         rx_stats = stream_stats[rx_ph]
 
                         #Following check is to avoid KeyError traffic_item. Reason is traffic was not started.
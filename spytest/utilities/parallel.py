@@ -260,6 +260,101 @@ def ensure_no_exception(values, action="abort"):
         elif action == "trace": st.error("exception in thread: {}".format(exp))
     return True
 
+class Future(object):
+    """
+    Result of a function submitted to a Worker
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.retval = None
+        self.exception = None
+        self.start_time = None
+        self.end_time = None
+        self.event = threading.Event()
+
+    def run(self):
+        self.start_time = time.time()
+        try:
+            self.retval = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.exception = traceback.format_exc()
+        except SystemExit as e2:
+            self.exception = e2
+        self.end_time = time.time()
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise ValueError("Timeout waiting for {}".format(self.func))
+        return self.retval
+
+    def elapsed(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+class Worker(object):
+    """
+    Thread executing the submitted functions in the order of submission
+    """
+    def __init__(self, name=None):
+        self.pending = []
+        self.cond = threading.Condition(threading.Lock())
+        self.finished = False
+        self.t = threading.Thread(target=self._thread_func, name=name)
+        self.t.daemon = True
+        self.t.start()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future(func, *args, **kwargs)
+        with self.cond:
+            if self.finished:
+                raise ValueError("Worker is already stopped")
+            self.pending.append(future)
+            self.cond.notify()
+        return future
+
+    def stop(self, timeout=None):
+        with self.cond:
+            self.finished = True
+            self.cond.notify()
+        if self.t is not threading.current_thread():
+            self.t.join(timeout)
+
+    def _thread_func(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.finished:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                future = self.pending.pop(0)
+            future.run()
+
+def wait_futures(on_except, futures):
+    """
+    Wait for the futures returned by Worker.submit
+    :return: [retvals, exceptions] same as exec_all2
+    """
+    for future in futures:
+        while not future.wait(1):
+            if shutting_down: break
+    retvals = [future.retval for future in futures]
+    exceptions = [future.exception for future in futures]
+    for exp in exceptions:
+        if isinstance(exp, SystemExit):
+            sys.exit()
+    ensure_no_exception(exceptions, on_except)
+    return [retvals, exceptions]
+
 class Lock(object):
     def __init__(self):
         self.lock = threading.Lock()
@@ -6,8 +6,10 @@ import os
 import cPickle as pickle
 import shutil
 import sys
+import tempfile
+import time
 
-from collections import defaultdict
+from collections import OrderedDict
 from threading import Lock
 from six import with_metaclass
 
@@ -19,6 +21,8 @@ CACHE_LOCATION = os.path.join(CURRENT_PATH, '../../../_cache')
 
 SIZE_LIMIT = 1000000000  # 1G bytes, max disk usage allowed by cache
 ENTRY_LIMIT = 1000000    # Max number of pickle files allowed in cache.
+EVICT_RATIO = 0.8        # When a limit is exceeded, least recently used files are evicted down to this ratio of it.
+MEMORY_ENTRY_LIMIT = 10000  # Max number of facts kept in memory.
 
 
 class Singleton(type):
@@ -34,11 +38,34 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+class CacheEntry(object):
+    """Cached facts stored in pickle file along with the metadata used for invalidation.
+
+    Args:
+        value (obj): Cached facts.
+        version (str): Version of the zone at the time of writing, for example DUT image version and config checksum.
+        ttl (int): Time to live of the entry in seconds, None for no expiration.
+    """
+
+    def __init__(self, value, version=None, ttl=None):
+        self.value = value
+        self.version = version
+        self.ttl = ttl
+        self.timestamp = time.time()
+
+    def is_expired(self):
+        return self.ttl is not None and time.time() - self.timestamp > self.ttl
+
+
 class FactsCache(with_metaclass(Singleton, object)):
     """Singleton class for reading from cache and write to cache.
 
     Used singleton design pattern. Only a single instance of this class can be initialized.
 
+    Facts are kept in memory with LRU eviction and stored in pickle files. Pickle files are written atomically
+    (write to temporary file and rename), so concurrent processes like pytest-xdist workers never read a partially
+    written file. Disk usage is tracked incrementally, least recently used files are evicted when limits are exceeded.
+
     Args:
         with_metaclass ([function]): Python 2&3 compatible function from the six library for adding metaclass.
     """
@@ -47,24 +74,106 @@ class FactsCache(with_metaclass(Singleton, object)):
 
     def __init__(self, cache_location=CACHE_LOCATION):
         self._cache_location = os.path.abspath(cache_location)
-        self._cache = defaultdict(dict)
+        self._cache = OrderedDict()
         self._write_lock = Lock()
+        self._usage = None
+        self._zone_versions = {}
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "invalidations": 0, "evictions": 0}
 
-    def _check_usage(self):
-        """Check cache usage, raise exception if usage exceeds the limitations.
-        """
-        total_size = 0
-        total_entries = 0
+    def _get_facts_file(self, zone, key):
+        return os.path.join(self._cache_location, '{}/{}.pickle'.format(zone, key))
+
+    def _list_cache_files(self):
         for root, _, files in os.walk(self._cache_location):
             for f in files:
-                fp = os.path.join(root, f)
-                total_size += os.path.getsize(fp)
-                total_entries += 1
+                yield os.path.join(root, f)
+
+    def _get_usage(self):
+        """Get cache disk usage. Full scan of the cache folder is done only once, then usage is updated on every
+        write and removal.
+        """
+        if self._usage is None:
+            self._usage = {"size": 0, "entries": 0}
+            for fp in self._list_cache_files():
+                try:
+                    self._usage["size"] += os.path.getsize(fp)
+                    self._usage["entries"] += 1
+                except OSError:
+                    pass
+        return self._usage
 
-        if total_size > SIZE_LIMIT or total_entries > ENTRY_LIMIT:
-            msg = 'Cache usage exceeds limitations. total_size={}, SIZE_LIMIT={}, total_entries={}, ENTRY_LIMIT={}' \
-                .format(total_size, SIZE_LIMIT, total_entries, ENTRY_LIMIT)
-            raise Exception(msg)
+    def _update_usage(self, size_delta, entries_delta):
+        usage = self._get_usage()
+        usage["size"] += size_delta
+        usage["entries"] += entries_delta
+
+    def _check_usage(self):
+        """Check cache usage, evict least recently used files if usage exceeds the limitations.
+        """
+        usage = self._get_usage()
+        if usage["size"] <= SIZE_LIMIT and usage["entries"] <= ENTRY_LIMIT:
+            return
+
+        logger.info('Cache usage exceeds limitations. total_size={}, SIZE_LIMIT={}, total_entries={}, ENTRY_LIMIT={}'
+                    .format(usage["size"], SIZE_LIMIT, usage["entries"], ENTRY_LIMIT))
+        files = []
+        for fp in self._list_cache_files():
+            try:
+                stat = os.stat(fp)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, fp))
+        files.sort()
+
+        # Files could be written by other processes, so refresh usage from the scan
+        self._usage = {"size": sum(f[1] for f in files), "entries": len(files)}
+        for _, size, fp in files:
+            if self._usage["size"] <= SIZE_LIMIT * EVICT_RATIO and self._usage["entries"] <= ENTRY_LIMIT * EVICT_RATIO:
+                break
+            try:
+                os.remove(fp)
+            except OSError:
+                continue
+            self._update_usage(-size, -1)
+            self._stats["evictions"] += 1
+            logger.debug('Evicted cache file "{}"'.format(fp))
+
+    def _remember(self, zone, key, value):
+        self._cache[(zone, key)] = value
+        while len(self._cache) > MEMORY_ENTRY_LIMIT:
+            self._cache.popitem(last=False)
+
+    def _forget(self, zone, key=None):
+        for k in list(self._cache):
+            if k[0] == zone and (key is None or k[1] == key):
+                del self._cache[k]
+
+    def set_zone_version(self, zone, version):
+        """Set version of the zone. Cached facts written with another version of the zone are treated as not existing.
+        The version also applies to zones prefixed by '<zone>-', like '<hostname>-<namespace>'.
+
+        Args:
+            zone (str): Zone name, usually hostname.
+            version (str): Zone version, for example DUT image version and config checksum.
+        """
+        self._zone_versions[zone] = version
+
+    def _get_zone_version(self, zone):
+        if zone in self._zone_versions:
+            return self._zone_versions[zone]
+        for versioned_zone, version in self._zone_versions.items():
+            if zone.startswith(versioned_zone + '-'):
+                return version
+        return None
+
+    def _is_valid(self, entry, zone):
+        if not isinstance(entry, CacheEntry):
+            # Facts cached by previous version of FactsCache have no metadata
+            return self._get_zone_version(zone) is None
+        if entry.is_expired():
+            return False
+        version = self._get_zone_version(zone)
+        return version is None or entry.version == version
 
     def read(self, zone, key):
         """Read cached facts.
@@ -78,22 +187,41 @@ class FactsCache(with_metaclass(Singleton, object)):
             obj: Cached object, usually a dictionary.
         """
         # Lazy load
-        if zone in self._cache and key in self._cache[zone]:
-            logger.debug('Read cached facts "{}.{}"'.format(zone, key))
-            return self._cache[zone][key]
-        else:
-            facts_file = os.path.join(self._cache_location, '{}/{}.pickle'.format(zone, key))
-            try:
-                with open(facts_file) as f:
-                    self._cache[zone][key] = pickle.load(f)
-                    logger.debug('Loaded cached facts "{}.{}" from {}'.format(zone, key, facts_file))
-                    return self._cache[zone][key]
-            except (IOError, ValueError) as e:
-                logger.info('Load cache file "{}" failed with exception: {}'\
-                    .format(os.path.abspath(facts_file), repr(e)))
-                return self.NOTEXIST
-
-    def write(self, zone, key, value):
+        if (zone, key) in self._cache:
+            entry = self._cache.pop((zone, key))
+            if self._is_valid(entry, zone):
+                self._cache[(zone, key)] = entry
+                self._stats["memory_hits"] += 1
+                logger.debug('Read cached facts "{}.{}"'.format(zone, key))
+                return entry.value if isinstance(entry, CacheEntry) else entry
+
+        facts_file = self._get_facts_file(zone, key)
+        try:
+            with open(facts_file) as f:
+                entry = pickle.load(f)
+        except (IOError, ValueError, EOFError, pickle.UnpicklingError) as e:
+            self._stats["misses"] += 1
+            logger.info('Load cache file "{}" failed with exception: {}'\
+                .format(os.path.abspath(facts_file), repr(e)))
+            return self.NOTEXIST
+
+        if not self._is_valid(entry, zone):
+            self._stats["invalidations"] += 1
+            logger.info('Cached facts "{}.{}" in {} are expired or outdated'.format(zone, key, facts_file))
+            self.cleanup(zone, key)
+            return self.NOTEXIST
+
+        # Update modification time for LRU eviction of files
+        try:
+            os.utime(facts_file, None)
+        except OSError:
+            pass
+        self._remember(zone, key, entry)
+        self._stats["disk_hits"] += 1
+        logger.debug('Loaded cached facts "{}.{}" from {}'.format(zone, key, facts_file))
+        return entry.value if isinstance(entry, CacheEntry) else entry
+
+    def write(self, zone, key, value, ttl=None):
         """Store facts to cache.
 
         Args:
@@ -101,28 +229,65 @@ class FactsCache(with_metaclass(Singleton, object)):
                 The zone name could be hostname.
             key (str): Name of cached facts.
             value (obj): Value of cached facts. Usually a dictionary.
+            ttl (int): Time to live of cached facts in seconds. Default is None, cached facts never expire.
 
         Returns:
             boolean: Caching facts is successful or not.
         """
+        entry = CacheEntry(value, version=self._get_zone_version(zone), ttl=ttl)
         with self._write_lock:
             self._check_usage()
-            facts_file = os.path.join(self._cache_location, '{}/{}.pickle'.format(zone, key))
+            facts_file = self._get_facts_file(zone, key)
+            tmp_file = None
             try:
                 cache_subfolder = os.path.join(self._cache_location, zone)
                 if not os.path.exists(cache_subfolder):
                     logger.info('Create cache dir {}'.format(cache_subfolder))
-                    os.makedirs(cache_subfolder)
-
-                with open(facts_file, 'w') as f:
-                    pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
-                    self._cache[zone][key] = value
-                    logger.info('Cached facts "{}.{}" to {}'.format(zone, key, facts_file))
-                    return True
-            except (IOError, ValueError) as e:
+                    try:
+                        os.makedirs(cache_subfolder)
+                    except OSError:
+                        # Could be created by another process in the meantime
+                        if not os.path.isdir(cache_subfolder):
+                            raise
+
+                old_size = os.path.getsize(facts_file) if os.path.exists(facts_file) else None
+                fd, tmp_file = tempfile.mkstemp(dir=cache_subfolder, prefix='.{}.'.format(key))
+                with os.fdopen(fd, 'w') as f:
+                    pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+                os.chmod(tmp_file, 0o644)
+                new_size = os.path.getsize(tmp_file)
+                os.rename(tmp_file, facts_file)
+                tmp_file = None
+
+                if old_size is None:
+                    self._update_usage(new_size, 1)
+                else:
+                    self._update_usage(new_size - old_size, 0)
+                self._remember(zone, key, entry)
+                self._stats["writes"] += 1
+                logger.info('Cached facts "{}.{}" to {}'.format(zone, key, facts_file))
+                return True
+            except (IOError, OSError, ValueError, pickle.PicklingError) as e:
                 logger.error('Dump cache file "{}" failed with exception: {}'.format(facts_file, repr(e)))
+                if tmp_file:
+                    try:
+                        os.remove(tmp_file)
+                    except OSError:
+                        pass
                 return False
 
+    def get_stats(self):
+        """Get cache statistics.
+
+        Returns:
+            dict: Counters of memory hits, disk hits, misses, writes, invalidated and evicted entries,
+                along with current disk usage.
+        """
+        stats = dict(self._stats)
+        if self._usage is not None:
+            stats.update({"disk_size": self._usage["size"], "disk_entries": self._usage["entries"]})
+        return stats
+
     def cleanup(self, zone=None, key=None):
         """Cleanup cached files.
 
@@ -134,29 +299,32 @@ class FactsCache(with_metaclass(Singleton, object)):
         """
         if zone:
             if key:
-                if zone in self._cache and key in self._cache[zone]:
-                    del self._cache[zone][key]
+                if (zone, key) in self._cache:
+                    self._forget(zone, key)
                     logger.debug('Removed "{}.{}" from cache.'.format(zone, key))
                 try:
-                    cache_file = os.path.join(self._cache_location, zone, '{}.pickle'.format(key))
+                    cache_file = self._get_facts_file(zone, key)
+                    size = os.path.getsize(cache_file)
                     os.remove(cache_file)
+                    self._update_usage(-size, -1)
                     logger.debug('Removed cache file "{}.pickle"'.format(cache_file))
                 except OSError as e:
                     logger.error('Cleanup cache {}.{}.pickle failed with exception: {}'.format(zone, key, repr(e)))
             else:
-                if zone in self._cache:
-                    del self._cache[zone]
-                    logger.debug('Removed zone "{}" from cache'.format(zone))
+                self._forget(zone)
+                logger.debug('Removed zone "{}" from cache'.format(zone))
                 try:
                     cache_subfolder = os.path.join(self._cache_location, zone)
                     shutil.rmtree(cache_subfolder)
+                    self._usage = None
                     logger.debug('Removed cache subfolder "{}"'.format(cache_subfolder))
                 except OSError as e:
                     logger.error('Remove cache subfolder "{}" failed with exception: {}'.format(zone, repr(e)))
         else:
-            self._cache = defaultdict(dict)
+            self._cache = OrderedDict()
             try:
                 shutil.rmtree(self._cache_location)
+                self._usage = None
                 logger.debug('Removed all cache files under "{}"'.format(self._cache_location))
             except OSError as e:
                 logger.error('Remove cache folder "{}" failed with exception: {}'\
@@ -188,7 +356,7 @@ def _get_default_zone(function, func_args, func_kargs):
     return zone
 
 
-def cached(name, zone_getter=None, after_read=None, before_write=None):
+def cached(name, zone_getter=None, after_read=None, before_write=None, ttl=None):
     """Decorator for enabling cache for facts.
 
     The cached facts are to be stored by <name>.pickle. Because the cached pickle files must be stored under subfolder
@@ -205,6 +373,7 @@ def cached(name, zone_getter=None, after_read=None, before_write=None):
         zone_getter ([function]): Function used to get hostname used as zone.
         after_read ([function]): Hook function used to process facts after read from cache.
         before_write ([function]): Hook function used to process facts before write into cache.
+        ttl ([int]): Time to live of the cached facts in seconds. Default is None, cached facts never expire.
     Returns:
         [function]: Decorator function.
     """
@@ -224,9 +393,9 @@ def cached(name, zone_getter=None, after_read=None, before_write=None):
                 facts = target(*args, **kargs)
                 if before_write:
                     _facts = before_write(facts, target, args, kargs)
-                    cache.write(zone, name, _facts)
+                    cache.write(zone, name, _facts, ttl=ttl)
                 else:
-                    cache.write(zone, name, facts)
+                    cache.write(zone, name, facts, ttl=ttl)
                 return facts
         return wrapper
     return decorator
@@ -0,0 +1,270 @@
+"""
+Fast path for running simple Ansible modules over a persistent SSH connection.
+
+Every Ansible module call packages the module, copies it to the host and starts a python interpreter there.
+For plain 'shell', 'command', 'copy' and 'fetch' calls this overhead is much bigger than the command itself.
+SSHExecConn keeps one paramiko SSH transport per host and opens a new channel on it for every call, so
+the calls cost a single round trip. Calls with module arguments which are not supported by the fast path
+fall back to Ansible.
+"""
+import datetime
+import logging
+import os
+import pipes
+import shlex
+import socket
+import threading
+
+from collections import defaultdict
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+# Module arguments supported by the fast path. Calls with any other argument are run by Ansible.
+SUPPORTED_MODULE_ARGS = {
+    "shell": {"chdir", "executable"},
+    "command": {"chdir"},
+    "copy": {"src", "dest", "content"},
+    "fetch": {"src", "dest", "flat"},
+}
+
+
+class LatencyStats(object):
+    """Latency statistics of module calls."""
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def to_dict(self):
+        return {"calls": self.calls,
+                "total": round(self.total, 3),
+                "avg": round(self.total / self.calls, 3) if self.calls else 0.0,
+                "max": round(self.max, 3)}
+
+
+# Map <hostname, <"backend:module_name", LatencyStats>>
+_latency_stats = defaultdict(lambda: defaultdict(LatencyStats))
+_latency_stats_lock = threading.Lock()
+
+
+def record_latency(hostname, backend, module_name, elapsed):
+    """Record latency of a module call.
+
+    Args:
+        hostname (str): Host the module was called on.
+        backend (str): 'ssh' for the fast path, 'ansible' otherwise.
+        module_name (str): Name of the called module.
+        elapsed (float): Call duration in seconds.
+    """
+    with _latency_stats_lock:
+        _latency_stats[hostname]["{}:{}".format(backend, module_name)].add(elapsed)
+
+
+def get_latency_report():
+    """Get latency statistics of module calls per host.
+
+    Returns:
+        dict: Map <hostname, <"backend:module_name", {"calls", "total", "avg", "max"}>>
+    """
+    with _latency_stats_lock:
+        return {hostname: {name: stats.to_dict() for name, stats in host_stats.items()}
+                for hostname, host_stats in _latency_stats.items()}
+
+
+class FastPathUnavailable(Exception):
+    """Raised when SSH connection to the host can't be established, the call should be run by Ansible."""
+    pass
+
+
+class FastPathResult(dict):
+    """Module result with the same interface as results of modules run by pytest-ansible."""
+
+    @property
+    def is_failed(self):
+        return self.get("failed", False)
+
+    @property
+    def is_successful(self):
+        return not self.is_failed
+
+    @property
+    def is_changed(self):
+        return self.get("changed", False)
+
+
+class SSHExecConn(object):
+    """Persistent SSH connection to a host, used to run simple module calls without Ansible.
+
+    Commands are run with sudo, like modules run by Ansible with 'become'.
+
+    Args:
+        hostname (str): Name of the host in the inventory, used for logging and 'fetch' destination.
+        host (str): Address of the host.
+        user (str): SSH user name.
+        password (str): SSH and sudo password.
+        port (int): SSH port.
+        timeout (int): Timeout in seconds for connection and for a single command.
+    """
+
+    def __init__(self, hostname, host, user, password, port=22, timeout=300):
+        self.hostname = hostname
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.timeout = timeout
+        self._client = None
+        self._sudo_needs_password = True
+        self._lock = threading.Lock()
+
+    def _get_transport(self):
+        with self._lock:
+            transport = self._client.get_transport() if self._client else None
+            if transport is None or not transport.is_active():
+                logger.debug("Open SSH connection to {}".format(self.hostname))
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                try:
+                    client.connect(self.host, port=self.port, username=self.user, password=self.password,
+                                   timeout=30, look_for_keys=False, allow_agent=False)
+                    transport = client.get_transport()
+                    transport.set_keepalive(30)
+                    self._sudo_needs_password = self._exec_raw(transport, "sudo -n true")[0] != 0
+                except (paramiko.SSHException, socket.error) as e:
+                    client.close()
+                    raise FastPathUnavailable("SSH connection to {} failed: {}".format(self.hostname, repr(e)))
+                self._client = client
+            return transport
+
+    def _exec_raw(self, transport, cmd, data=None):
+        """Run command on a new channel of the transport.
+
+        Returns:
+            tuple: Return code, stdout and stderr of the command.
+        """
+        chan = transport.open_session()
+        try:
+            chan.settimeout(self.timeout)
+            chan.exec_command(cmd)
+            if data:
+                chan.sendall(data)
+            chan.shutdown_write()
+
+            # Read stderr in a separate thread, so a command with big output on both streams doesn't hang
+            stderr = []
+            stderr_reader = threading.Thread(target=lambda: stderr.append(chan.makefile_stderr("rb").read()))
+            stderr_reader.start()
+            stdout = chan.makefile("rb").read()
+            stderr_reader.join()
+            return chan.recv_exit_status(), stdout, stderr[0] if stderr else ""
+        finally:
+            chan.close()
+
+    def exec_command(self, cmd, data=None, executable="/bin/sh"):
+        """Run command as root.
+
+        Args:
+            cmd (str): Command to be run by the shell.
+            data (str): Data to be sent to stdin of the command.
+            executable (str): Shell used to run the command.
+
+        Returns:
+            tuple: Return code, stdout and stderr of the command.
+        """
+        transport = self._get_transport()
+        sudo_cmd = "sudo -S -p '' {} -c {}".format(executable, pipes.quote(cmd))
+        if self._sudo_needs_password:
+            data = self.password + "\n" + (data or "")
+        return self._exec_raw(transport, sudo_cmd, data)
+
+    @staticmethod
+    def supports(module_name, module_args, complex_args):
+        """Check whether the module call can be run by the fast path."""
+        if module_name not in SUPPORTED_MODULE_ARGS:
+            return False
+        if not set(complex_args).issubset(SUPPORTED_MODULE_ARGS[module_name]):
+            return False
+        if module_name in ("shell", "command"):
+            return len(module_args) == 1
+        if module_args:
+            return False
+        if module_name == "copy":
+            return "dest" in complex_args and \
+                ("content" in complex_args or os.path.isfile(complex_args.get("src", "")))
+        return "src" in complex_args and "dest" in complex_args
+
+    def run(self, module_name, module_args, complex_args):
+        """Run the module call, which must be supported by the fast path.
+
+        Raises:
+            FastPathUnavailable: SSH connection can't be established, the command was not run.
+
+        Returns:
+            FastPathResult: Result in the same format as returned by the Ansible module.
+        """
+        return getattr(self, "_run_" + module_name)(*module_args, **complex_args)
+
+    def _run_shell(self, cmd, chdir=None, executable="/bin/sh"):
+        script = cmd if not chdir else "cd {} && {}".format(pipes.quote(chdir), cmd)
+        start = datetime.datetime.now()
+        rc, stdout, stderr = self.exec_command(script, executable=executable)
+        end = datetime.datetime.now()
+        stdout = stdout.rstrip("\r\n")
+        stderr = stderr.rstrip("\r\n")
+        res = FastPathResult(cmd=cmd, rc=rc, stdout=stdout, stderr=stderr,
+                             stdout_lines=stdout.splitlines(), stderr_lines=stderr.splitlines(),
+                             start=str(start), end=str(end), delta=str(end - start),
+                             changed=True, failed=rc != 0)
+        if rc != 0:
+            res["msg"] = "non-zero return code"
+        return res
+
+    def _run_command(self, cmd, chdir=None):
+        # Command module doesn't use shell, so quote every argument to prevent shell expansions
+        args = " ".join(pipes.quote(arg) for arg in shlex.split(cmd))
+        res = self._run_shell("exec " + args, chdir=chdir)
+        res["cmd"] = cmd
+        return res
+
+    def _run_copy(self, dest, src=None, content=None):
+        if content is None:
+            with open(src, "rb") as f:
+                content = f.read()
+        # Same as the copy module: when dest is a directory, copy into it
+        base = os.path.basename(src) if src else ""
+        script = 'd={}; [ -d "$d" ] && d="$d/"{}; cat > "$d" && echo "$d"'.format(pipes.quote(dest), pipes.quote(base))
+        rc, stdout, stderr = self.exec_command(script, data=content)
+        if rc != 0:
+            return FastPathResult(failed=True, changed=False, dest=dest, msg=stderr.strip())
+        return FastPathResult(failed=False, changed=True, dest=stdout.strip())
+
+    def _run_fetch(self, src, dest, flat=False):
+        if flat in (True, "yes", "true", "True"):
+            local_path = os.path.join(dest, os.path.basename(src)) if dest.endswith("/") else dest
+        else:
+            local_path = os.path.join(dest, self.hostname, src.lstrip("/"))
+
+        rc, stdout, stderr = self.exec_command("cat {}".format(pipes.quote(src)))
+        if rc != 0:
+            return FastPathResult(failed=True, changed=False, file=src, msg=stderr.strip())
+
+        local_dir = os.path.dirname(local_path)
+        if local_dir and not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+        with open(local_path, "wb") as f:
+            f.write(stdout)
+        return FastPathResult(failed=False, changed=True, dest=local_path, remote_path=src)
+
+    def close(self):
+        with self._lock:
+            if self._client:
+                self._client.close()
+                self._client = None
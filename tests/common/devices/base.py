@@ -1,9 +1,11 @@
 import inspect
 import json
 import logging
+import time
 
 from multiprocessing.pool import ThreadPool
 
+from tests.common.connections.ssh_exec_conn import SSHExecConn, FastPathUnavailable, record_latency
 from tests.common.errors import RunAnsibleModuleFail
 
 logger = logging.getLogger(__name__)
@@ -32,6 +34,9 @@ class AnsibleHostBase(object):
     on the host.
     """
 
+    # Persistent SSH connection used to run simple module calls without Ansible, see enable_fast_path()
+    fast_path = None
+
     def __init__(self, ansible_adhoc, hostname, *args, **kwargs):
         if hostname == 'localhost':
             self.host = ansible_adhoc(connection='local', host_pattern=hostname)[hostname]
@@ -50,6 +55,16 @@ class AnsibleHostBase(object):
             "'%s' object has no attribute '%s'" % (self.__class__, module_name)
             )
 
+    def enable_fast_path(self, user, password):
+        """
+        @summary: Run 'shell', 'command', 'copy' and 'fetch' module calls over a persistent SSH connection
+            instead of Ansible. Calls with module arguments not supported by the fast path still use Ansible.
+
+        @param user: SSH user name.
+        @param password: SSH and sudo password.
+        """
+        self.fast_path = SSHExecConn(self.hostname, self.mgmt_ip, user, password)
+
     def _run(self, *module_args, **complex_args):
 
         previous_frame = inspect.currentframe().f_back
@@ -75,7 +90,18 @@ class AnsibleHostBase(object):
             result = pool.apply_async(run_module, (module_args, complex_args))
             return pool, result
 
-        res = self.module(*module_args, **complex_args)[self.hostname]
+        res = None
+        start = time.time()
+        if self.fast_path and self.fast_path.supports(self.module_name, module_args, complex_args):
+            try:
+                res = self.fast_path.run(self.module_name, module_args, complex_args)
+                record_latency(self.hostname, "ssh", self.module_name, time.time() - start)
+            except FastPathUnavailable as e:
+                logging.warning("{}, fall back to Ansible".format(e))
+                start = time.time()
+        if res is None:
+            res = self.module(*module_args, **complex_args)[self.hostname]
+            record_latency(self.hostname, "ansible", self.module_name, time.time() - start)
 
         if verbose:
             logging.debug("{}::{}#{}: [{}] AnsibleModule::{} Result => {}"\
@@ -1,9 +1,90 @@
 import logging
+import multiprocessing
+import time
+
+from multiprocessing.pool import ThreadPool
 
 from tests.common.devices.multi_asic import MultiAsicSonicHost
 
 logger = logging.getLogger(__name__)
 
+# Max number of DUTs a call is run on concurrently
+MAX_NODES_CONCURRENCY = 16
+
+
+class NodesCallTimeout(Exception):
+    """ Raised when a call on a DUT didn't complete in time """
+    pass
+
+
+class NodesResult(dict):
+    """ Results of a call on multiple DUTs, a dictionary with key being the DUT's hostname and value being the
+    result of the call on that DUT. Additionally holds:
+    errors: dictionary with key being the DUT's hostname and value being the exception raised on that DUT
+    elapsed: dictionary with key being the DUT's hostname and value being the call duration in seconds
+    """
+    def __init__(self):
+        super(NodesResult, self).__init__()
+        self.errors = {}
+        self.elapsed = {}
+
+
+def run_on_nodes(nodes, func, timeout=None, raise_errors=True):
+    """ Run function on each of the nodes concurrently, on a bounded thread pool.
+
+    Args:
+        nodes: list of nodes
+        func: function with a single argument - the node
+        timeout: time in seconds to wait for all the nodes, None to wait forever
+        raise_errors: re-raise the exception of the first failed node (in nodes order)
+
+    Returns:
+        NodesResult with result of each node
+    """
+    result = NodesResult()
+
+    def _call(node):
+        start = time.time()
+        try:
+            return func(node)
+        finally:
+            result.elapsed[node.hostname] = time.time() - start
+
+    if not nodes:
+        return result
+    if len(nodes) == 1 and timeout is None:
+        node = nodes[0]
+        try:
+            result[node.hostname] = _call(node)
+        except Exception as e:
+            result.errors[node.hostname] = e
+    else:
+        pool = ThreadPool(min(len(nodes), MAX_NODES_CONCURRENCY))
+        async_results = [(node, pool.apply_async(_call, (node,))) for node in nodes]
+        pool.close()
+        deadline = time.time() + timeout if timeout is not None else None
+        for node, async_result in async_results:
+            try:
+                if deadline is None:
+                    # get() without timeout can't be interrupted by KeyboardInterrupt
+                    while not async_result.ready():
+                        async_result.wait(1)
+                    result[node.hostname] = async_result.get()
+                else:
+                    result[node.hostname] = async_result.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                result.errors[node.hostname] = NodesCallTimeout(
+                    "Call on {} didn't complete in {} seconds".format(node.hostname, timeout))
+            except Exception as e:
+                result.errors[node.hostname] = e
+
+    if raise_errors:
+        for node in nodes:
+            if node.hostname in result.errors:
+                logger.error("Call failed on nodes: {}".format(result.errors.keys()))
+                raise result.errors[node.hostname]
+    return result
+
 
 class DutHosts(object):
     """ Represents all the DUTs (nodes) in a testbed. class has 3 important attributes:
@@ -13,9 +94,17 @@ class DutHosts(object):
     """
     class _Nodes(list):
         """ Internal class representing a list of MultiAsicSonicHosts """
-        def _run_on_nodes(self, *module_args, **complex_args):
-            """ Delegate the call to each of the nodes, return the results in a dict."""
-            return {node.hostname: getattr(node, self.attr)(*module_args, **complex_args) for node in self}
+
+        # Default timeout in seconds of a call on the nodes, None to wait forever
+        call_timeout = None
+
+        def _run_on_nodes(self, attr, *module_args, **complex_args):
+            """ Delegate the call to each of the nodes concurrently, return the results in a dict.
+
+            Keyword argument 'nodes_timeout' overrides default timeout of the call.
+            """
+            timeout = complex_args.pop("nodes_timeout", self.call_timeout)
+            return run_on_nodes(self, lambda node: getattr(node, attr)(*module_args, **complex_args), timeout=timeout)
 
         def __getattr__(self, attr):
             """ To support calling ansible modules on a list of MultiAsicSonicHost
@@ -26,8 +115,12 @@ class DutHosts(object):
                a dictionary with key being the MultiAsicSonicHost's hostname, and value being the output of ansible module
                on that MultiAsicSonicHost
             """
-            self.attr = attr
-            return self._run_on_nodes
+            if attr.startswith("__"):
+                raise AttributeError(attr)
+
+            def _run(*module_args, **complex_args):
+                return self._run_on_nodes(attr, *module_args, **complex_args)
+            return _run
 
         def __eq__(self, o):
             """ To support eq operator on the DUTs (nodes) in the testbed """
@@ -112,8 +205,7 @@ class DutHosts(object):
         return getattr(self.nodes, attr)
 
     def config_facts(self, *module_args, **complex_args):
-        result = {}
-        for node in self.nodes:
-            complex_args['host'] = node.hostname
-            result[node.hostname] = node.config_facts(*module_args, **complex_args)['ansible_facts']
-        return result
+        def _config_facts(node):
+            node_args = dict(complex_args, host=node.hostname)
+            return node.config_facts(*module_args, **node_args)['ansible_facts']
+        return dict(run_on_nodes(self.nodes, _config_facts))
@@ -17,6 +17,7 @@ from tests.common.devices.base import AnsibleHostBase
 from tests.common.helpers.dut_utils import is_supervisor_node
 from tests.common.cache import cached
 from tests.common.helpers.constants import DEFAULT_ASIC_ID, DEFAULT_NAMESPACE
+from tests.common.helpers.show_table import parse_column_positions, parse_show
 from tests.common.errors import RunAnsibleModuleFail
 
 logger = logging.getLogger(__name__)
@@ -975,59 +976,12 @@ default via fc00::1a dev PortChannel0004 proto 186 src fc00:1::32 metric 20  pre
             Returns a list. Each item is a tuple with two elements. The first element is start position of a column. The
             second element is the end position of the column.
         """
-        prev = ' ',
-        positions = []
-        for pos, char in enumerate(sep_line + ' '):
-            if char == sep_char:
-                if char != prev:
-                    left = pos
-            else:
-                if char != prev:
-                    right = pos
-                    positions.append((left, right))
-            prev = char
-        return positions
-
+        return parse_column_positions(sep_line, sep_char)
 
     def _parse_show(self, output_lines):
+        return parse_show(output_lines).to_dicts()
 
-        result = []
-
-        sep_line_pattern = re.compile(r"^( *-+ *)+$")
-        sep_line_found = False
-        for idx, line in enumerate(output_lines):
-            if sep_line_pattern.match(line):
-                sep_line_found = True
-                header_line = output_lines[idx-1]
-                sep_line = output_lines[idx]
-                content_lines = output_lines[idx+1:]
-                break
-
-        if not sep_line_found:
-            logging.error('Failed to find separation line in the show command output')
-            return result
-
-        try:
-            positions = self._parse_column_positions(sep_line)
-        except Exception as e:
-            logging.error('Possibly bad command output, exception: {}'.format(repr(e)))
-            return result
-
-        headers = []
-        for (left, right) in positions:
-            headers.append(header_line[left:right].strip().lower())
-
-        for content_line in content_lines:
-            item = {}
-            for idx, (left, right) in enumerate(positions):
-                k = headers[idx]
-                v = content_line[left:right].strip()
-                item[k] = v
-            result.append(item)
-
-        return result
-
-    def show_and_parse(self, show_cmd, **kwargs):
+    def show_and_parse(self, show_cmd, columnar=False, converters=None, **kwargs):
         """Run a show command and parse the output using a generic pattern.
 
         This method can adapt to the column changes as long as the output format follows the pattern of
@@ -1085,8 +1039,15 @@ default via fc00::1a dev PortChannel0004 proto 186 src fc00:1::32 metric 20  pre
               ...
             ]
 
+        Column positions are cached per separation line, so parsing output with the same columns again doesn't detect
+        them again. For commands with big output, use 'columnar' to get the parsed output as ShowTable, which keeps
+        values column by column and builds the dicts of rows only when iterated.
+
         Args:
             show_cmd: The show command that will be executed.
+            columnar: Return ShowTable instead of list of dictionary. Defaults to False.
+            converters: Dict of column header to function converting the column values, e.g. to_int or to_rate from
+                tests.common.helpers.show_table. Defaults to None, the values are strings.
 
         Returns:
             Return the parsed output of the show command in a list of dictionary. Each list item is a dictionary,
@@ -1094,7 +1055,8 @@ default via fc00::1a dev PortChannel0004 proto 186 src fc00:1::32 metric 20  pre
             headers in lowercase.
         """
         output = self.shell(show_cmd, **kwargs)["stdout_lines"]
-        return self._parse_show(output)
+        table = parse_show(output, converters=converters)
+        return table if columnar else table.to_dicts()
 
     @cached(name='mg_facts')
     def get_extended_minigraph_facts(self, tbinfo, namespace = DEFAULT_NAMESPACE):
@@ -1,59 +1,181 @@
 import datetime
 import logging
 import os
+import Queue
 import shutil
 import tempfile
 import signal
-from multiprocessing import Process, Manager
+import threading
+import time
+import traceback
+from multiprocessing import Process, Queue as ProcessQueue
+from multiprocessing.pool import ThreadPool
 from tests.common.helpers.assertions import pytest_assert as pt_assert
 
 logger = logging.getLogger(__name__)
 
+PROCESS_MODE = "process"
+THREAD_MODE = "thread"
 
-def parallel_run(target, args, kwargs, nodes, timeout=None):
+# Max number of threads of the session-wide pool used in thread mode
+MAX_THREAD_WORKERS = 32
+
+_MAIN_PID = os.getpid()
+_parallel_mode = PROCESS_MODE
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+# Set in the threads running target functions, to detect nested parallel_run
+_thread_local = threading.local()
+
+
+class ParallelResults(dict):
+    """Results returned by parallel_run.
+
+    It is a dict filled by the target function. Additionally holds 'elapsed' - a dict with wall clock time in seconds
+    of running the target function on each node, keyed by node hostname (or node itself if it has no hostname).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ParallelResults, self).__init__(*args, **kwargs)
+        self.elapsed = {}
+
+
+def set_parallel_mode(mode):
+    """Set default mode of parallel_run for the session.
+
+    Args:
+        mode (str): 'process' - run target function on each node in a forked process, 'thread' - run target
+            function on each node in a thread of session-wide thread pool. parallel_run called by the target
+            function runs in its own thread pool.
+    """
+    global _parallel_mode
+    pt_assert(mode in (PROCESS_MODE, THREAD_MODE), 'Unknown parallel mode "{}"'.format(mode))
+    _parallel_mode = mode
+
+
+def _get_thread_pool():
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPool(MAX_THREAD_WORKERS)
+        return _thread_pool
+
+
+def _discard_thread_pool(pool):
+    """Replace the session-wide pool with workers stuck in timed out tasks, the next run gets a new pool."""
+    global _thread_pool
+    with _thread_pool_lock:
+        if _thread_pool is pool:
+            _thread_pool = None
+    # Workers exit when the stuck tasks complete
+    pool.close()
+
+
+def _node_key(node):
+    return getattr(node, "hostname", node)
+
+
+def parallel_run(target, args, kwargs, nodes, timeout=None, mode=None):
     """Run target function on nodes in parallel
 
     Args:
         target (function): The target function to be executed in parallel.
         args (list of tuple): List of arguments for the target function.
         kwargs (dict): Keyword arguments for the target function. It will be extended with two keys: 'node' and
-            'results'. The 'node' key will hold an item of the nodes list. The 'result' key will hold an instance of
-            multiprocessing.Manager().dict(). It is a proxy of the shared dict that will be used by each process for
-            returning execution results.
+            'results'. The 'node' key will hold an item of the nodes list. The 'result' key will hold a dict that
+            will be used by the target function for returning execution results.
         nodes (list of nodes): List of nodes to be used by the target function
-        timeout (int or float, optional): Total time allowed for the spawned multiple processes to run. Defaults to
-            None. When timeout is specified, this function will wait at most 'timeout' seconds for the processes to
-            run. When time is up, this function will try to terminate or even kill all the processes.
+        timeout (int or float, optional): Total time allowed for the target function to run on all the nodes.
+            Defaults to None. When timeout is specified, this function will wait at most 'timeout' seconds for the
+            target function to run. When time is up, this function will try to terminate or even kill all the
+            processes in process mode, or cancel the tasks not started yet in thread mode. The session-wide thread
+            pool with tasks still running is replaced by a new one.
+        mode (str, optional): 'process' or 'thread', see set_parallel_mode. Defaults to the mode set for the session.
 
     Raises:
         flag.: In case any of the spawned process cannot be terminated, fail the test.
 
     Returns:
-        dict: An instance of multiprocessing.Manager().dict(). It is a proxy to the shared dict that is used by all the
-            spawned processes.
+        ParallelResults: The dict filled by the target function on all the nodes.
     """
-    workers = []
-    results = Manager().dict()
+    mode = mode or _parallel_mode
     start_time = datetime.datetime.now()
+    if mode == THREAD_MODE:
+        results = _thread_run(target, args, kwargs, nodes, timeout)
+    else:
+        results = _process_run(target, args, kwargs, nodes, timeout)
+    delta_time = datetime.datetime.now() - start_time
+
+    logger.info('Completed running target "{}" in {} seconds, time per node: {}'
+                .format(target.__name__, str(delta_time),
+                        {str(node): round(elapsed, 3) for node, elapsed in results.elapsed.items()}))
+
+    return results
+
+
+def _process_target(target, args, kwargs, result_queue):
+    """Run target function in a spawned process and send the results back over the queue."""
+    results = {}
+    kwargs['results'] = results
+    start = time.time()
+    try:
+        target(*args, **kwargs)
+    except Exception:
+        logger.error('Target "{}" failed:\n{}'.format(target.__name__, traceback.format_exc()))
+        raise
+    finally:
+        result_queue.put((_node_key(kwargs['node']), results, time.time() - start))
+
+
+def _process_run(target, args, kwargs, nodes, timeout):
+    workers = []
+    results = ParallelResults()
+    result_queue = ProcessQueue()
+    start_time = time.time()
     for node in nodes:
-        kwargs['node'] = node
-        kwargs['results'] = results
+        process_kwargs = dict(kwargs, node=node)
         process_name = "{}--{}".format(target.__name__, node)
-        worker = Process(name=process_name, target=target, args=args, kwargs=kwargs)
+        worker = Process(name=process_name, target=_process_target,
+                         args=(target, args, process_kwargs, result_queue))
         worker.start()
         logger.debug('Started process {} running target "{}"'.format(worker.pid, process_name))
         workers.append(worker)
 
-    for worker in workers:
-        logger.debug('Wait for process "{}" with pid "{}" to complete, timeout={}'.format(worker.name, worker.pid, timeout))
-        worker.join(timeout)
-        logger.debug('Process "{}" with pid "{}" completed'.format(worker.name, worker.pid))
-
-        # If execution time of processes exceeds timeout, need to force terminate them all.
-        if timeout is not None:
-            if (datetime.datetime.now() - start_time).seconds > timeout:
+    # Results must be received before joining the processes, otherwise a process putting big results
+    # into the queue never exits
+    pending = len(workers)
+    while pending:
+        if timeout is None:
+            wait_time = 1
+        else:
+            wait_time = timeout - (time.time() - start_time)
+            if wait_time <= 0:
                 logger.error('Process execution time exceeds {} seconds.'.format(str(timeout)))
                 break
+        try:
+            node_key, node_results, elapsed = result_queue.get(timeout=min(wait_time, 1))
+        except Queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                # A process died without sending results
+                break
+            continue
+        results.update(node_results)
+        results.elapsed[node_key] = elapsed
+        pending -= 1
+
+    # Pick up results sent by processes which exited while waiting
+    while pending:
+        try:
+            node_key, node_results, elapsed = result_queue.get_nowait()
+        except Queue.Empty:
+            break
+        results.update(node_results)
+        results.elapsed[node_key] = elapsed
+        pending -= 1
+
+    for worker in workers:
+        logger.debug('Wait for process "{}" with pid "{}" to complete'.format(worker.name, worker.pid))
+        worker.join(0 if pending else None)
 
     # check if we have any processes that failed - have exitcode non-zero
     failed_processes = [worker for worker in workers if worker.exitcode != 0]
@@ -63,9 +185,7 @@ def parallel_run(target, args, kwargs, nodes, timeout=None):
         if worker.is_alive():
             logger.error('Process {} with pid {} is still alive, try to force terminate it.'.format(worker.name, worker.pid))
             worker.terminate()
-
-    end_time = datetime.datetime.now()
-    delta_time = end_time - start_time
+            worker.join(5)
 
     # Some processes cannot be terminated. Try to kill them and raise flag.
     running_processes = [worker for worker in workers if worker.is_alive()]
@@ -85,7 +205,60 @@ def parallel_run(target, args, kwargs, nodes, timeout=None):
         logger.error('Processes "{}" had failures. Please check the debug logs'.format(failed_processes))
         pt_assert(False, 'Processes "{}" had failures. Please check the debug logs'.format(failed_processes))
 
-    logger.info('Completed running processes for target "{}" in {} seconds'.format(target.__name__, str(delta_time)))
+    return results
+
+
+def _thread_run(target, args, kwargs, nodes, timeout):
+    results = ParallelResults()
+    cancelled = threading.Event()
+    failed_nodes = []
+
+    def _thread_target(node):
+        if cancelled.is_set():
+            return
+        _thread_local.in_target = True
+        start = time.time()
+        try:
+            target(*args, **dict(kwargs, node=node, results=results))
+        except Exception:
+            logger.error('Target "{}" failed on {}:\n{}'.format(target.__name__, node, traceback.format_exc()))
+            failed_nodes.append(node)
+        finally:
+            _thread_local.in_target = False
+            results.elapsed[_node_key(node)] = time.time() - start
+
+    # A nested run gets its own pool, the workers of the session-wide pool can be all held by the outer
+    # tasks waiting for it
+    nested = getattr(_thread_local, "in_target", False)
+    if nested:
+        pool = ThreadPool(max(1, min(len(nodes), MAX_THREAD_WORKERS)))
+    else:
+        pool = _get_thread_pool()
+    tasks = [(node, pool.apply_async(_thread_target, (node,))) for node in nodes]
+    deadline = time.time() + timeout if timeout is not None else None
+    for node, task in tasks:
+        while not task.ready():
+            if deadline is not None and time.time() > deadline:
+                break
+            task.wait(1 if deadline is None else max(0, min(1, deadline - time.time())))
+
+    running_nodes = [node for node, task in tasks if not task.ready()]
+    if running_nodes:
+        # Threads can't be terminated, only the tasks not started yet are cancelled
+        cancelled.set()
+    if nested:
+        pool.close()
+    elif running_nodes:
+        _discard_thread_pool(pool)
+    if running_nodes:
+        logger.error('Execution time exceeds {} seconds, target "{}" is still running on {}'
+                     .format(timeout, target.__name__, running_nodes))
+        pt_assert(False, 'Target "{}" did not complete in {} seconds on {}'
+                  .format(target.__name__, timeout, running_nodes))
+
+    if failed_nodes:
+        logger.error('Target "{}" had failures on "{}". Please check the debug logs'.format(target.__name__, failed_nodes))
+        pt_assert(False, 'Target "{}" had failures on "{}". Please check the debug logs'.format(target.__name__, failed_nodes))
 
     return results
 
@@ -93,11 +266,15 @@ def parallel_run(target, args, kwargs, nodes, timeout=None):
 def reset_ansible_local_tmp(target):
     """Decorator for resetting ansible default local tmp dir for parallel multiprocessing.Process
 
+    In thread mode the target runs in the main process, so the ansible local tmp dir is not changed.
+
     Args:
         target (function): The function to be decorated.
     """
 
     def wrapper(*args, **kwargs):
+        if os.getpid() == _MAIN_PID:
+            return target(*args, **kwargs)
 
         # Reset the ansible default local tmp directory for the current subprocess
         # Otherwise, multiple processes could share a same ansible default tmp directory and there could be conflicts
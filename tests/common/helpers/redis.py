@@ -1,10 +1,50 @@
 import logging
 import json
+import pipes
 from tests.common.helpers.constants import DEFAULT_NAMESPACE
 from tests.common.devices.sonic_asic import SonicAsic
 
 logger = logging.getLogger(__name__)
 
+# Lua script run by EVAL for batched requests. ARGV[1] is a JSON list of requests, each request is a list of command
+# name and its arguments. Returns JSON list of results in the same order. SCAN and TABLE take a cursor and a key
+# pattern and do a single SCAN step, so redis is not blocked for the whole walk of the keyspace. They return the next
+# cursor and the matched keys, TABLE also gets all fields of the matched keys.
+BATCH_SCRIPT = """
+local function hgetall(key)
+    local reply, fields = redis.call('HGETALL', key), {}
+    for i = 1, #reply, 2 do fields[reply[i]] = reply[i + 1] end
+    return fields
+end
+local results = {}
+for i, req in ipairs(cjson.decode(ARGV[1])) do
+    local cmd = req[1]
+    if cmd == 'SCAN' or cmd == 'TABLE' then
+        local reply = redis.call('SCAN', req[2], 'MATCH', req[3], 'COUNT', 1000)
+        local value = reply[2]
+        if cmd == 'TABLE' then
+            value = {}
+            for _, key in ipairs(reply[2]) do value[key] = hgetall(key) end
+        end
+        results[i] = {reply[1], value}
+    elseif cmd == 'HGETALL' then
+        results[i] = hgetall(req[2])
+    else
+        results[i] = redis.call(unpack(req))
+    end
+end
+return cjson.encode(results)
+"""
+
+# Batched requests returning lists, Lua cjson encodes the empty list as empty JSON object
+BATCH_LIST_COMMANDS = ("KEYS", "SCAN")
+
+# Batched requests walking the keyspace, they are run one SCAN step per EVAL
+BATCH_SCAN_COMMANDS = ("SCAN", "TABLE")
+
+# Maximum length of the JSON list of requests passed to one EVAL, the kernel limits single argument to 128KB
+BATCH_MAX_ARG_LEN = 64 * 1024
+
 
 class RedisCli(object):
     """Base class for interface to RedisDb using redis-cli command.
@@ -21,6 +61,8 @@ class RedisCli(object):
         self.database = database
         self.pid = pid
         self.ip = None
+        # Map <key pattern, snapshot of the table>
+        self.table_snapshots = {}
 
     def _cli_prefix(self):
         """Builds opening of redis CLI command for other methods."""
@@ -163,6 +205,159 @@ class RedisCli(object):
         else:
             return result['stdout'].decode('unicode-escape')
 
+    def _eval_batch(self, requests):
+        """
+        Runs the requests by the batch Lua script, in as few redis-cli invocations as the argument length allows.
+
+        Args:
+            requests: List of requests, see batch.
+
+        Returns:
+            List of raw results of the requests, in the same order.
+
+        Raises:
+            RedisNoCommandOutput: If the command had no output.
+
+        """
+        chunks, chunk_len = [[]], 0
+        for request in requests:
+            request_len = len(json.dumps(request)) + 2
+            if chunks[-1] and chunk_len + request_len > BATCH_MAX_ARG_LEN:
+                chunks.append([])
+                chunk_len = 0
+            chunks[-1].append(request)
+            chunk_len += request_len
+
+        results = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            cmd = self._cli_prefix() + "EVAL {} 0 {}".format(pipes.quote(BATCH_SCRIPT), pipes.quote(json.dumps(chunk)))
+            logger.debug("REDIS: batch of %d requests", len(chunk))
+            result = self.host.run_redis_cli_cmd(cmd)
+            if len(result["stdout_lines"]) == 0:
+                raise RedisNoCommandOutput("Batch of %d requests returned no response." % len(chunk))
+            results.extend(json.loads(result["stdout"]))
+        return results
+
+    def batch(self, requests):
+        """
+        Executes many redis requests in few redis-cli invocations.
+
+        The requests are run by a Lua script with EVAL, so a single command is run on the host for a chunk of them.
+
+        Args:
+            requests: List of requests. Each request is a list of a command name and its arguments. Supported are
+                GET, HGET, HGETALL, KEYS, EXISTS and also SCAN and TABLE with a key pattern. SCAN returns the list of
+                keys matching the pattern, TABLE returns dictionary of the matched keys and all their fields. They
+                walk the keyspace by SCAN, one cursor step per EVAL, so unlike KEYS they don't block redis for a long
+                time on big tables. Each step costs a redis-cli invocation, steps of all SCAN and TABLE requests of
+                the batch are run together.
+
+        Returns:
+            List of results of the requests, in the same order. Result of a request for a missing value is None.
+
+        Raises:
+            RedisNoCommandOutput: If the command had no output.
+
+        """
+        results = [None] * len(requests)
+        # Map <index of SCAN or TABLE request, cursor of its next step>
+        cursors = {}
+        others = []
+        for index, request in enumerate(requests):
+            command = request[0].upper()
+            if command in BATCH_SCAN_COMMANDS:
+                cursors[index] = "0"
+                results[index] = [] if command in BATCH_LIST_COMMANDS else {}
+            else:
+                others.append(index)
+
+        for index, value in zip(others, self._eval_batch([requests[index] for index in others])):
+            if value is False:
+                value = None
+            elif value == {} and requests[index][0].upper() in BATCH_LIST_COMMANDS:
+                value = []
+            results[index] = value
+
+        while cursors:
+            indexes = sorted(cursors)
+            steps = [[requests[index][0].upper(), cursors[index], requests[index][1]] for index in indexes]
+            for index, (cursor, value) in zip(indexes, self._eval_batch(steps)):
+                if isinstance(results[index], list):
+                    results[index].extend(value or [])
+                else:
+                    results[index].update(value)
+                if cursor == "0":
+                    del cursors[index]
+                else:
+                    cursors[index] = cursor
+        return results
+
+    def hget_key_values(self, keys, field):
+        """
+        Gets a field of many keys in one redis-cli invocation.
+
+        Args:
+            keys: List of full names of the keys to get.
+            field: Name of the hash field to get.
+
+        Returns:
+            Dictionary of the key to the value of the field.
+
+        Raises:
+            RedisKeyNotFound: If the key or field has no value or is not present.
+
+        """
+        values = self.batch([["HGET", key, field] for key in keys])
+        for key, value in zip(keys, values):
+            if value is None:
+                raise RedisKeyNotFound("Key: %s, field: %s not found" % (key, field))
+        return dict(zip(keys, values))
+
+    def scan_keys(self, pattern):
+        """
+        Gets the list of keys matching a pattern using SCAN instead of KEYS.
+
+        Args:
+            pattern: Pattern of the keys, like in the KEYS command.
+
+        Returns:
+            List of the matched keys.
+
+        Raises:
+            RedisNoCommandOutput: If no key matches the pattern.
+
+        """
+        keys = self.batch([["SCAN", pattern]])[0]
+        if not keys:
+            logger.warning("No keys match: %s" % pattern)
+            raise RedisNoCommandOutput("Pattern: %s matched no keys." % pattern)
+        return keys
+
+    def get_table(self, pattern, refresh=False):
+        """
+        Gets snapshot of all the keys matching a pattern with all their fields.
+
+        The snapshot is taken with batched SCAN steps and it is cached, use refresh or refresh_tables to get
+        a fresh copy from the DUT.
+
+        Args:
+            pattern: Pattern of the keys, like in the KEYS command.
+            refresh: If True, get a fresh copy from the DUT.
+
+        Returns:
+            Dictionary of the key to the dictionary of its fields.
+
+        """
+        if pattern not in self.table_snapshots or refresh:
+            self.table_snapshots[pattern] = self.batch([["TABLE", pattern]])[0]
+        return self.table_snapshots[pattern]
+
+    def refresh_tables(self):
+        """Drops all the cached table snapshots, next get_table calls get fresh copies from the DUT."""
+        self.table_snapshots = {}
+
     def dump(self, table):
         """
         Dumps and entire table with redis-dump.
@@ -224,7 +419,6 @@ class AsicDbCli(RedisCli):
         super(AsicDbCli, self).__init__(host, 1)
         # cache this to improve speed
         self.hostif_portidlist = []
-        self.hostif_table = []
         self.system_port_key_list = []
         self.port_key_list = []
 
@@ -238,8 +432,7 @@ class AsicDbCli(RedisCli):
         if self.system_port_key_list != [] and refresh is False:
             return self.system_port_key_list
 
-        cmd = self._cli_prefix() + "KEYS %s*" % AsicDbCli.ASIC_SYSPORT_TABLE
-        self.system_port_key_list = self._run_and_raise(cmd)["stdout_lines"]
+        self.system_port_key_list = self.scan_keys("%s*" % AsicDbCli.ASIC_SYSPORT_TABLE)
         return self.system_port_key_list
 
     def get_port_key_list(self, refresh=False):
@@ -248,34 +441,28 @@ class AsicDbCli(RedisCli):
         if self.port_key_list != [] and refresh is False:
             return self.port_key_list
 
-        cmd = self._cli_prefix() + "KEYS %s*" % AsicDbCli.ASIC_PORT_TABLE
-        self.port_key_list = self._run_and_raise(cmd)["stdout_lines"]
+        self.port_key_list = self.scan_keys("%s*" % AsicDbCli.ASIC_PORT_TABLE)
         return self.port_key_list
 
     def get_hostif_list(self):
         """Returns a list of keys in the host interface table"""
-        cmd = self._cli_prefix() + "KEYS %s:*" % AsicDbCli.ASIC_HOSTIF_TABLE
-        return self._run_and_raise(cmd)["stdout_lines"]
+        return self.scan_keys("%s:*" % AsicDbCli.ASIC_HOSTIF_TABLE)
 
     def get_asic_db_lag_list(self):
         """Returns a list of keys in the lag table"""
-        cmd = self._cli_prefix() + "KEYS %s:*" % AsicDbCli.ASIC_LAG_TABLE
-        return self._run_and_raise(cmd)["stdout_lines"]
+        return self.scan_keys("%s:*" % AsicDbCli.ASIC_LAG_TABLE)
 
     def get_asic_db_lag_member_list(self):
         """Returns a list of keys in the lag member table"""
-        cmd = self._cli_prefix() + "KEYS %s:*" % AsicDbCli.ASIC_LAG_MEMBER_TABLE
-        return self._run_and_raise(cmd)["stdout_lines"]
+        return self.scan_keys("%s:*" % AsicDbCli.ASIC_LAG_MEMBER_TABLE)
 
     def get_router_if_list(self):
         """Returns a list of keys in the router interface table"""
-        cmd = self._cli_prefix() + "KEYS %s:*" % AsicDbCli.ASIC_ROUTERINTF_TABLE
-        return self._run_and_raise(cmd)["stdout_lines"]
+        return self.scan_keys("%s:*" % AsicDbCli.ASIC_ROUTERINTF_TABLE)
 
     def get_neighbor_list(self):
         """Returns a list of keys in the neighbor table"""
-        cmd = self._cli_prefix() + "KEYS %s:*" % AsicDbCli.ASIC_NEIGH_ENTRY_TABLE
-        return self._run_and_raise(cmd)["stdout_lines"]
+        return self.scan_keys("%s:*" % AsicDbCli.ASIC_NEIGH_ENTRY_TABLE)
 
     def get_neighbor_key_by_ip(self, ipaddr):
         """Returns the key in the neighbor table that is for a specific IP neighbor
@@ -327,13 +514,9 @@ class AsicDbCli(RedisCli):
 
         """
 
-        if self.hostif_table != [] and refresh is False:
-            hostif_table = self.hostif_table
-        else:
-            hostif_table = self.dump("%s:" % AsicDbCli.ASIC_HOSTIF_TABLE)
-            self.hostif_table = hostif_table
-
-        return hostif_table
+        table = self.get_table("%s:*" % AsicDbCli.ASIC_HOSTIF_TABLE, refresh)
+        # Same format as the output of redis-dump
+        return dict((key, {"type": "hash", "value": fields}) for key, fields in table.items())
 
     def get_hostif_portid_oidlist(self, refresh=False):
         """
@@ -0,0 +1,178 @@
+"""
+Parser of tabular output of SONiC show commands.
+
+The output must follow the pattern of 'show interface status': a line of column headers, then a separation line
+with '-' under each column header. Both header and column content are within the width of '-' chars for that column.
+
+Rows are sliced column by column using the column positions, and kept in a columnar ShowTable. Dicts of rows are
+built only on demand. Column positions are cached per separation line.
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+SEP_LINE_PATTERN = re.compile(r"^( *-+ *)+$")
+
+# Map <separation line, list of column positions>
+_positions_cache = {}
+# Max number of separation lines in the cache, it is cleared when full
+MAX_POSITIONS_CACHE_SIZE = 256
+
+RATE_UNITS = {
+    "b/s": 1,
+    "kb/s": 1000,
+    "mb/s": 1000 ** 2,
+    "gb/s": 1000 ** 3,
+}
+
+
+def to_int(value):
+    """Convert value like '12,345' to int. Values which are not numbers, like 'N/A', are returned unchanged."""
+    try:
+        return int(value.replace(",", ""))
+    except ValueError:
+        return value
+
+
+def to_float(value):
+    """Convert value like '12.5' or '0.01%' to float. Values which are not numbers are returned unchanged."""
+    try:
+        return float(value.replace(",", "").rstrip("%"))
+    except ValueError:
+        return value
+
+
+def to_rate(value):
+    """Convert rate like '1.23 MB/s' to float bytes per second. Values which are not rates are returned unchanged."""
+    parts = value.split()
+    if len(parts) != 2 or parts[1].lower() not in RATE_UNITS:
+        return value
+    try:
+        return float(parts[0].replace(",", "")) * RATE_UNITS[parts[1].lower()]
+    except ValueError:
+        return value
+
+
+def parse_column_positions(sep_line, sep_char='-'):
+    """Parse the position of each columns in the command output
+
+    Args:
+        sep_line: The output line separating actual data and column headers
+        sep_char: The character used in separation line. Defaults to '-'.
+
+    Returns:
+        Returns a list. Each item is a tuple with two elements. The first element is start position of a column. The
+        second element is the end position of the column.
+    """
+    prev = ' ',
+    positions = []
+    for pos, char in enumerate(sep_line + ' '):
+        if char == sep_char:
+            if char != prev:
+                left = pos
+        else:
+            if char != prev:
+                right = pos
+                positions.append((left, right))
+        prev = char
+    return positions
+
+
+def _get_positions(sep_line):
+    positions = _positions_cache.get(sep_line)
+    if positions is None:
+        positions = parse_column_positions(sep_line)
+        if len(_positions_cache) >= MAX_POSITIONS_CACHE_SIZE:
+            _positions_cache.clear()
+        _positions_cache[sep_line] = positions
+    return positions
+
+
+def _find_sep_line(output_lines):
+    """Find index of the separation line."""
+    for idx, line in enumerate(output_lines):
+        if SEP_LINE_PATTERN.match(line):
+            return idx
+    return None
+
+
+class ShowTable(object):
+    """Parsed output of a show command, stored column by column.
+
+    Iterating over the table or indexing it gives dicts of rows, the same as items of the list returned by
+    SonicHost.show_and_parse. Use 'column' to get values of a single column without building the dicts.
+
+    Args:
+        headers: List of column headers in lowercase.
+        columns: List of lists of column values, in the same order as headers.
+    """
+    __slots__ = ("headers", "columns", "_header_idx")
+
+    def __init__(self, headers, columns):
+        self.headers = headers
+        self.columns = columns
+        # Same as for dicts of rows, the last column wins when headers are duplicated
+        self._header_idx = dict((header, idx) for idx, header in enumerate(headers))
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        return iter(self.to_dicts())
+
+    def __getitem__(self, idx):
+        return dict(zip(self.headers, [column[idx] for column in self.columns]))
+
+    def column(self, header):
+        """Get list of values of the column with the header."""
+        return self.columns[self._header_idx[header]]
+
+    def convert(self, converters):
+        """Convert values of columns in place.
+
+        Args:
+            converters: Dict of column header to function converting a string value, e.g. to_int or to_rate.
+        """
+        for header, converter in converters.items():
+            idx = self._header_idx[header]
+            self.columns[idx] = [converter(value) for value in self.columns[idx]]
+        return self
+
+    def to_dicts(self):
+        """Get list of dicts of rows. Keys of the dictionary are the column headers in lowercase."""
+        if not self.columns:
+            return []
+        headers = self.headers
+        return [dict(zip(headers, row)) for row in zip(*self.columns)]
+
+
+def parse_show(output_lines, converters=None):
+    """Parse tabular output of a show command.
+
+    Args:
+        output_lines: Lines of the show command output.
+        converters: Dict of column header to function converting the column values, see ShowTable.convert.
+
+    Returns:
+        ShowTable: Parsed output. The table is empty if the output can't be parsed.
+    """
+    idx = _find_sep_line(output_lines)
+    if idx is None:
+        logger.error('Failed to find separation line in the show command output')
+        return ShowTable([], [])
+
+    header_line = output_lines[idx - 1]
+    try:
+        positions = _get_positions(output_lines[idx])
+    except Exception as e:
+        logger.error('Possibly bad command output, exception: {}'.format(repr(e)))
+        return ShowTable([], [])
+
+    content_lines = output_lines[idx + 1:]
+    headers = [header_line[left:right].strip().lower() for left, right in positions]
+    columns = [[line[left:right].strip() for line in content_lines] for left, right in positions]
+    table = ShowTable(headers, columns)
+    if converters:
+        table.convert(converters)
+    return table
@@ -24,8 +24,8 @@ def get_lag_ids_from_chassis_db(duthosts):
     for sup in duthosts.supervisor_nodes:
         voqdb = VoqDbCli(sup)
         lag_list = voqdb.get_lag_list()
-        for lag in lag_list:
-            lag_ids.append(voqdb.hget_key_value(lag, "lag_id"))
+        lag_id_map = voqdb.hget_key_values(lag_list, "lag_id")
+        lag_ids.extend(lag_id_map[lag] for lag in lag_list)
 
     logging.info("LAG id's preset in CHASSIS_DB are {}".format(lag_ids))
     return lag_ids
@@ -157,8 +157,9 @@ def verify_lag_in_asic_db(asics, lag_id, deleted=False):
         asicdb = AsicDbCli(asic)
         asic_db_lag_list = asicdb.get_asic_db_lag_list()
         if deleted:
+            aggregate_ids = asicdb.hget_key_values(asic_db_lag_list, "SAI_LAG_ATTR_SYSTEM_PORT_AGGREGATE_ID")
             for lag in asic_db_lag_list:
-                if asicdb.hget_key_value(lag, "SAI_LAG_ATTR_SYSTEM_PORT_AGGREGATE_ID") == lag_id:
+                if aggregate_ids[lag] == lag_id:
                     pytest.fail('LAG id {} for LAG {} exist in ASIC DB,'
                                 ' Expected was should not be present'.format(lag_id, TMP_PC))
 
@@ -275,13 +276,14 @@ def verify_lag_member_in_asic_db(asics, lag_id, pc_members, deleted=False):
         asic_db_lag_member_list = asicdb.get_asic_db_lag_member_list()
         lag_oid = None
         if deleted:
+            aggregate_ids = asicdb.hget_key_values(asic_lag_list, "SAI_LAG_ATTR_SYSTEM_PORT_AGGREGATE_ID")
             for lag in asic_lag_list:
-                if asicdb.hget_key_value(lag,
-                                         "SAI_LAG_ATTR_SYSTEM_PORT_AGGREGATE_ID") == lag_id:
+                if aggregate_ids[lag] == lag_id:
                     lag_oid = ":".join(lag for lag in lag.split(':')[-1:-3:-1])
 
+            member_lag_ids = asicdb.hget_key_values(asic_db_lag_member_list, "SAI_LAG_MEMBER_ATTR_LAG_ID")
             for lag_member in asic_db_lag_member_list:
-                if asicdb.hget_key_value(lag_member, "SAI_LAG_MEMBER_ATTR_LAG_ID") == lag_oid:
+                if member_lag_ids[lag_member] == lag_oid:
                     pytest.fail("lag members {} still exist in lag member table on {},"
                                 " Expected was should be deleted"
                                  .format(pc_members, asic.sonichost.hostname))
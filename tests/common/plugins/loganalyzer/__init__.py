@@ -9,6 +9,8 @@ from tests.common.helpers.parallel import parallel_run, reset_ansible_local_tmp
 def pytest_addoption(parser):
     parser.addoption("--disable_loganalyzer", action="store_true", default=False,
                      help="disable loganalyzer analysis for 'loganalyzer' fixture")
+    parser.addoption("--loganalyzer_streaming", action="store_true", default=False,
+                     help="analyze only syslog content appended during the test on the DUT instead of extracting and downloading the whole log")
 
 
 @reset_ansible_local_tmp
@@ -52,7 +54,8 @@ def loganalyzer(duthosts, request):
     analyzers = {}
     parallel_run(analyzer_logrotate, [], {}, duthosts, timeout=120)
     for duthost in duthosts:
-        analyzers[duthost.hostname] = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name)
+        analyzers[duthost.hostname] = LogAnalyzer(ansible_host=duthost, marker_prefix=request.node.name,
+                                                  streaming=request.config.getoption("--loganalyzer_streaming"))
     markers = parallel_run(analyzer_add_marker, [analyzers], {}, duthosts, timeout=120)
 
     yield analyzers
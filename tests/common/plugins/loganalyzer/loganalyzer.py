@@ -1,13 +1,16 @@
 import sys
+import gzip
+import json
+import shutil
 import logging
 import os
-import re
 import time
 import pprint
 
 import system_msg_handler
 
 from system_msg_handler import AnsibleLogAnalyzer as ansible_loganalyzer
+from system_msg_handler import MessageRules
 from os.path import join, split
 from os.path import normpath
 
@@ -17,6 +20,9 @@ COMMON_IGNORE = join(split(__file__)[0], "loganalyzer_common_ignore.txt")
 COMMON_EXPECT = join(split(__file__)[0], "loganalyzer_common_expect.txt")
 SYSLOG_TMP_FOLDER = "/tmp/syslog"
 
+# Regular expressions parsed from the rule files, the files are parsed once per session
+_parsed_regexp_files = {}
+
 
 class LogAnalyzerError(Exception):
     """Raised when loganalyzer found matches during analysis phase."""
@@ -25,7 +31,7 @@ class LogAnalyzerError(Exception):
 
 
 class LogAnalyzer:
-    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp", start_marker=None, additional_files={}):
+    def __init__(self, ansible_host, marker_prefix, dut_run_dir="/tmp", start_marker=None, additional_files={}, streaming=False):
         self.ansible_host = ansible_host
         self.dut_run_dir = dut_run_dir
         self.extracted_syslog = os.path.join(self.dut_run_dir, "syslog")
@@ -43,6 +49,8 @@ class LogAnalyzer:
 
         self.additional_files = list(additional_files.keys())
         self.additional_start_str = list(additional_files.values())
+        # In streaming mode only the log content appended after "init" is analyzed on the DUT
+        self.streaming = streaming
 
     def _add_end_marker(self, marker):
         """
@@ -108,15 +116,17 @@ class LogAnalyzer:
         @summary: Load regular expressions from common files, which are localted in folder with legacy loganalyzer.
                   Loaded regular expressions are used by "analyze" method to match expected text in the downloaded log file.
         """
-        self.match_regex = self.ansible_loganalyzer.create_msg_regex([COMMON_MATCH])[1]
-        self.ignore_regex = self.ansible_loganalyzer.create_msg_regex([COMMON_IGNORE])[1]
-        self.expect_regex = self.ansible_loganalyzer.create_msg_regex([COMMON_EXPECT])[1]
+        self.match_regex = self.parse_regexp_file(COMMON_MATCH)
+        self.ignore_regex = self.parse_regexp_file(COMMON_IGNORE)
+        self.expect_regex = self.parse_regexp_file(COMMON_EXPECT)
 
     def parse_regexp_file(self, src):
         """
         @summary: Get regular expressions defined in src file.
         """
-        return self.ansible_loganalyzer.create_msg_regex([src])[1]
+        if src not in _parsed_regexp_files:
+            _parsed_regexp_files[src] = self.ansible_loganalyzer.create_msg_regex([src])[1]
+        return list(_parsed_regexp_files[src])
 
     def run_cmd(self, callback, *args, **kwargs):
         """
@@ -152,12 +162,23 @@ class LogAnalyzer:
 
         return self._setup_marker()
 
+    def _is_streaming(self):
+        """
+        Streaming mode relies on the log position recorded by "init", so it can't be used with custom start marker
+        """
+        return self.streaming and not self.start_marker
+
     def _setup_marker(self):
         """
         Adds the marker to the syslog
         """
         start_marker = ".".join((self.marker_prefix, time.strftime("%Y-%m-%d-%H:%M:%S", time.gmtime())))
         cmd = "python {run_dir}/loganalyzer.py --action init --run_id {start_marker}".format(run_dir=self.dut_run_dir, start_marker=start_marker)
+        if self._is_streaming():
+            cmd = "python {run_dir}/loganalyzer.py --action init_stream --run_id {start_marker} --out_dir {run_dir}"\
+                .format(run_dir=self.dut_run_dir, start_marker=start_marker)
+            if self.additional_files:
+                cmd += " --logs {}".format(",".join(self.additional_files))
 
         logging.debug("Adding start marker '{}'".format(start_marker))
         self.ansible_host.command(cmd)
@@ -177,7 +198,9 @@ class LogAnalyzer:
                             "match_files": {},
                             "match_messages": {},
                             "expect_messages": {},
-                            "unused_expected_regexp": []
+                            "unused_expected_regexp": [],
+                            "match_regexp_hits": {},
+                            "expect_regexp_hits": {}
                             }
         timestamp = time.strftime("%Y-%m-%d-%H:%M:%S", time.gmtime())
         tmp_folder = ".".join((SYSLOG_TMP_FOLDER, timestamp))
@@ -189,6 +212,10 @@ class LogAnalyzer:
         else:
             start_string = self.start_marker
 
+        if self._is_streaming():
+            analyzer_parse_result = self._analyze_stream(marker)
+            return self._build_summary(analyzer_summary, analyzer_parse_result, fail)
+
         try:
             # Disable logrotate cron task
             self.ansible_host.command("sed -i 's/^/#/g' /etc/cron.d/logrotate")
@@ -212,7 +239,8 @@ class LogAnalyzer:
             self._add_end_marker(marker)
 
             # On DUT extract syslog files from /var/log/ and create one file by location - /tmp/syslog
-            self.ansible_host.extract_log(directory='/var/log', file_prefix='syslog', start_string=start_string, target_filename=self.extracted_syslog)
+            self.ansible_host.extract_log(directory='/var/log', file_prefix='syslog', start_string=start_string,
+                                          target_filename=self.extracted_syslog + ".gz", compress=True)
             for idx, path in enumerate(self.additional_files):
                 file_dir, file_name = split(path)
                 extracted_file_name = os.path.join(self.dut_run_dir, file_name)
@@ -220,7 +248,8 @@ class LogAnalyzer:
                     start_str = self.additional_start_str[idx]
                 else:
                     start_str = start_string
-                self.ansible_host.extract_log(directory=file_dir, file_prefix=file_name, start_string=start_str, target_filename=extracted_file_name)
+                self.ansible_host.extract_log(directory=file_dir, file_prefix=file_name, start_string=start_str,
+                                              target_filename=extracted_file_name + ".gz", compress=True)
         finally:
             # Enable logrotate cron task back
             self.ansible_host.command("sed -i 's/^#//g' /etc/cron.d/logrotate")
@@ -236,9 +265,9 @@ class LogAnalyzer:
             self.save_extracted_file(dest=tmp_folder, src=extracted_file_name)
             file_list.append(tmp_folder)
 
-        match_messages_regex = re.compile('|'.join(self.match_regex)) if len(self.match_regex) else None
-        ignore_messages_regex = re.compile('|'.join(self.ignore_regex)) if len(self.ignore_regex) else None
-        expect_messages_regex = re.compile('|'.join(self.expect_regex)) if len(self.expect_regex) else None
+        match_messages_regex = MessageRules.get(self.match_regex) if len(self.match_regex) else None
+        ignore_messages_regex = MessageRules.get(self.ignore_regex) if len(self.ignore_regex) else None
+        expect_messages_regex = MessageRules.get(self.expect_regex) if len(self.expect_regex) else None
 
         analyzer_parse_result = self.ansible_loganalyzer.analyze_file_list(file_list, match_messages_regex, ignore_messages_regex, expect_messages_regex)
         # Print file content and remove the file
@@ -247,8 +276,47 @@ class LogAnalyzer:
                 logging.debug("{} file content:\n\n{}".format(folder, fo.read()))
             os.remove(folder)
 
-        total_match_cnt = 0
-        total_expect_cnt = 0
+        return self._build_summary(analyzer_summary, analyzer_parse_result, fail)
+
+    def _analyze_stream(self, marker):
+        """
+        @summary: Analyze on the DUT only the log content appended after "init" call, following log rotation.
+                  Only matching and expected lines are downloaded from the DUT.
+
+        @param marker: Marker obtained from "init" method.
+
+        @return: Map <file_name, [matching_lines, expected_lines]>
+        """
+        stream_config = {"match": self.match_regex,
+                         "ignore": self.ignore_regex,
+                         "expect": self.expect_regex,
+                         "start_strings": {}}
+        for path, start_str in zip(self.additional_files, self.additional_start_str):
+            if start_str:
+                stream_config["start_strings"][path] = start_str
+
+        stream_config_file = os.path.join(self.dut_run_dir, "loganalyzer.{}.json".format(marker))
+        self.ansible_host.copy(content=json.dumps(stream_config), dest=stream_config_file)
+
+        cmd = "python {run_dir}/loganalyzer.py --action analyze_stream --run_id {marker} --out_dir {run_dir} --stream_config {config}"\
+            .format(run_dir=self.dut_run_dir, marker=marker, config=stream_config_file)
+        try:
+            stream_result = json.loads(self.ansible_host.command(cmd)["stdout"])
+        finally:
+            self.ansible_host.file(path=stream_config_file, state="absent")
+
+        analyzer_parse_result = {}
+        for log_file, value in stream_result.items():
+            logging.debug("{}: analyzed {} lines, {} matches, {} expected matches".format(
+                log_file, value["lines"], len(value["match"]), len(value["expect"])))
+            analyzer_parse_result[log_file] = [value["match"], value["expect"]]
+        return analyzer_parse_result
+
+    def _build_summary(self, analyzer_summary, analyzer_parse_result, fail):
+        """
+        @summary: Fill analyzer summary with parsed result, verify it if "fail" is True or return it otherwise.
+        """
+        matching_lines_total = []
         expected_lines_total = []
         unused_regex_messages = []
 
@@ -259,15 +327,17 @@ class LogAnalyzer:
             analyzer_summary["match_files"][key] = {"match": len(matching_lines), "expected_match": len(expecting_lines)}
             analyzer_summary["match_messages"][key] = matching_lines
             analyzer_summary["expect_messages"][key] = expecting_lines
+            matching_lines_total.extend(matching_lines)
             expected_lines_total.extend(expecting_lines)
 
-        # Find unused regex matches
-        for regex in self.expect_regex:
-            for line in expected_lines_total:
-                if re.search(regex, line):
-                    break
-            else:
-                unused_regex_messages.append(regex)
+        # Count hits per regular expression and find unused regex matches
+        if self.match_regex:
+            match_hits = MessageRules.get(self.match_regex).count_hits(matching_lines_total)
+            analyzer_summary["match_regexp_hits"] = dict(zip(self.match_regex, match_hits))
+        if self.expect_regex:
+            expect_hits = MessageRules.get(self.expect_regex).count_hits(expected_lines_total)
+            analyzer_summary["expect_regexp_hits"] = dict(zip(self.expect_regex, expect_hits))
+            unused_regex_messages = [regex for regex, hits in zip(self.expect_regex, expect_hits) if not hits]
         analyzer_summary["total"]["expected_missing_match"] = len(unused_regex_messages)
         analyzer_summary["unused_expected_regexp"] = unused_regex_messages
 
@@ -282,14 +352,18 @@ class LogAnalyzer:
 
         @param dest: File path to store downloaded log file.
         """
-        self.ansible_host.fetch(dest=dest, src=self.extracted_syslog, flat="yes")
+        self.save_extracted_file(dest=dest, src=self.extracted_syslog)
 
     def save_extracted_file(self, dest, src):
         """
-        @summary: Download extracted file to the ansible host.
+        @summary: Download extracted file to the ansible host. The file is extracted gzip-compressed on the DUT
+                  and is decompressed after download.
 
         @param dest: File path to store downloaded file.
 
         @param src: Source path to store downloaded file.
         """
-        self.ansible_host.fetch(dest=dest, src=src, flat="yes")
+        self.ansible_host.fetch(dest=dest + ".gz", src=src + ".gz", flat="yes")
+        with gzip.open(dest + ".gz", "rb") as fi, open(dest, "wb") as fo:
+            shutil.copyfileobj(fi, fo)
+        os.remove(dest + ".gz")
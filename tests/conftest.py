@@ -29,9 +29,11 @@ from tests.common.utilities import get_host_vars
 from tests.common.utilities import get_host_visible_vars
 from tests.common.utilities import get_test_server_host
 from tests.common.helpers.dut_utils import is_supervisor_node, is_frontend_node
+from tests.common.helpers.parallel import set_parallel_mode
 from tests.common.cache import FactsCache
 
 from tests.common.connections.console_host import ConsoleHost
+from tests.common.connections.ssh_exec_conn import get_latency_report
 
 
 logger = logging.getLogger(__name__)
@@ -55,6 +57,12 @@ pytest_plugins = ('tests.common.plugins.ptfadapter',
 def pytest_addoption(parser):
     parser.addoption("--testbed", action="store", default=None, help="testbed name")
     parser.addoption("--testbed_file", action="store", default=None, help="testbed file name")
+    parser.addoption("--facts_cache_versioning", action="store_true", default=False,
+                     help="Invalidate cached facts of DUTs when DUT image version or config_db.json changed")
+    parser.addoption("--parallel_mode", action="store", default="process", choices=["process", "thread"],
+                     help="Run parallel_run targets in forked processes or in threads of a session-wide pool")
+    parser.addoption("--ssh_fast_path", action="store_true", default=False,
+                     help="Run simple shell/command/copy/fetch calls on DUTs over persistent SSH connection instead of Ansible")
 
     # test_vrf options
     parser.addoption("--vrf_capacity", action="store", default=None, type=int, help="vrf capacity of dut (4-1000)")
@@ -135,6 +143,14 @@ def enhance_inventory(request):
         logger.error("Failed to set enhanced 'ansible_inventory' to request.config.option")
 
 
+@pytest.fixture(scope="session", autouse=True)
+def config_parallel_mode(request):
+    """
+    Set mode of parallel_run for the session according to the '--parallel_mode' option.
+    """
+    set_parallel_mode(request.config.getoption("--parallel_mode"))
+
+
 @pytest.fixture(scope="session", autouse=True)
 def config_logging(request):
 
@@ -224,7 +240,30 @@ def fixture_duthosts(enhance_inventory, ansible_adhoc, tbinfo, request):
         mandatory argument for the class constructors.
     @param tbinfo: fixture provides information about testbed.
     """
-    return DutHosts(ansible_adhoc, tbinfo, get_specified_duts(request))
+    duts = get_specified_duts(request)
+    if request.config.getoption("--facts_cache_versioning"):
+        set_facts_cache_versions(ansible_adhoc, duts)
+    duthosts = DutHosts(ansible_adhoc, tbinfo, duts)
+    if request.config.getoption("--ssh_fast_path"):
+        for node in duthosts:
+            dut_creds = creds_on_dut(node)
+            node.sonichost.enable_fast_path(dut_creds["sonicadmin_user"], dut_creds["sonicadmin_password"])
+    return duthosts
+
+
+def set_facts_cache_versions(ansible_adhoc, duts):
+    """
+    @summary: Use checksum of DUT image version file and config_db.json as version of DUT zone in the facts cache,
+        so facts cached before image upgrade or config change are not used.
+    """
+    cmd = "cat /etc/sonic/sonic_version.yml /etc/sonic/config_db.json | md5sum"
+    results = ansible_adhoc(become=True)[":".join(duts)].shell(cmd)
+    for dut in duts:
+        res = results[dut]
+        if res.is_failed:
+            logger.warning("Failed to get facts cache version of {}: {}".format(dut, res.get("stderr")))
+            continue
+        cache.set_zone_version(dut, res["stdout"].split()[0])
 
 
 @pytest.fixture(scope="session")
@@ -496,6 +535,11 @@ def creds_all_duts(duthosts):
     return creds_all_duts
 
 
+def pytest_sessionfinish(session, exitstatus):
+    logger.info("Facts cache statistics: {}".format(cache.get_stats()))
+    logger.info("Module call latency per host: {}".format(json.dumps(get_latency_report(), indent=2, sort_keys=True)))
+
+
 @pytest.hookimpl(tryfirst=True, hookwrapper=True)
 def pytest_runtest_makereport(item, call):
 
@@ -0,0 +1,13 @@
+# FIB pytest arguments
+def pytest_addoption(parser):
+
+    fib_group = parser.getgroup("FIB test suite options")
+
+    fib_group.addoption(
+        "--fib_batch_size",
+        action="store",
+        default=0,
+        type=int,
+        help="Send the packets of the FIB and hash tests in batches of this size, 0 to send them one at a time. "
+             "The PTF tests cap it at the PTF queue length",
+    )
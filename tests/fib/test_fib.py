@@ -365,8 +365,14 @@ def single_fib_for_duts(tbinfo):
         return True
     return False
 
+@pytest.fixture(scope="module")
+def batch_size(request):
+    # Packets sent and verified by the PTF test at once, 0 for one at a time
+    return request.config.getoption("fib_batch_size")
+
+
 @pytest.mark.parametrize("ipv4, ipv6, mtu", [pytest.param(True, True, 1514)])
-def test_basic_fib(duthosts, ptfhost, ipv4, ipv6, mtu, fib_info_files, router_macs, set_mux_random, ptf_test_port_map, ignore_ttl, single_fib_for_duts):
+def test_basic_fib(duthosts, ptfhost, ipv4, ipv6, mtu, fib_info_files, router_macs, set_mux_random, ptf_test_port_map, ignore_ttl, single_fib_for_duts, batch_size):
     timestamp = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
 
     # do not test load balancing for vs platform as kernel 4.9
@@ -391,7 +397,8 @@ def test_basic_fib(duthosts, ptfhost, ipv4, ipv6, mtu, fib_info_files, router_ma
                         "testbed_mtu": mtu,
                         "test_balancing": test_balancing,
                         "ignore_ttl": ignore_ttl,
-                        "single_fib_for_duts": single_fib_for_duts},
+                        "single_fib_for_duts": single_fib_for_duts,
+                        "batch_size": batch_size},
                 log_file=log_file,
                 qlen=PTF_QLEN,
                 socket_recv_size=16384)
@@ -496,7 +503,7 @@ def ipver(request):
     return request.param
 
 
-def test_hash(fib_info_files, setup_vlan, hash_keys, ptfhost, ipver, router_macs, set_mux_same_side, ptf_test_port_map, ignore_ttl, single_fib_for_duts):
+def test_hash(fib_info_files, setup_vlan, hash_keys, ptfhost, ipver, router_macs, set_mux_same_side, ptf_test_port_map, ignore_ttl, single_fib_for_duts, batch_size):
     timestamp = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
     log_file = "/tmp/hash_test.HashTest.{}.{}.log".format(ipver, timestamp)
     logging.info("PTF log file: %s" % log_file)
@@ -519,7 +526,8 @@ def test_hash(fib_info_files, setup_vlan, hash_keys, ptfhost, ipver, router_macs
                     "router_macs": router_macs,
                     "vlan_ids": VLANIDS,
                     "ignore_ttl":ignore_ttl,
-                    "single_fib_for_duts": single_fib_for_duts
+                    "single_fib_for_duts": single_fib_for_duts,
+                    "batch_size": batch_size
                    },
             log_file=log_file,
             qlen=PTF_QLEN,